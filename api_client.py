@@ -1,26 +1,252 @@
 # api_client.py
 # Module for interacting with Blitz VPN API
 
-import requests
+import asyncio
+import random
+import threading
+import time
+import httpx
 import logging
-from config import BLITZ_API_BASE_URL, BLITZ_API_USERNAME, BLITZ_API_PASSWORD
+from collections import OrderedDict
+from config import (BLITZ_API_BASE_URL, BLITZ_API_USERNAME, BLITZ_API_PASSWORD, BLITZ_API_TIMEOUT,
+                    BLITZ_API_MAX_CONNECTIONS, BLITZ_API_MAX_KEEPALIVE, BLITZ_CACHE_MAX_ENTRIES,
+                    BLITZ_CACHE_TTL_USER, BLITZ_CACHE_TTL_URI, BLITZ_CACHE_TTL_STATUS, BLITZ_BREAKER_FAILURES,
+                    BLITZ_BREAKER_RESET, BLITZ_API_RETRIES, BLITZ_API_RETRY_BACKOFF, BLITZ_API_RETRY_BUDGET,
+                    BLITZ_PAYLOAD_LOG_SAMPLE, BLITZ_PANEL_NODES, BLITZ_HEALTH_INTERVAL, BLITZ_PLACEMENT_COST)
+from circuit_breaker import CircuitBreaker
+from metrics import PANEL_LATENCY
+from ratelimit import RetryBudget
 
 logger = logging.getLogger(__name__)
 
-class BlitzAPIClient:
-    def __init__(self):
-        self.base_url = BLITZ_API_BASE_URL.rstrip('/')  # Remove trailing slash
-        self.username = BLITZ_API_USERNAME
-        self.password = BLITZ_API_PASSWORD
+# Imported by the first BlitzAPIClient: the bot itself only uses httpx, and
+# requests adds noticeably to cold start
+requests = None
+
+class BlitzAPIError(Exception):
+    """Error returned by the Blitz panel or raised while talking to it."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class UserAlreadyExistsError(BlitzAPIError):
+    """The panel already has a user with the requested username (HTTP 409)."""
+
+class CircuitOpenError(BlitzAPIError):
+    """Rejected without contacting the panel because its endpoints are failing."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# Statuses worth retrying for idempotent requests
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Statuses meaning the panel session is missing or has expired
+AUTH_STATUSES = frozenset({401, 403})
+
+def _endpoint_family(path):
+    """Circuit breaker group of a panel path: endpoints that fail together."""
+    if path.startswith('/api/v1/users'):
+        return 'users'
+    if path.startswith('/api/v1/server'):
+        return 'server'
+    return 'auth'
+
+def _endpoint_label(path):
+    """Path template used as a metrics label, e.g. '/api/v1/users/{username}/uri'."""
+    prefix = '/api/v1/users/'
+    if path.startswith(prefix) and len(path) > len(prefix):
+        _, _, rest = path[len(prefix):].partition('/')
+        return prefix + '{username}' + (f'/{rest}' if rest else '')
+    return path
+
+def _observe_request(method, path, status, elapsed):
+    """Record one attempt; status is the HTTP code or 'timeout'/'error' when there was no response."""
+    PANEL_LATENCY.labels(method, _endpoint_label(path), str(status)).observe(elapsed)
+
+def _sample_payload():
+    """True for the share of requests (BLITZ_PAYLOAD_LOG_SAMPLE) whose bodies are logged."""
+    return BLITZ_PAYLOAD_LOG_SAMPLE > 0 and random.random() < BLITZ_PAYLOAD_LOG_SAMPLE
+
+def _redacted(data):
+    return dict(data, password='***') if 'password' in data else data
+
+# Outcome of a call attempt: log in again and replay the request
+_RELOGIN = object()
+
+class _PanelCall:
+    """Breaker, retry and re-login decisions for one request across its attempts.
+
+    The clients only send: each attempt is login_due() -> send() -> the transport
+    call -> outcome(), which returns _RELOGIN, a delay before the next attempt, or
+    None once the response is final (a final error is raised instead).
+    """
+
+    def __init__(self, panel, method, path, authenticate=True, deadline=None):
+        self.panel = panel
+        self.method = method
+        self.path = path
+        self.authenticate = authenticate
+        self.deadline = deadline
+        self.breaker = panel._breaker(path)
+        self.replayed = not authenticate
+        self.attempt = 0
+        self.admitted = False
+        self.started = time.monotonic()
+        self.generation = None
+        self.sent_at = None
+
+    def login_due(self):
+        """Check the circuit before an attempt. Returns whether to log in before sending."""
+        # Checked first, so an open circuit fails fast without waiting for a login
+        self.panel._admit(self.breaker)
+        if not self.admitted:
+            # Only requests that reach the panel earn retry budget
+            self.panel.retry_budget.deposit()
+            self.admitted = True
+        return self.authenticate and self.panel._login_due()
+
+    def send(self):
+        """Mark the attempt as sent with the current session."""
+        self.generation = self.panel._auth_generation
+        self.sent_at = time.perf_counter()
+
+    def remaining(self):
+        """Seconds left of the deadline shared by all attempts, or None without one."""
+        if self.deadline is None:
+            return None
+        return self.deadline - (time.monotonic() - self.started)
+
+    def outcome(self, response=None, error=None, status=None):
+        """Record the attempt; status is 'timeout' or 'error' when there was no response."""
+        if error is None:
+            status = response.status_code
+        _observe_request(self.method, self.path, status, time.perf_counter() - self.sent_at)
+        if error is not None or response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if error is None and response.status_code in AUTH_STATUSES and not self.replayed:
+            logger.info("Panel rejected the session (%s), logging in again", response.status_code)
+            self.replayed = True
+            return _RELOGIN
+        if error is None and response.status_code not in RETRY_STATUSES:
+            return None
+        delay = self.panel._retry_delay(self.method, self.attempt, self.remaining())
+        if delay is None:
+            if error is not None:
+                raise error
+            return None
+        self.attempt += 1
+        return delay
+
+class _PanelResilience:
+    """Per-endpoint-family circuit breakers and the GET retry policy shared by both clients."""
+
+    def _init_resilience(self, retries=None, retry_backoff=None):
+        self.breakers = {}
+        self.retries = BLITZ_API_RETRIES if retries is None else retries
+        self.retry_backoff = BLITZ_API_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self.retry_budget = RetryBudget(BLITZ_API_RETRY_BUDGET)
+        self._login_failed_at = None
+
+    def _call(self, method, path, authenticate=True, deadline=None):
+        """Decision state for one request; the client only runs the transport call."""
+        return _PanelCall(self, method, path, authenticate, deadline)
+
+    def _breaker(self, path):
+        family = _endpoint_family(path)
+        breaker = self.breakers.get(family)
+        if breaker is None:
+            breaker = self.breakers[family] = CircuitBreaker(family, BLITZ_BREAKER_FAILURES, BLITZ_BREAKER_RESET)
+        return breaker
+
+    def _admit(self, breaker):
+        """Raise CircuitOpenError instead of sending while the family's circuit is open."""
+        if not breaker.allow():
+            retry_after = breaker.retry_after()
+            raise CircuitOpenError(f"Panel {breaker.name} endpoints are unavailable, retry in {retry_after:.0f}s",
+                                   retry_after)
+
+    def _retry_delay(self, method, attempt, remaining=None):
+        """Full-jitter backoff before the next attempt, or None if the request must not be retried."""
+        if method != 'GET' or attempt >= self.retries:
+            return None
+        delay = random.uniform(0, self.retry_backoff * 2 ** attempt)
+        if remaining is not None and delay >= remaining:
+            return None
+        if not self.retry_budget.try_spend():
+            return None
+        return delay
+
+    def _login_due(self):
+        """Whether a request should log in first.
+
+        Not while the login circuit is open or within its reset timeout of a failed
+        login: during an outage requests go out with basic auth instead of each
+        sending its own login, and a 401 still triggers one.
+        """
+        if self._logged_in:
+            return False
+        breaker = self._breaker('/login')
+        if self._login_failed_at is not None and time.monotonic() - self._login_failed_at < breaker.reset_timeout:
+            return False
+        return self.is_available('auth')
+
+    def _basic_auth(self):
+        """Basic auth credentials, or None if no panel credentials are configured."""
+        return (self.username, self.password or '') if self.username else None
+
+    def _on_login_response(self, status_code, http):
+        """Switch `http` to session cookies or basic auth. Returns False if login must be retried later."""
+        logger.info("Login response status: %s", status_code)
+        if status_code == 200:
+            # Session cookies are kept by the HTTP client
+            logger.info("Login successful - session cookies stored")
+            http.auth = None
+            return True
+        logger.warning("Login endpoint returned %s, trying basic auth", status_code)
+        http.auth = self._basic_auth()
+        # A 5xx means the panel is down rather than lacking a login endpoint
+        return status_code < 500
+
+    def is_available(self, family='users'):
+        """False while the family's circuit is open, so handlers can warn the user up front."""
+        breaker = self.breakers.get(family)
+        return breaker is None or breaker.state != 'open' or breaker.retry_after() == 0
+
+    def breaker_stats(self):
+        """State and counters of every endpoint family's breaker, plus retry budget usage."""
+        stats = {name: dict(b.stats, state=b.state) for name, b in self.breakers.items()}
+        stats['retries'] = {'spent': self.retry_budget.spent, 'denied': self.retry_budget.denied}
+        return stats
+
+class BlitzAPIClient(_PanelResilience):
+    def __init__(self, base_url=None, username=None, password=None):
+        global requests
+        if requests is None:
+            import requests
+        self.base_url = (base_url or BLITZ_API_BASE_URL or '').rstrip('/')  # Remove trailing slash
+        self.username = username or BLITZ_API_USERNAME
+        self.password = password or BLITZ_API_PASSWORD
         self.session = requests.Session()
+        self._init_resilience()
         self.token = None
-        self.login()
+        # Login happens on the first request, not at import time
+        self._logged_in = False
+        self._auth_generation = 0
+        self._auth_lock = threading.Lock()
 
     def login(self):
-        """Authenticate with the API."""
+        """Authenticate with the API.
+
+        Runs lazily before the first request and again whenever the panel
+        rejects the session.
+        """
         try:
             # Try to login and get authentication token
-            logger.info(f"Attempting login with username: {self.username}")
+            logger.info("Attempting login with username: %s", self.username)
             
             # Method 1: Try token-based auth (if API provides one)
             login_url = f"{self.base_url}/login"
@@ -29,22 +255,30 @@ class BlitzAPIClient:
                 "password": self.password
             }
             
-            response = self.session.post(login_url, data=login_data, timeout=10)
-            logger.info(f"Login response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                # Store session cookies for future requests
-                logger.info("Login successful - session cookies stored")
-                return
-            
-            # Method 2: Try basic auth if login endpoint fails
-            logger.warning(f"Login endpoint returned {response.status_code}, trying basic auth")
-            self.session.auth = (self.username, self.password)
-            
+            response = self._send('POST', login_url, authenticate=False, data=login_data, timeout=10)
         except Exception as e:
-            logger.warning(f"Login failed: {e}, will try basic auth")
-            # Fallback to basic auth
-            self.session.auth = (self.username, self.password)
+            # Panel unreachable: use basic auth for now and try the login endpoint again on the next request
+            logger.warning("Login failed: %s, will try basic auth", e)
+            self.session.auth = self._basic_auth()
+            self._logged_in = False
+        else:
+            # Method 2: Try basic auth if login endpoint fails
+            self._logged_in = self._on_login_response(response.status_code, self.session)
+        self._login_failed_at = None if self._logged_in else time.monotonic()
+        self._auth_generation += 1
+
+    def _ensure_login(self):
+        # Callers queued behind a failed attempt don't retry it one after another
+        generation = self._auth_generation
+        with self._auth_lock:
+            if not self._logged_in and self._auth_generation == generation:
+                self.login()
+
+    def _relogin(self, generation):
+        """Log in again unless another caller already did since `generation`."""
+        with self._auth_lock:
+            if self._auth_generation == generation:
+                self.login()
 
     def create_user(self, username, password, traffic_limit, expiration_days, unlimited=False, note=""):
         """Create a new user via API.
@@ -83,66 +317,609 @@ class BlitzAPIClient:
         # data["creation_date"] = datetime.now().isoformat()
         
         try:
-            logger.info(f"Creating user {username} with URL: {url}")
-            logger.info(f"Request data: {data}")
-            response = self.session.post(url, json=data, timeout=10, verify=False)
-            logger.info(f"API response status: {response.status_code}, body: {response.text}")
+            logger.info("Creating user %s", username)
+            sampled = _sample_payload()
+            if sampled:
+                logger.info("Request data: %s", _redacted(data))
+            response = self._send('POST', url, json=data, timeout=10, verify=False)
+            if sampled:
+                logger.info("API response status: %s, body: %s", response.status_code, response.text)
             
             # Handle specific error codes
             if response.status_code == 409:
                 error_data = response.json()
                 error_msg = error_data.get('detail', 'User already exists')
-                logger.error(f"User already exists: {error_msg}")
-                raise Exception(f"User already exists: {error_msg}")
+                logger.error("User already exists: %s", error_msg)
+                raise UserAlreadyExistsError(f"User already exists: {error_msg}", 409)
             elif response.status_code == 422:
                 try:
                     error_data = response.json()
-                    logger.error(f"Validation error details: {error_data}")
+                    logger.error("Validation error details: %s", error_data)
                     if 'detail' in error_data:
-                        raise Exception(f"API Validation Error: {error_data['detail']}")
+                        raise BlitzAPIError(f"API Validation Error: {error_data['detail']}", 422)
                 except:
                     pass
             
             response.raise_for_status()  # Raise exception for bad status codes
             return response.json()
         except requests.exceptions.RequestException as e:
-            logger.error(f"API request failed: {e}")
-            raise Exception(f"API request failed: {e}")
+            logger.error("API request failed: %s", e)
+            raise BlitzAPIError(f"API request failed: {e}", _status_of(e))
 
     def get_user_uri(self, username):
         """Get user URI."""
         url = f"{self.base_url}/api/v1/users/{username}/uri"
         try:
-            response = self.session.get(url, timeout=10, verify=False)
-            logger.info(f"Get URI response status: {response.status_code}, body: {response.text}")
+            response = self._send('GET', url, timeout=10, verify=False)
+            if _sample_payload():
+                logger.info("Get URI response status: %s, body: %s", response.status_code, response.text)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to get user URI: {e}")
-            raise Exception(f"Failed to get user URI: {e}")
+            logger.error("Failed to get user URI: %s", e)
+            raise BlitzAPIError(f"Failed to get user URI: {e}", _status_of(e))
     
     def get_user(self, username):
         """Get user details."""
         url = f"{self.base_url}/api/v1/users/{username}"
         try:
-            response = self.session.get(url, timeout=10, verify=False)
-            logger.info(f"Get user response status: {response.status_code}, body: {response.text}")
+            response = self._send('GET', url, timeout=10, verify=False)
+            if _sample_payload():
+                logger.info("Get user response status: %s, body: %s", response.status_code, response.text)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to get user details: {e}")
-            raise Exception(f"Failed to get user details: {e}")
+            logger.error("Failed to get user details: %s", e)
+            raise BlitzAPIError(f"Failed to get user details: {e}", _status_of(e))
 
     def get_server_status(self):
         """Get server status."""
         url = f"{self.base_url}/api/v1/server/status"
         try:
-            response = self.session.get(url, timeout=10, verify=False)
+            response = self._send('GET', url, timeout=10, verify=False)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to get server status: {e}")
-            raise Exception(f"Failed to get server status: {e}")
+            logger.error("Failed to get server status: %s", e)
+            raise BlitzAPIError(f"Failed to get server status: {e}", _status_of(e))
+
+    def _send(self, method, url, authenticate=True, **kwargs):
+        """Send a request through the endpoint family's circuit breaker, retrying idempotent GETs.
+
+        A request rejected with 401/403 is replayed once after a fresh login.
+        """
+        call = self._call(method, url[len(self.base_url):], authenticate)
+        while True:
+            if call.login_due():
+                self._ensure_login()
+            call.send()
+            error = response = status = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.Timeout as e:
+                error, status = e, 'timeout'
+            except requests.exceptions.ConnectionError as e:
+                error, status = e, 'error'
+            step = call.outcome(response, error, status)
+            if step is _RELOGIN:
+                self._relogin(call.generation)
+            elif step is not None:
+                time.sleep(step)
+            else:
+                return response
+
+def _status_of(error):
+    """HTTP status code carried by a requests/httpx error, if any."""
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+def _build_user_payload(username, password, traffic_limit, expiration_days, unlimited, note):
+    """Build the create-user request body according to API documentation."""
+    data = {
+        "username": username,
+        "password": password,
+        "expiration_days": int(expiration_days),
+        "unlimited": bool(unlimited),
+        "note": note
+    }
+    # Don't include traffic_limit for unlimited users
+    if not unlimited:
+        data["traffic_limit"] = int(traffic_limit) if traffic_limit and traffic_limit > 0 else 0
+    return data
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a per-entry TTL."""
+
+    def __init__(self, max_entries=BLITZ_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'invalidations': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return (True, value) for a fresh entry, (False, None) otherwise."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                return True, value
+            del self._entries[key]
+        return False, None
+
+    def set(self, key, value, ttl):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def invalidate(self, key):
+        if self._entries.pop(key, None) is not None:
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+class AsyncBlitzAPIClient(_PanelResilience):
+    """Asyncio-native Blitz API client with the same method surface as BlitzAPIClient.
+
+    Requests share a bounded pool of keep-alive connections, and every call is
+    capped by a per-request deadline, so a slow panel never blocks the event loop.
+    """
+
+    def __init__(self, base_url=None, username=None, password=None, timeout=None,
+                 max_connections=None, max_keepalive=None):
+        self.base_url = (base_url or BLITZ_API_BASE_URL or '').rstrip('/')
+        self.username = username or BLITZ_API_USERNAME
+        self.password = password or BLITZ_API_PASSWORD
+        self.timeout = timeout or BLITZ_API_TIMEOUT
+        self.limits = httpx.Limits(
+            max_connections=max_connections or BLITZ_API_MAX_CONNECTIONS,
+            max_keepalive_connections=max_keepalive or BLITZ_API_MAX_KEEPALIVE,
+            keepalive_expiry=30.0,
+        )
+        self._client = None
+        # Read endpoints are cached per endpoint TTL; 0 disables caching for an endpoint
+        self.cache = TTLCache()
+        self.cache_ttls = {'user': BLITZ_CACHE_TTL_USER, 'uri': BLITZ_CACHE_TTL_URI, 'status': BLITZ_CACHE_TTL_STATUS}
+        self._inflight = {}
+        self._init_resilience()
+        # Login happens on the first request
+        self._logged_in = False
+        self._auth_generation = 0
+        self._auth_lock = asyncio.Lock()
+
+    @property
+    def client(self):
+        """The underlying pooled httpx client, created on first use."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=httpx.Timeout(self.timeout), verify=False)
+        return self._client
+
+    async def aclose(self):
+        """Close pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def login(self):
+        """Authenticate with the API.
+
+        Runs lazily before the first request and again whenever the panel
+        rejects the session.
+        """
+        try:
+            logger.info("Attempting login with username: %s", self.username)
+            response = await self._request('POST', '/login', authenticate=False, data={
+                "username": self.username,
+                "password": self.password
+            })
+        except Exception as e:
+            # Panel unreachable: use basic auth for now and try the login endpoint again on the next request
+            logger.warning("Login failed: %s, will try basic auth", e)
+            self.client.auth = self._basic_auth()
+            self._logged_in = False
+        else:
+            self._logged_in = self._on_login_response(response.status_code, self.client)
+        self._login_failed_at = None if self._logged_in else time.monotonic()
+        self._auth_generation += 1
+
+    async def _ensure_login(self):
+        # Callers queued behind a failed attempt don't retry it one after another
+        generation = self._auth_generation
+        async with self._auth_lock:
+            if not self._logged_in and self._auth_generation == generation:
+                await self.login()
+
+    async def _relogin(self, generation):
+        """Log in again unless another caller already did since `generation`."""
+        async with self._auth_lock:
+            if self._auth_generation == generation:
+                await self.login()
+
+    def cache_stats(self):
+        """Cache hit/miss counters, to see how many panel round trips are saved."""
+        return dict(self.cache.stats, size=len(self.cache), inflight=len(self._inflight))
+
+    def invalidate_user(self, username):
+        """Drop cached lookups for a panel user, including ones still in flight."""
+        for key in (('user', username), ('uri', username)):
+            self.cache.invalidate(key)
+            self._inflight.pop(key, None)
+
+    async def _cached(self, key, fetch, cacheable=None):
+        """Serve key from the cache, or run fetch() once for all concurrent callers (single-flight)."""
+        ttl = self.cache_ttls.get(key[0], 0)
+        if ttl <= 0:
+            return await fetch()
+
+        hit, value = self.cache.get(key)
+        if hit:
+            self.cache.stats['hits'] += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.cache.stats['coalesced'] += 1
+        else:
+            self.cache.stats['misses'] += 1
+            async def load():
+                value = await fetch()
+                # Skip the store if the key was invalidated while the request was in flight
+                if self._inflight.get(key) is task and (cacheable is None or cacheable(value)):
+                    self.cache.set(key, value, ttl)
+                return value
+
+            task = asyncio.ensure_future(load())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget_inflight(key, done))
+        # Shield so one cancelled caller doesn't cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    def _forget_inflight(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every waiter went away
+
+    async def _request(self, method, path, deadline=None, authenticate=True, **kwargs):
+        """Send a request through the endpoint family's circuit breaker.
+
+        Idempotent GETs are retried with jittered backoff while the retry budget
+        allows, and a request rejected with 401/403 is replayed once after a
+        fresh login. The deadline bounds all attempts together, on top of
+        httpx's per-phase timeouts.
+        """
+        url = f"{self.base_url}{path}"
+        deadline = deadline or self.timeout
+        call = self._call(method, path, authenticate, deadline)
+        while True:
+            if call.login_due():
+                await self._ensure_login()
+            call.send()
+            error = response = status = None
+            try:
+                response = await asyncio.wait_for(self.client.request(method, url, **kwargs), call.remaining())
+            except asyncio.TimeoutError:
+                error, status = httpx.TimeoutException(f"Request to {url} exceeded deadline of {deadline}s"), 'timeout'
+            except httpx.TimeoutException as e:
+                error, status = e, 'timeout'
+            except httpx.TransportError as e:
+                error, status = e, 'error'
+            step = call.outcome(response, error, status)
+            if step is _RELOGIN:
+                await self._relogin(call.generation)
+            elif step is not None:
+                await asyncio.sleep(step)
+            else:
+                return response
+
+    async def create_user(self, username, password, traffic_limit, expiration_days, unlimited=False, note="",
+                          deadline=None):
+        """Create a new user via API.
+
+        Args:
+            username: Username for the new user
+            password: Password for the new user
+            traffic_limit: Traffic limit in bytes (0 if unlimited)
+            expiration_days: Days until expiration
+            unlimited: If True, user has unlimited traffic
+            note: Optional note for the user
+            deadline: Overall request deadline in seconds (defaults to BLITZ_API_TIMEOUT)
+        """
+        data = _build_user_payload(username, password, traffic_limit, expiration_days, unlimited, note)
+        try:
+            logger.info("Creating user %s", username)
+            sampled = _sample_payload()
+            if sampled:
+                logger.info("Request data: %s", _redacted(data))
+            response = await self._request('POST', '/api/v1/users/', deadline, json=data)
+            if sampled:
+                logger.info("API response status: %s, body: %s", response.status_code, response.text)
+
+            if response.status_code == 409:
+                error_msg = response.json().get('detail', 'User already exists')
+                logger.error("User already exists: %s", error_msg)
+                raise UserAlreadyExistsError(f"User already exists: {error_msg}", 409)
+            if response.status_code == 422:
+                try:
+                    error_data = response.json()
+                except ValueError:
+                    error_data = {}
+                logger.error("Validation error details: %s", error_data)
+                if 'detail' in error_data:
+                    raise BlitzAPIError(f"API Validation Error: {error_data['detail']}", 422)
+
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error("API request failed: %s", e)
+            raise BlitzAPIError(f"API request failed: {e}", _status_of(e))
+        finally:
+            self.invalidate_user(username)
+
+    async def edit_user(self, username, expiration_days=None, traffic_limit=None, unlimited=None,
+                        renew_creation_date=False, renew_traffic=False, deadline=None):
+        """Edit a user via API.
+
+        The panel counts expiration_days from the account creation date, so a renewal
+        passes renew_creation_date=True and the days left from today.
+        """
+        data = {}
+        if expiration_days is not None:
+            data["new_expiration_days"] = int(expiration_days)
+        if traffic_limit is not None:
+            data["new_traffic_limit"] = int(traffic_limit)
+        if unlimited is not None:
+            data["unlimited_ip"] = bool(unlimited)
+        if renew_creation_date:
+            data["renew_creation_date"] = True
+        if renew_traffic:
+            data["renew_traffic"] = True
+        try:
+            logger.info("Editing user %s", username)
+            response = await self._request('PATCH', f'/api/v1/users/{username}', deadline, json=data)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error("Failed to edit user: %s", e)
+            raise BlitzAPIError(f"Failed to edit user: {e}", _status_of(e))
+        finally:
+            self.invalidate_user(username)
+
+    async def delete_user(self, username, deadline=None):
+        """Delete a user via API. A user the panel does not know counts as deleted."""
+        try:
+            logger.info("Deleting user %s", username)
+            response = await self._request('DELETE', f'/api/v1/users/{username}', deadline)
+            if response.status_code == 404:
+                return
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.error("Failed to delete user: %s", e)
+            raise BlitzAPIError(f"Failed to delete user: {e}", _status_of(e))
+        finally:
+            self.invalidate_user(username)
+
+    async def get_user_uri(self, username, deadline=None):
+        """Get user URI."""
+        # Keys can be generated with a delay, so only complete responses are cached
+        return await self._cached(('uri', username), lambda: self._fetch_user_uri(username, deadline),
+                                  cacheable=lambda uri: bool(uri.get('ipv4')))
+
+    async def get_user(self, username, deadline=None, fresh=False):
+        """Get user details. fresh=True bypasses the cache (used by bulk jobs)."""
+        if fresh:
+            return await self._fetch_user(username, deadline)
+        return await self._cached(('user', username), lambda: self._fetch_user(username, deadline))
+
+    async def get_server_status(self, deadline=None, fresh=False):
+        """Get server status. fresh=True bypasses the cache (used by health checks)."""
+        if fresh:
+            return await self._fetch_server_status(deadline)
+        return await self._cached(('status',), lambda: self._fetch_server_status(deadline))
+
+    async def _fetch_user_uri(self, username, deadline=None):
+        try:
+            response = await self._request('GET', f'/api/v1/users/{username}/uri', deadline)
+            if _sample_payload():
+                logger.info("Get URI response status: %s, body: %s", response.status_code, response.text)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error("Failed to get user URI: %s", e)
+            raise BlitzAPIError(f"Failed to get user URI: {e}", _status_of(e))
+
+    async def _fetch_user(self, username, deadline=None):
+        try:
+            response = await self._request('GET', f'/api/v1/users/{username}', deadline)
+            if _sample_payload():
+                logger.info("Get user response status: %s, body: %s", response.status_code, response.text)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error("Failed to get user details: %s", e)
+            raise BlitzAPIError(f"Failed to get user details: {e}", _status_of(e))
+
+    async def _fetch_server_status(self, deadline=None):
+        try:
+            response = await self._request('GET', '/api/v1/server/status', deadline)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error("Failed to get server status: %s", e)
+            raise BlitzAPIError(f"Failed to get server status: {e}", _status_of(e))
+
+def _percent(value):
+    """Parse a panel usage figure like "42.5%" into a float, or None if it is missing."""
+    try:
+        return float(str(value).strip().rstrip('%'))
+    except (TypeError, ValueError):
+        return None
+
+class PanelNode:
+    """One panel of the pool with the result of its last health check."""
+
+    def __init__(self, name, client, max_users=0):
+        self.name = name
+        self.client = client
+        self.max_users = max_users
+        self.status = None
+        self.healthy = False
+        self.error = None
+        self.checked_at = None
+        # Users placed here since the last check, not yet reflected in its status
+        self.placed = 0
+
+    def headroom(self, placement_cost=BLITZ_PLACEMENT_COST):
+        """Free capacity in percent: the scarcest of CPU, RAM and (with max_users) online user slots."""
+        if self.status is None:
+            return 0.0
+        free = [100 - usage for usage in (_percent(self.status.get('cpu_usage')),
+                                          _percent(self.status.get('ram_usage'))) if usage is not None]
+        online = self.online_users()
+        if self.max_users:
+            free.append(100 * (1 - (online + self.placed) / self.max_users))
+        return (min(free) if free else 100.0) - self.placed * placement_cost
+
+    def online_users(self):
+        if self.status is None:
+            return 0
+        try:
+            return int(self.status.get('online_users') or 0)
+        except (TypeError, ValueError):
+            return 0
+
+class PanelPool:
+    """Set of Blitz panels: routes calls to a subscription's node and places new users.
+
+    Every `interval` seconds each node's server status is fetched. New users go to the
+    healthy node with the most headroom (see PanelNode.headroom), fewer online users
+    breaking ties; nodes whose last check failed or whose user endpoints have an open
+    circuit are skipped. Rows that predate node tracking (node None) use the first node.
+    """
+
+    def __init__(self, nodes, interval=BLITZ_HEALTH_INTERVAL, placement_cost=BLITZ_PLACEMENT_COST):
+        """nodes: PanelNode instances, or a mapping of name to client."""
+        if isinstance(nodes, dict):
+            nodes = [PanelNode(name, client) for name, client in nodes.items()]
+        self.nodes = {node.name: node for node in nodes}
+        self.default = next(iter(self.nodes))
+        self.interval = interval
+        self.placement_cost = placement_cost
+        self._task = None
+        self._wakeup = None
+        self._stopping = False
+
+    @classmethod
+    def from_config(cls, nodes=BLITZ_PANEL_NODES):
+        return cls([PanelNode(node['name'], AsyncBlitzAPIClient(node['url'], node['username'], node['password']),
+                              node['max_users'])
+                    for node in nodes])
+
+    def client(self, node=None):
+        """Client of a node; None means the first node."""
+        try:
+            return self.nodes[node or self.default].client
+        except KeyError:
+            raise BlitzAPIError(f"Unknown panel node: {node}")
+
+    def choose(self):
+        """Name of the node a new user should be created on. Counts the placement against it."""
+        candidates = [node for node in self.nodes.values() if node.healthy and node.client.is_available('users')]
+        if not candidates:
+            raise BlitzAPIError("No panel node is available")
+        node = max(candidates, key=lambda node: (node.headroom(self.placement_cost),
+                                                 -(node.online_users() + node.placed)))
+        node.placed += 1
+        return node.name
+
+    def is_available(self, family='users', node=None):
+        """True if the node, or without one at least one healthy node, accepts requests of the family."""
+        nodes = [self.nodes[node]] if node in self.nodes else self.nodes.values()
+        return any(node.healthy and node.client.is_available(family) for node in nodes)
+
+    async def check_health(self):
+        """Fetch every node's server status concurrently."""
+        await asyncio.gather(*(self._check(node) for node in self.nodes.values()))
+
+    async def _check(self, node):
+        try:
+            status = await node.client.get_server_status(fresh=True)
+        except Exception as e:
+            if node.healthy:
+                logger.warning("Panel node %s failed its health check: %s", node.name, e, extra={'node': node.name})
+            node.healthy, node.error = False, str(e)
+        else:
+            if not node.healthy and node.checked_at is not None:
+                logger.info("Panel node %s is healthy again", node.name, extra={'node': node.name})
+            node.status, node.healthy, node.error, node.placed = status, True, None, 0
+        node.checked_at = time.time()
+
+    async def start(self):
+        """Check every node once, then keep checking in the background."""
+        await self.check_health()
+        if self.interval > 0:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                break
+            try:
+                await self.check_health()
+            except Exception:
+                logger.exception("Panel health check failed")
+
+    def stats(self):
+        """Per-node health, last reported load and headroom, in configuration order."""
+        return [{
+            'name': node.name,
+            'healthy': node.healthy,
+            'error': node.error,
+            'online_users': node.status.get('online_users', 'N/A') if node.status else 'N/A',
+            'cpu_usage': node.status.get('cpu_usage', 'N/A') if node.status else 'N/A',
+            'ram_usage': node.status.get('ram_usage', 'N/A') if node.status else 'N/A',
+            'headroom': node.headroom(self.placement_cost),
+            'placed': node.placed,
+        } for node in self.nodes.values()]
+
+    def cache_stats(self):
+        """Cache counters summed over all nodes."""
+        total = {}
+        for node in self.nodes.values():
+            for key, value in node.client.cache_stats().items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+    async def aclose(self):
+        await asyncio.gather(*(node.client.aclose() for node in self.nodes.values()))
+
+# Global client instances. The blocking client is only used by scripts, so it
+# is created on first access (`from api_client import api_client`).
+panel_pool = PanelPool.from_config()
+# Client of the first node, for code that talks to a single panel
+async_api_client = panel_pool.client()
 
-# Global client instance
-api_client = BlitzAPIClient()
\ No newline at end of file
+def __getattr__(name):
+    global api_client
+    if name == 'api_client':
+        api_client = BlitzAPIClient()
+        return api_client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,201 @@
+# async_database.py
+# Awaitable database facade that keeps SQLite I/O off the asyncio thread
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import DATABASE_FILE, DATABASE_READER_THREADS
+from database import Database
+from metrics import DB_LATENCY
+
+class AsyncDatabase:
+    """Runs Database operations on a dedicated writer thread and a small reader pool.
+
+    Every thread owns its own connection. Writes are serialized on the single
+    writer thread, while reads run concurrently thanks to WAL mode.
+    """
+
+    def __init__(self, path=DATABASE_FILE, readers=DATABASE_READER_THREADS):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer',
+                                          initializer=self._open, initargs=(False,))
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader',
+                                           initializer=self._open, initargs=(True,))
+
+    def _open(self, read_only):
+        """Open the calling thread's connection."""
+        self._local.db = Database(self.path, read_only=read_only)
+        with self._connections_lock:
+            self._connections.append(self._local.db)
+
+    def _call(self, method, args):
+        started = time.perf_counter()
+        try:
+            return getattr(self._local.db, method)(*args)
+        finally:
+            DB_LATENCY.labels(method).observe(time.perf_counter() - started)
+
+    def _call_func(self, func, args):
+        started = time.perf_counter()
+        try:
+            return func(self._local.db, *args)
+        finally:
+            DB_LATENCY.labels(func.__name__).observe(time.perf_counter() - started)
+
+    def queue_depths(self):
+        """Operations waiting for a free database thread, for the writer and the reader pool."""
+        return {'writer': self._writer._work_queue.qsize(), 'readers': self._readers._work_queue.qsize()}
+
+    async def _read(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._readers, self._call, method, args)
+
+    async def _write(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._writer, self._call, method, args)
+
+    async def run_write(self, func, *args):
+        """Run func(db, *args) on the writer thread, for multi-statement jobs."""
+        return await asyncio.get_running_loop().run_in_executor(self._writer, self._call_func, func, args)
+
+    async def run_read(self, func, *args):
+        """Run func(db, *args) on a reader thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._readers, self._call_func, func, args)
+
+    def close(self):
+        """Wait for queued operations and close every connection."""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for db in self._connections:
+                db.close()
+            self._connections.clear()
+
+    async def create_tables(self):
+        await self._write('create_tables')
+
+    async def run_backfills(self):
+        """Run pending data backfills batch by batch, letting other writes in between."""
+        while await self._write('run_backfill_batch'):
+            await asyncio.sleep(0)
+
+    async def add_user(self, user_id, username, first_name, last_name, referral_code=None, referred_by=None):
+        await self._write('add_user', user_id, username, first_name, last_name, referral_code, referred_by)
+
+    async def upsert_users(self, rows):
+        await self._write('upsert_users', rows)
+
+    async def get_user(self, user_id):
+        return await self._read('get_user', user_id)
+
+    async def update_subscription(self, user_id, plan, device_limit, end_date, vpn_username="", vpn_password="", vpn_key=""):
+        await self._write('update_subscription', user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key)
+
+    async def get_referral_code(self, user_id):
+        # May assign a new code, so it runs on the writer
+        return await self._write('get_referral_code', user_id)
+
+    async def get_active_subscription(self, user_id):
+        return await self._read('get_active_subscription', user_id)
+
+    async def count_users(self):
+        return await self._read('count_users')
+
+    async def count_panel_subscriptions(self):
+        return await self._read('count_panel_subscriptions')
+
+    async def get_panel_subscriptions(self, after_id, limit):
+        return await self._read('get_panel_subscriptions', after_id, limit)
+
+    async def save_panel_states(self, states):
+        await self._write('save_panel_states', states)
+
+    async def enqueue_purchase(self, user_id, plan, chat_id, message_id, vpn_username, vpn_password):
+        return await self._write('enqueue_purchase', user_id, plan, chat_id, message_id, vpn_username, vpn_password)
+
+    async def claim_purchase_job(self, now):
+        return await self._write('claim_purchase_job', now)
+
+    async def next_purchase_due(self):
+        return await self._read('next_purchase_due')
+
+    async def mark_purchase_create_sent(self, job_id, panel_node=None):
+        await self._write('mark_purchase_create_sent', job_id, panel_node)
+
+    async def retry_purchase_job(self, job_id, next_attempt_at, error, counted=True):
+        await self._write('retry_purchase_job', job_id, next_attempt_at, error, counted)
+
+    async def fail_purchase_job(self, job_id, error):
+        await self._write('fail_purchase_job', job_id, error)
+
+    async def complete_purchase_job(self, job_id, device_limit, end_date, vpn_key):
+        return await self._write('complete_purchase_job', job_id, device_limit, end_date, vpn_key)
+
+    async def requeue_running_purchase_jobs(self):
+        return await self._write('requeue_running_purchase_jobs')
+
+    async def get_unnotified_purchase_jobs(self):
+        return await self._read('get_unnotified_purchase_jobs')
+
+    async def get_purchase_job(self, job_id):
+        return await self._read('get_purchase_job', job_id)
+
+    async def mark_purchase_job_notified(self, job_id):
+        await self._write('mark_purchase_job_notified', job_id)
+
+    async def count_purchase_jobs(self):
+        return await self._read('count_purchase_jobs')
+
+    async def add_warm_account(self, plan, panel_node, vpn_username, vpn_password, created_at):
+        return await self._write('add_warm_account', plan, panel_node, vpn_username, vpn_password, created_at)
+
+    async def get_creating_warm_accounts(self, max_attempts):
+        return await self._read('get_creating_warm_accounts', max_attempts)
+
+    async def mark_warm_account_ready(self, account_id, vpn_key):
+        await self._write('mark_warm_account_ready', account_id, vpn_key)
+
+    async def fail_warm_account(self, account_id, max_attempts):
+        return await self._write('fail_warm_account', account_id, max_attempts)
+
+    async def discard_warm_account(self, account_id):
+        await self._write('discard_warm_account', account_id)
+
+    async def get_discarded_warm_accounts(self, limit):
+        return await self._read('get_discarded_warm_accounts', limit)
+
+    async def delete_warm_account(self, account_id):
+        await self._write('delete_warm_account', account_id)
+
+    async def retire_warm_accounts(self, created_before):
+        return await self._write('retire_warm_accounts', created_before)
+
+    async def count_warm_accounts(self):
+        return await self._read('count_warm_accounts')
+
+    async def claim_warm_account(self, user_id, plan, chat_id, message_id, device_limit, end_date, created_after):
+        return await self._write('claim_warm_account', user_id, plan, chat_id, message_id, device_limit, end_date,
+                                 created_after)
+
+    async def get_pending_expiries(self, stage, after, until, limit):
+        return await self._read('get_pending_expiries', stage, after, until, limit)
+
+    async def mark_subscriptions_reminded(self, subscription_ids):
+        return await self._write('mark_subscriptions_reminded', subscription_ids)
+
+    async def expire_subscriptions(self, subscription_ids, now):
+        return await self._write('expire_subscriptions', subscription_ids, now)
+
+    async def count_broadcast_recipients(self):
+        return await self._read('count_broadcast_recipients')
+
+    async def get_broadcast_recipients(self, after_user_id, limit):
+        return await self._read('get_broadcast_recipients', after_user_id, limit)
+
+    async def count_rows(self, table):
+        return await self._read('count_rows', table)
+
+# Global facade instance; threads and connections are opened on first use
+async_db = AsyncDatabase()
@@ -0,0 +1,58 @@
+# bench_api_client.py
+# Benchmark: concurrent purchases with the async pooled client vs the blocking client
+
+import argparse
+import asyncio
+import logging
+import time
+from api_client import AsyncBlitzAPIClient, BlitzAPIClient
+from stub_panel import StubPanel
+
+
+def sync_purchases(base_url, count):
+    """Run purchases one after another, as the blocking client forces the event loop to."""
+    client = BlitzAPIClient(base_url=base_url, username="admin", password="admin")
+    started = time.perf_counter()
+    for i in range(count):
+        client.create_user(f"sync_{i}", "password", 100, 30)
+        client.get_user_uri(f"sync_{i}")
+    return time.perf_counter() - started
+
+
+async def async_purchases(base_url, count, prefix):
+    """Run purchases concurrently through one pooled client."""
+    client = AsyncBlitzAPIClient(base_url=base_url, username="admin", password="admin")
+    await client.login()
+
+    async def purchase(i):
+        await client.create_user(f"{prefix}_{i}", "password", 100, 30)
+        await client.get_user_uri(f"{prefix}_{i}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(purchase(i) for i in range(count)))
+    elapsed = time.perf_counter() - started
+    await client.aclose()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent purchases against a stub panel")
+    parser.add_argument('--purchases', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.2, help="stub panel latency per request, seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    with StubPanel(latency=args.latency) as panel:
+        single = asyncio.run(async_purchases(panel.base_url, 1, "single"))
+        concurrent = asyncio.run(async_purchases(panel.base_url, args.purchases, "async"))
+        sequential = sync_purchases(panel.base_url, args.purchases)
+
+    print(f"Panel latency per request: {args.latency * 1000:.0f} ms, purchases: {args.purchases}")
+    print(f"  one purchase (async):         {single:7.3f} s")
+    print(f"  {args.purchases} purchases, async pooled:  {concurrent:7.3f} s  ({concurrent / single:.1f}x one purchase)")
+    print(f"  {args.purchases} purchases, blocking:      {sequential:7.3f} s  ({sequential / single:.1f}x one purchase)")
+
+
+if __name__ == "__main__":
+    main()
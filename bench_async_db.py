@@ -0,0 +1,129 @@
+# bench_async_db.py
+# Load test: handler latency with database calls on the event loop vs the async facade
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from async_database import AsyncDatabase
+from database import Database
+
+
+class OnLoopDatabase:
+    """Awaitable wrapper that still runs every query on the event loop thread, like the old handlers."""
+
+    def __init__(self, path):
+        self.db = Database(path)
+
+    async def get_user(self, user_id):
+        return self.db.get_user(user_id)
+
+    async def get_active_subscription(self, user_id):
+        return self.db.get_active_subscription(user_id)
+
+    async def update_subscription(self, *args):
+        self.db.update_subscription(*args)
+
+    def close(self):
+        self.db.close()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run_load(db, users, read_rate, write_rate, duration):
+    """Open-loop load: menu clicks (no DB), profile views (two reads) and purchases (one write).
+
+    Updates arrive on a fixed schedule and latency is measured from the scheduled
+    arrival, so time spent waiting for a blocked event loop counts against the
+    handler, as it does for a real update.
+    """
+    end_date = (datetime.now() + timedelta(days=30)).isoformat()
+    nav_latencies = []
+    latencies = []
+    write_latencies = []
+    tasks = []
+
+    async def menu_handler(i, arrival):
+        await asyncio.sleep(0)
+        nav_latencies.append(time.perf_counter() - arrival)
+
+    async def profile_handler(i, arrival):
+        await db.get_user(i % users)
+        await db.get_active_subscription(i % users)
+        latencies.append(time.perf_counter() - arrival)
+
+    async def purchase_handler(i, arrival):
+        await db.update_subscription(i % users, 'basic', 1, end_date, f"user_{i}", "pw", "key")
+        write_latencies.append(time.perf_counter() - arrival)
+
+    async def generate(handler, rate):
+        started = time.perf_counter()
+        for i in range(int(rate * duration)):
+            arrival = started + i / rate
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(handler(i, arrival)))
+
+    await asyncio.gather(generate(menu_handler, read_rate), generate(profile_handler, read_rate),
+                         generate(purchase_handler, write_rate))
+    await asyncio.gather(*tasks)
+    return nav_latencies, latencies, write_latencies
+
+
+def seed(path, users):
+    db = Database(path)
+    db.create_tables()
+    end_date = (datetime.now() + timedelta(days=30)).isoformat()
+    with db._conn:
+        db._conn.executemany('INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+                             ((i, f"user{i}", "Name") for i in range(users)))
+        db._conn.executemany('INSERT INTO subscriptions (user_id, plan, end_date) VALUES (?, ?, ?)',
+                             ((i % users, 'basic', end_date) for i in range(users * 2)))
+    db.close()
+
+
+def report(name, *groups):
+    ms = lambda v: v * 1000
+    print(f"{name:<16}" + "".join(f"{ms(percentile(g, 50)):>8.2f}/{ms(percentile(g, 99)):<8.2f}" for g in groups))
+
+
+def set_synchronous(db, mode):
+    db._conn.execute(f"PRAGMA synchronous = {mode}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure p99 handler latency under concurrent writes")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--read-rate', type=float, default=1000, help="profile views per second")
+    parser.add_argument('--write-rate', type=float, default=200, help="purchases per second")
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--synchronous', default='NORMAL', choices=['OFF', 'NORMAL', 'FULL'],
+                        help="FULL makes every purchase commit fsync")
+    args = parser.parse_args()
+
+    print(f"{args.read_rate:.0f} menu clicks/s, {args.read_rate:.0f} profile views/s, "
+          f"{args.write_rate:.0f} purchases/s for {args.duration:.0f}s, synchronous={args.synchronous}")
+    print(f"{'p50/p99 ms':<16}{'menu':>8} {'':8}{'profile':>8} {'':8}{'purchase':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        seed(path, args.users)
+
+        db = OnLoopDatabase(path)
+        set_synchronous(db.db, args.synchronous)
+        report("on event loop", *asyncio.run(run_load(db, args.users, args.read_rate, args.write_rate, args.duration)))
+        db.close()
+
+        db = AsyncDatabase(path)
+        asyncio.run(db.run_write(set_synchronous, args.synchronous))
+        report("AsyncDatabase", *asyncio.run(run_load(db, args.users, args.read_rate, args.write_rate, args.duration)))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# bench_bulk.py
+# Benchmark: memory and time of admin exports and broadcasts at 1M users, fetchall vs streamed
+
+import argparse
+import asyncio
+import csv
+import gzip
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from async_database import AsyncDatabase
+from bulk import Broadcaster, BulkProgress, export_table
+from database import EXPORT_COLUMNS, Database
+
+
+class InstantBot:
+    """Accepts every message immediately, so only the bot's own overhead is measured."""
+
+    rate_limiter = None
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, rate_limit_args=None):
+        self.sent += 1
+
+
+def seed(path, users):
+    """`users` users, each with one subscription; a quarter of them expired."""
+    db = Database(path)
+    db.create_tables()
+    now = datetime.now()
+    with db._conn:
+        db._conn.executemany('INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+                             ((i, f"user{i}", "Name") for i in range(1, users + 1)))
+        db._conn.executemany(
+            'INSERT INTO subscriptions (user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((i, 'basic', 1, (now + timedelta(days=random.randint(-30, 90))).isoformat(), f"user_{i}", "pw", "key")
+             for i in range(1, users + 1)))
+        db._conn.execute("UPDATE users SET current_subscription_id = user_id")
+    db.close()
+
+
+def measure(label, run):
+    """Run `run()` and print its wall time and Python heap peak."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<32}{elapsed:>9.2f} s{peak / 2**20:>10.1f} MiB peak")
+    return result
+
+
+def export_fetchall(path, table, directory):
+    """Baseline: the whole table in one fetchall, then written out."""
+    db = Database(path, read_only=True)
+    columns = EXPORT_COLUMNS[table]
+    rows = db._conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid").fetchall()
+    db.close()
+    out_path = os.path.join(directory, f"{table}-fetchall.csv.gz")
+    with gzip.open(out_path, 'wt', encoding='utf-8', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    return len(rows)
+
+
+async def broadcast_fetchall(path, bot, concurrency):
+    """Baseline: every recipient loaded at once and one task created per message."""
+    db = Database(path, read_only=True)
+    user_ids = db.get_broadcast_recipients(0, -1)
+    db.close()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(user_id):
+        async with semaphore:
+            await bot.send_message(user_id, "text")
+
+    await asyncio.gather(*(send(user_id) for user_id in user_ids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure memory of admin exports and broadcasts")
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        print(f"Seeding {args.users:,} users with subscriptions...")
+        seed(path, args.users)
+
+        print("Export of subscriptions to gzip CSV:")
+        measure("fetchall", lambda: export_fetchall(path, 'subscriptions', tmp))
+        measure("streamed (fetchmany)", lambda: export_table(path, 'subscriptions', 'csv', BulkProgress(), tmp))
+
+        print("Broadcast to active subscribers (instant bot):")
+        measure("fetchall + gather", lambda: asyncio.run(broadcast_fetchall(path, InstantBot(), args.concurrency)))
+        db = AsyncDatabase(path)
+        try:
+            bot = InstantBot()
+            measure("keyset pages", lambda: asyncio.run(Broadcaster(db, concurrency=args.concurrency).run(bot, "text")))
+        finally:
+            db.close()
+        print(f"  {bot.sent:,} messages per broadcast")
+
+
+if __name__ == "__main__":
+    main()
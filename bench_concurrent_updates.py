@@ -0,0 +1,32 @@
+# bench_concurrent_updates.py
+# Benchmark: update throughput and menu latency with sequential vs per-user concurrent processing,
+# under a traffic mix where some updates are slow purchases
+
+import argparse
+from loadgen_updates import run_mode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sequential and concurrent update processing")
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--rate', type=float, default=0, help="updates per second, 0 = as fast as possible")
+    parser.add_argument('--purchases', type=float, default=0.05, help="share of updates that are purchases")
+    parser.add_argument('--panel-latency', type=float, default=0.1, help="stub panel latency per request, s")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 32], help="CONCURRENT_UPDATES values")
+    parser.add_argument('--webhook-port', type=int, default=8443)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--send-rate', type=float, default=0, help="TELEGRAM_SEND_RATE for the bot, 0 = unshaped")
+    args = parser.parse_args()
+
+    print(f"{args.updates} updates, {args.purchases:.0%} purchases, panel latency {args.panel_latency * 1000:.0f} ms")
+    print(f"{'concurrent':<12}{'answered':>12}{'updates/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for concurrent_updates in args.concurrency:
+        args.concurrent_updates = concurrent_updates
+        r = run_mode('polling', args)
+        print(f"{concurrent_updates:<12}{r['answered']:>6}/{r['updates']:<5}{r['throughput']:>12.0f}"
+              f"{r['p50'] * 1000:>10.1f}{r['p95'] * 1000:>10.1f}{r['p99'] * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
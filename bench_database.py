@@ -0,0 +1,124 @@
+# bench_database.py
+# Micro-benchmark: connect-per-call database functions vs the long-lived Database repository
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from database import Database
+
+
+class ConnectPerCall:
+    """The previous database.py behaviour: a fresh connection for every operation."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def add_user(self, user_id, username, first_name, last_name, referral_code=None, referred_by=None):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, referral_code, referred_by)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, username, first_name, last_name, referral_code, referred_by))
+        conn.commit()
+        conn.close()
+
+    def get_user(self, user_id):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+        user = cursor.fetchone()
+        conn.close()
+        return user
+
+    def update_subscription(self, user_id, plan, device_limit, end_date, vpn_username="", vpn_password="", vpn_key=""):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO subscriptions (user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key))
+        cursor.execute("UPDATE users SET subscription_status = 'active' WHERE user_id = ?", (user_id,))
+        conn.commit()
+        conn.close()
+
+    def get_referral_code(self, user_id):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT referral_code FROM users WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+        if result and result[0]:
+            referral_code = result[0]
+        else:
+            referral_code = f"REF{user_id}"
+            cursor.execute('UPDATE users SET referral_code = ? WHERE user_id = ?', (referral_code, user_id))
+            conn.commit()
+        conn.close()
+        return referral_code
+
+    def get_active_subscription(self, user_id):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT plan, device_limit, vpn_username, vpn_password, vpn_key, end_date
+            FROM subscriptions
+            WHERE user_id = ? AND end_date > datetime('now')
+            ORDER BY end_date DESC
+            LIMIT 1
+        ''', (user_id,))
+        subscription = cursor.fetchone()
+        conn.close()
+        return subscription
+
+
+def run_ops(repo, users, ops):
+    """Run each operation `ops` times and return ops/sec per operation."""
+    end_date = (datetime.now() + timedelta(days=30)).isoformat()
+    workloads = {
+        'add_user': lambda i: repo.add_user(i % users, f"user{i}", "Name", None),
+        'get_user': lambda i: repo.get_user(i % users),
+        'get_referral_code': lambda i: repo.get_referral_code(i % users),
+        'get_active_subscription': lambda i: repo.get_active_subscription(i % users),
+        'update_subscription': lambda i: repo.update_subscription(i % users, 'basic', 1, end_date, f"user_{i}", "pw", "key"),
+    }
+    results = {}
+    for name, op in workloads.items():
+        started = time.perf_counter()
+        for i in range(ops):
+            op(i)
+        results[name] = ops / (time.perf_counter() - started)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare connect-per-call vs persistent repository ops/sec")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--ops', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        schema = Database(legacy_path)
+        schema.create_tables()
+        schema.close()
+        # The legacy module never switched journal modes, so measure it in its default rollback journal
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+        legacy = run_ops(ConnectPerCall(legacy_path), args.users, args.ops)
+
+        repo = Database(os.path.join(tmp, 'repo.db'))
+        repo.create_tables()
+        persistent = run_ops(repo, args.users, args.ops)
+        repo.close()
+
+    print(f"{'operation':<26}{'connect-per-call':>18}{'Database':>14}{'speedup':>10}")
+    for name in legacy:
+        print(f"{name:<26}{legacy[name]:>14,.0f}/s{persistent[name]:>12,.0f}/s{persistent[name] / legacy[name]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+# bench_e2e.py
+# End-to-end benchmark: runs the bot against the stub Telegram API and stub panel with a realistic
+# update mix, reports throughput, latency per handler, DB and panel calls and peak RSS, and saves
+# the results as JSON for comparison between runs
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from config import ADMIN_IDS, SUBSCRIPTION_PLANS
+from loadgen_updates import feed_polling, feed_webhook, percentile, start_bot
+from stub_panel import StubPanel
+from stub_telegram import StubTelegram, make_callback_update, make_start_update, response_key
+
+# Update kinds and their share of traffic: mostly menu navigation, a few purchases and admin views
+MIX = (
+    ('start', 0.15),
+    ('profile', 0.22),
+    ('show_keys', 0.15),
+    ('back_to_menu', 0.15),
+    ('help', 0.1),
+    ('referral', 0.08),
+    ('buy_subscription', 0.08),
+    ('buy_{plan}', 0.05),
+    ('admin_panel', 0.02),
+)
+METRIC_LINE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def make_updates(count, users, mix=MIX):
+    """Updates of the mix with one reply key each; returns [(kind, update)]."""
+    kinds, weights = zip(*mix)
+    plans = list(SUBSCRIPTION_PLANS)
+    updates, seen = [], set()
+    for update_id in range(1, count + 1):
+        kind = random.choices(kinds, weights)[0]
+        user_id = ADMIN_IDS[0] if kind == 'admin_panel' else random.randint(1, users)
+        if kind == 'start':
+            update = make_start_update(update_id, user_id)
+        else:
+            data = f"buy_{random.choice(plans)}" if kind == 'buy_{plan}' else kind
+            update = make_callback_update(update_id, user_id, data)
+        # One reply is matched per update key, so a user's /start is sent once per run
+        key = response_key(update)
+        if key not in seen:
+            seen.add(key)
+            updates.append((kind, update))
+    return updates
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def parse_metrics(text):
+    """Prometheus text into [(name, {label: value}, value)]."""
+    samples = []
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples.append((name, dict(LABEL.findall(labels or '')), float(value)))
+    return samples
+
+
+def histogram_quantile(buckets, q):
+    """Quantile from cumulative (upper bound, count) buckets, interpolated within a bucket."""
+    buckets = sorted(buckets)
+    total = buckets[-1][1] if buckets else 0
+    if not total:
+        return None
+    rank = q * total
+    lower, below = 0.0, 0
+    for bound, cumulative in buckets:
+        if cumulative >= rank:
+            if bound == float('inf'):
+                return lower
+            return lower + (bound - lower) * (rank - below) / max(1, cumulative - below)
+        lower, below = bound, cumulative
+    return lower
+
+
+def summarize_metrics(samples):
+    """Handler latency quantiles and call counts from the bot's /metrics."""
+    handler_buckets, handler_counts, handler_errors = {}, {}, {}
+    db_calls, api_calls = {}, {}
+    for name, labels, value in samples:
+        if name == 'bot_handler_seconds_bucket':
+            handler_buckets.setdefault(labels['route'], []).append((float(labels['le']), value))
+        elif name == 'bot_handler_seconds_count':
+            handler_counts[labels['route']] = int(value)
+        elif name == 'bot_handler_errors_total':
+            handler_errors[labels['route']] = int(value)
+        elif name == 'sqlite_query_seconds_count':
+            db_calls[labels['function']] = int(value)
+        elif name == 'blitz_api_request_seconds_count':
+            key = f"{labels['method']} {labels['endpoint']} {labels['status']}"
+            api_calls[key] = api_calls.get(key, 0) + int(value)
+    handlers = {}
+    for route, buckets in handler_buckets.items():
+        handlers[route] = {'count': handler_counts.get(route, 0), 'errors': handler_errors.get(route, 0)}
+        for q in (50, 95, 99):
+            handlers[route][f'p{q}_ms'] = _ms(histogram_quantile(buckets, q / 100))
+    return handlers, db_calls, api_calls
+
+
+def peak_rss_mb(pid):
+    """Peak resident set size of a running process, from /proc on Linux."""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def latency_summary(values):
+    return {'count': len(values), 'p50_ms': _ms(percentile(values, 50)), 'p95_ms': _ms(percentile(values, 95)),
+            'p99_ms': _ms(percentile(values, 99))}
+
+
+def run(args):
+    telegram = StubTelegram()
+    panel = StubPanel(latency=args.panel_latency, error_rate=args.panel_error_rate)
+    telegram.start()
+    panel.start()
+    metrics_port = free_port()
+    webhook_port = free_port()
+    extra_env = dict(METRICS_LISTEN='127.0.0.1', METRICS_PORT=str(metrics_port), LOG_FILE=os.devnull)
+    extra_env.update(pair.split('=', 1) for pair in args.env)
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = start_bot(args.mode, telegram, panel, os.path.join(tmp, 'bench.db'), webhook_port,
+                        args.concurrent_updates, args.send_rate, extra_env)
+        try:
+            if not telegram.ready.wait(30):
+                raise RuntimeError("bot did not start")
+            updates = make_updates(args.updates, args.users)
+            plain = [update for _, update in updates]
+            started = time.perf_counter()
+            if args.mode == 'webhook':
+                asyncio.run(feed_webhook(telegram, plain, args.rate, webhook_port, args.concurrency))
+            else:
+                asyncio.run(feed_polling(telegram, plain, args.rate))
+            deadline = time.monotonic() + args.timeout
+            while len(telegram.latencies) < len(updates) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            elapsed = time.perf_counter() - started
+            # Let queued purchases reach the panel before counting calls
+            time.sleep(args.settle)
+            metrics = httpx.get(f"http://127.0.0.1:{metrics_port}/metrics", timeout=10).text
+            rss = peak_rss_mb(bot.pid)
+        finally:
+            bot.terminate()
+            bot.wait()
+            telegram.stop()
+            panel.stop()
+    if rss is None:
+        # Max RSS of any waited-for child: exact when the bot is the only one
+        rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / (1024 if sys.platform != 'darwin' else 1024 * 1024)
+
+    kinds = {response_key(update): kind for kind, update in updates}
+    by_kind = {}
+    for key, latency in telegram.latencies.items():
+        by_kind.setdefault(kinds.get(key, 'other'), []).append(latency)
+    handlers, db_calls, api_calls = summarize_metrics(parse_metrics(metrics))
+    answered = len(telegram.latencies)
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _commit(),
+        'args': vars(args),
+        'updates': len(updates),
+        'answered': answered,
+        'elapsed_s': round(elapsed, 3),
+        'throughput': round(answered / elapsed, 1),
+        'latency': dict({'all': latency_summary(list(telegram.latencies.values()))},
+                        **{kind: latency_summary(values) for kind, values in sorted(by_kind.items())}),
+        'handlers': handlers,
+        'db_calls': dict(sorted(db_calls.items())),
+        'db_calls_total': sum(db_calls.values()),
+        'api_calls': dict(sorted(api_calls.items())),
+        'api_calls_total': sum(api_calls.values()),
+        'panel_requests': dict(sorted(panel.requests.items())),
+        'telegram_calls': dict(sorted(telegram.calls.items())),
+        'peak_rss_mb': round(rss, 1),
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def report(result, baseline=None):
+    def delta(new, old):
+        if old in (None, 0) or new is None:
+            return ''
+        return f" ({(new - old) / old:+.0%})"
+
+    base = baseline or {}
+    print(f"{result['answered']}/{result['updates']} updates in {result['elapsed_s']:.1f} s: "
+          f"{result['throughput']:.0f} updates/s{delta(result['throughput'], base.get('throughput'))}, "
+          f"peak RSS {result['peak_rss_mb']:.0f} MiB{delta(result['peak_rss_mb'], base.get('peak_rss_mb'))}")
+    print(f"\n{'update':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}   (end to end)")
+    for kind, stats in result['latency'].items():
+        old = base.get('latency', {}).get(kind, {})
+        print(f"{kind:<18}{stats['count']:>7}{_fmt(stats['p50_ms']):>10}{_fmt(stats['p95_ms']):>10}"
+              f"{_fmt(stats['p99_ms']):>10}{delta(stats['p95_ms'], old.get('p95_ms'))}")
+    print(f"\n{'handler':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}   (in the bot)")
+    for route, stats in sorted(result['handlers'].items()):
+        old = base.get('handlers', {}).get(route, {})
+        print(f"{route:<18}{stats['count']:>7}{_fmt(stats['p50_ms']):>10}{_fmt(stats['p95_ms']):>10}"
+              f"{_fmt(stats['p99_ms']):>10}{stats['errors']:>8}{delta(stats['p95_ms'], old.get('p95_ms'))}")
+    print(f"\nDB calls: {result['db_calls_total']}{delta(result['db_calls_total'], base.get('db_calls_total'))}, "
+          + ", ".join(f"{name} {count}" for name, count in
+                      sorted(result['db_calls'].items(), key=lambda item: -item[1])[:6]))
+    print(f"Panel calls: {result['api_calls_total']}{delta(result['api_calls_total'], base.get('api_calls_total'))}, "
+          + ", ".join(f"{name} {count}" for name, count in result['api_calls'].items()))
+    print("Telegram calls: " + ", ".join(f"{name} {count}" for name, count in result['telegram_calls'].items()))
+
+
+def _fmt(value):
+    return '-' if value is None else f"{value:.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end bot benchmark against local stub Telegram and panel servers")
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default='polling')
+    parser.add_argument('--updates', type=int, default=3000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=0, help="updates per second, 0 = as fast as possible")
+    parser.add_argument('--concurrency', type=int, default=40, help="parallel webhook requests")
+    parser.add_argument('--panel-latency', type=float, default=0.05, help="stub panel latency per request, s")
+    parser.add_argument('--panel-error-rate', type=float, default=0.0, help="share of panel requests failing with 503")
+    parser.add_argument('--concurrent-updates', type=int, default=None, help="CONCURRENT_UPDATES for the bot")
+    parser.add_argument('--send-rate', type=float, default=0, help="TELEGRAM_SEND_RATE for the bot")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help="extra bot setting, repeatable")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--settle', type=float, default=1.0, help="seconds to wait for background work before scraping")
+    parser.add_argument('--output', help="JSON file for the results (default bench_results/e2e-<time>.json)")
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    result = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} (commit {baseline.get('commit')}, {baseline.get('timestamp')})\n")
+    report(result, baseline)
+
+    output = args.output or os.path.join('bench_results', f"e2e-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
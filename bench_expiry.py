@@ -0,0 +1,109 @@
+# bench_expiry.py
+# Benchmark: expiry scheduler startup and per-tick cost on a large subscriptions table vs polling with a table scan
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+from async_database import AsyncDatabase
+from database import Database
+from expiry import ExpiryScheduler
+
+DAY = 86400
+
+
+def populate(path, subscriptions, days):
+    """Subscriptions ending uniformly over `days` around now; those already ended are handled."""
+    now = time.time()
+    db = Database(path)
+    db.create_tables()
+    rng = random.Random(1)
+    with db._conn:
+        db._conn.executemany('INSERT INTO users (user_id, username, subscription_status) VALUES (?, ?, ?)',
+                             ((i, f"user{i}", 'active') for i in range(1, subscriptions + 1)))
+        rows = []
+        for i in range(1, subscriptions + 1):
+            end = now + rng.uniform(-days / 2, days / 2) * DAY
+            rows.append((i, datetime.fromtimestamp(end).isoformat(), 2 if end < now else 0))
+        db._conn.executemany("INSERT INTO subscriptions (user_id, plan, end_date, expiry_stage) VALUES (?, 'basic', ?, ?)",
+                             rows)
+    db.close()
+    return now
+
+
+async def scheduler_ticks(path, now, ticks, step, args):
+    db = AsyncDatabase(path)
+    scheduler = ExpiryScheduler(db, remind_before=args.remind_before, lookahead=args.lookahead,
+                                batch_size=args.batch_size)
+
+    async def notify(kind, rows):
+        pass
+
+    scheduler.notify = notify
+    started = time.perf_counter()
+    await scheduler.tick(now)
+    startup = time.perf_counter() - started
+    durations = []
+    for i in range(1, ticks + 1):
+        started = time.perf_counter()
+        await scheduler.tick(now + i * step)
+        durations.append(time.perf_counter() - started)
+    db.close()
+    return startup, durations, scheduler
+
+
+def scan_ticks(path, now, ticks, step, remind_before):
+    """The same due lookups as unindexed polling queries."""
+    db = Database(path)
+    durations = []
+    for i in range(ticks):
+        until = datetime.fromtimestamp(now + i * step).isoformat()
+        started = time.perf_counter()
+        db._conn.execute("SELECT id FROM subscriptions NOT INDEXED WHERE expiry_stage = 0 AND end_date <= ?",
+                         (datetime.fromtimestamp(now + i * step + remind_before).isoformat(),)).fetchall()
+        db._conn.execute("SELECT id FROM subscriptions NOT INDEXED WHERE expiry_stage < 2 AND end_date <= ?",
+                         (until,)).fetchall()
+        durations.append(time.perf_counter() - started)
+    db.close()
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the expiry scheduler on a large subscriptions table")
+    parser.add_argument('--subscriptions', type=int, default=1_000_000)
+    parser.add_argument('--days', type=float, default=60, help="end dates spread over this many days around now")
+    parser.add_argument('--ticks', type=int, default=720)
+    parser.add_argument('--step', type=float, default=5, help="simulated seconds between ticks")
+    parser.add_argument('--remind-before', type=float, default=3 * DAY)
+    parser.add_argument('--lookahead', type=float, default=600)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--scan-ticks', type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'expiry.db')
+        started = time.perf_counter()
+        now = populate(path, args.subscriptions, args.days)
+        print(f"{args.subscriptions} subscriptions written in {time.perf_counter() - started:.1f} s")
+
+        startup, durations, scheduler = asyncio.run(scheduler_ticks(path, now, args.ticks, args.step, args))
+        scan = scan_ticks(path, now, args.scan_ticks, args.step, args.remind_before)
+
+    durations.sort()
+    print(f"Scheduler, {args.ticks} ticks over {args.ticks * args.step / 60:.0f} simulated minutes:")
+    print(f"  first tick after start:  {startup * 1000:8.2f} ms")
+    print(f"  tick p50 / p99 / max:    {durations[len(durations) // 2] * 1000:8.2f} / "
+          f"{durations[int(len(durations) * 0.99)] * 1000:.2f} / {durations[-1] * 1000:.2f} ms")
+    print(f"  events loaded / reminded / expired: {scheduler.stats['loaded']} / {scheduler.stats['reminded']} / "
+          f"{scheduler.stats['expired']}, held in memory: {scheduler.queued()}")
+    print(f"Polling with a table scan: {sum(scan) / len(scan) * 1000:8.2f} ms per tick")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# bench_logging.py
+# Benchmark: event loop cost of logging at 1k updates/s, logging.basicConfig to a file vs the queued pipeline
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from log_pipeline import setup_logging
+
+BODY = '{"username": "user_%d", "uri": "' + 'x' * 900 + '"}'
+TOKEN_URL = "https://api.telegram.org/bot123456:AAE0No9cx6GVD7FGLt5x1qr1xUvf6NusAUQ"
+
+httpx_log = logging.getLogger('httpx')
+api_log = logging.getLogger('api_client')
+bot_log = logging.getLogger('main')
+
+
+def eager_update(i, purchase):
+    """Log lines of one update as the bot wrote them before: f-strings, every payload."""
+    httpx_log.info(f'HTTP Request: POST {TOKEN_URL}/answerCallbackQuery "HTTP/1.1 200 OK"')
+    if purchase:
+        bot_log.info(f"Starting purchase process for user {i}, plan: basic")
+        data = {'username': f"user_{i}", 'password': 'pw', 'expiration_days': 30, 'unlimited': True, 'note': ''}
+        api_log.info(f"Creating user user_{i}")
+        api_log.info(f"Request data: {data}")
+        api_log.info(f"API response status: 200, body: {BODY % i}")
+        api_log.info(f"Get URI response status: 200, body: {BODY % i}")
+    httpx_log.info(f'HTTP Request: POST {TOKEN_URL}/editMessageText "HTTP/1.1 200 OK"')
+
+
+def lazy_update(i, purchase):
+    """The same update with %-style arguments; payloads are sampled in api_client before logging."""
+    httpx_log.info('HTTP Request: %s %s "%s %d %s"', 'POST', f'{TOKEN_URL}/answerCallbackQuery', 'HTTP/1.1', 200, 'OK')
+    if purchase:
+        bot_log.info("Starting purchase process for user %s, plan: %s", i, 'basic', extra={'user_id': i, 'plan': 'basic'})
+        api_log.info("Creating user %s", f"user_{i}")
+        if i % 100 == 0:
+            api_log.info("Request data: %s", {'username': f"user_{i}", 'password': '***'})
+            api_log.info("API response status: %s, body: %s", 200, BODY % i)
+    httpx_log.info('HTTP Request: %s %s "%s %d %s"', 'POST', f'{TOKEN_URL}/editMessageText', 'HTTP/1.1', 200, 'OK')
+
+
+async def drive(emit, rate, seconds, purchase_share):
+    """Emit one update's logging every 1/rate s; returns (per-update logging time, loop lag) samples."""
+    loop = asyncio.get_running_loop()
+    interval = 1 / rate
+    purchase_every = max(1, round(1 / purchase_share)) if purchase_share else 0
+    spent, lag = [], []
+    started = loop.time()
+    for i in range(int(rate * seconds)):
+        target = started + i * interval
+        delay = target - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lag.append(max(0.0, loop.time() - target))
+        begin = time.perf_counter()
+        emit(i, bool(purchase_every) and i % purchase_every == 0)
+        spent.append(time.perf_counter() - begin)
+    return spent, lag, loop.time() - started
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+
+def run(label, configure, emit, args, directory):
+    path = os.path.join(directory, f"{label}.log")
+    stop = configure(path)
+    spent, lag, elapsed = asyncio.run(drive(emit, args.rate, args.seconds, args.purchases))
+    drain_started = time.perf_counter()
+    stop()
+    drain = time.perf_counter() - drain_started
+    reset_root()
+    size = os.path.getsize(path)
+    with open(path, 'rb') as log:
+        lines = sum(1 for _ in log)
+    print(f"{label:<12}{len(spent) / elapsed:>10.0f}{sum(spent) / len(spent) * 1e6:>10.1f}"
+          f"{percentile(spent, 99) * 1e6:>10.1f}{percentile(lag, 99) * 1e3:>10.2f}"
+          f"{lines:>9}{size / 1024:>10.0f}{drain * 1e3:>10.1f}")
+
+
+def basic_config(path):
+    logging.basicConfig(filename=path, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+    return lambda: None
+
+
+def queue_only(path):
+    """The pipeline without sampling or rate limits: every record is written."""
+    listener, _ = setup_logging('INFO', 'json', path, sample={}, rate=0)
+    return listener.stop
+
+
+def pipeline(path):
+    listener, _ = setup_logging('INFO', 'json', path)
+    return listener.stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure logging cost on the event loop at a fixed update rate")
+    parser.add_argument('--rate', type=int, default=1000, help="updates per second")
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--purchases', type=float, default=0.05, help="share of updates that are purchases")
+    args = parser.parse_args()
+
+    print(f"{args.rate} updates/s for {args.seconds:.0f} s, {args.purchases:.0%} purchases")
+    print(f"{'setup':<12}{'upd/s':>10}{'mean µs':>10}{'p99 µs':>10}{'lag99 ms':>10}{'lines':>9}{'KiB':>10}{'drain ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        run('basicConfig', basic_config, eager_update, args, tmp)
+        run('queue only', queue_only, lazy_update, args, tmp)
+        run('pipeline', pipeline, lazy_update, args, tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# bench_render.py
+# Micro-benchmark: per-callback cost of building keyboards and plan text vs the render cache
+
+import argparse
+import time
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import SUBSCRIPTION_PLANS
+from keyboards import RenderCache, plan_button_text
+
+
+def legacy_main_menu(is_admin):
+    keyboard = [
+        [InlineKeyboardButton("Профиль", callback_data='profile')],
+        [InlineKeyboardButton("Реферальная ссылка", callback_data='referral')],
+        [InlineKeyboardButton("Купить подписку", callback_data='buy_subscription')],
+        [InlineKeyboardButton("Помощь", callback_data='help')]
+    ]
+    if is_admin:
+        keyboard.append([InlineKeyboardButton("Админ панель", callback_data='admin_panel')])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def legacy_plans():
+    keyboard = [[InlineKeyboardButton(plan_button_text(plan, details), callback_data=f'buy_{plan}')]
+                for plan, details in SUBSCRIPTION_PLANS.items()]
+    keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')])
+    return "Выберите план подписки:", InlineKeyboardMarkup(keyboard)
+
+
+def legacy_back():
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]])
+
+
+def measure(render, iterations, serialize):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        markup = render()
+        if serialize:
+            markup.to_dict()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-callback keyboard render cost")
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    cache = RenderCache()
+    cases = [
+        ('main menu (user)', lambda: legacy_main_menu(False), lambda: cache.main_menu(False)),
+        ('main menu (admin)', lambda: legacy_main_menu(True), lambda: cache.main_menu(True)),
+        ('subscription plans', lambda: legacy_plans()[1], lambda: cache.plans()[1]),
+        ('back to menu', legacy_back, lambda: cache.back_to_menu),
+    ]
+    print(f"{'callback':<22}{'built µs':>10}{'cached µs':>11}{'speedup':>9}{'built+json µs':>15}{'cached+json µs':>16}")
+    for name, legacy, cached in cases:
+        built, hit = measure(legacy, args.iterations, False), measure(cached, args.iterations, False)
+        built_json, hit_json = measure(legacy, args.iterations, True), measure(cached, args.iterations, True)
+        print(f"{name:<22}{built * 1e6:>10.2f}{hit * 1e6:>11.2f}{built / hit:>8.0f}x"
+              f"{built_json * 1e6:>15.2f}{hit_json * 1e6:>16.2f}")
+    print(f"plan keyboard builds: {cache.builds}")
+
+
+if __name__ == "__main__":
+    main()
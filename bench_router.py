@@ -0,0 +1,48 @@
+# bench_router.py
+# Benchmark: callback dispatch cost of an if/elif chain vs the table-driven router as screens are added
+
+import argparse
+import random
+import time
+from router import CallbackRouter
+
+
+def if_chain(names):
+    """Compile an if/elif chain like the old button_handler, ending with the 'buy_' prefix check."""
+    lines = ["def dispatch(data):"]
+    for index, name in enumerate(names):
+        lines.append(f"    {'if' if index == 0 else 'elif'} data == {name!r}:\n        return {name!r}, None")
+    lines.append("    elif data.startswith('buy_'):\n        return 'buy', data.split('_')[1]")
+    lines.append("    return None, None")
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return namespace['dispatch']
+
+
+def measure(resolve, sample):
+    started = time.perf_counter()
+    for data in sample:
+        resolve(data)
+    return (time.perf_counter() - started) / len(sample)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure callback dispatch cost per route count")
+    parser.add_argument('--lookups', type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"{'screens':>8}{'if/elif µs':>12}{'router µs':>11}")
+    for screens in (8, 32, 128, 512):
+        names = [f"screen{i}" for i in range(screens)]
+        router = CallbackRouter()
+        for name in names:
+            router.add(name, None)
+        router.add('buy_{plan}', None)
+        chain = if_chain(names)
+        # Menu navigation plus some purchases, uniformly over screens
+        sample = [random.choice(names) if random.random() < 0.9 else 'buy_basic' for _ in range(args.lookups)]
+        print(f"{screens:>8}{measure(chain, sample) * 1e6:>12.3f}{measure(router.resolve, sample) * 1e6:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
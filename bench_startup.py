@@ -0,0 +1,67 @@
+# bench_startup.py
+# Benchmark: time from process start to the first answered update after a restart
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from stub_panel import StubPanel
+from stub_telegram import StubTelegram, make_start_update
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+def time_to_first_update(main, telegram, panel, db_path, user_id):
+    """Start the bot with an update already waiting and time until it is answered."""
+    env = dict(os.environ,
+               TELEGRAM_BOT_TOKEN='123456:startup',
+               TELEGRAM_API_BASE_URL=telegram.api_url,
+               BLITZ_API_BASE_URL=panel.base_url,
+               DATABASE_FILE=db_path,
+               RECONCILE_INTERVAL='0',
+               BOT_MODE='polling')
+    update = make_start_update(user_id, user_id)
+    telegram.latencies.clear()
+    telegram.push_update(update)
+    started = time.perf_counter()
+    bot = subprocess.Popen([sys.executable, main], env=env, cwd=os.path.dirname(main),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while not telegram.latencies:
+            if bot.poll() is not None:
+                raise RuntimeError(f"bot exited with code {bot.returncode}")
+            time.sleep(0.002)
+        return time.perf_counter() - started
+    finally:
+        bot.terminate()
+        bot.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure time-to-first-update after a restart")
+    parser.add_argument('--main', default=MAIN, help="main.py to start (e.g. from another checkout)")
+    parser.add_argument('--restarts', type=int, default=5)
+    parser.add_argument('--panel-latency', type=float, default=0.0, help="stub panel latency, s (slow panel at boot)")
+    args = parser.parse_args()
+
+    telegram = StubTelegram()
+    panel = StubPanel(latency=args.panel_latency)
+    telegram.start()
+    panel.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'startup.db')
+            times = [time_to_first_update(args.main, telegram, panel, db_path, 1000 + i) for i in range(args.restarts)]
+    finally:
+        telegram.stop()
+        panel.stop()
+
+    print(f"{args.main}, panel latency {args.panel_latency * 1000:.0f} ms")
+    print(f"time to first update: min {min(times) * 1000:.0f} ms, "
+          f"mean {sum(times) / len(times) * 1000:.0f} ms, max {max(times) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# bench_subscription_lookup.py
+# Benchmark: get_active_subscription cost at 1M subscription rows, before and after the index and pointer
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from database import Database
+
+LEGACY_QUERY = '''
+    SELECT plan, device_limit, vpn_username, vpn_password, vpn_key, end_date
+    FROM subscriptions
+    WHERE user_id = ? AND end_date > datetime('now')
+    ORDER BY end_date DESC
+    LIMIT 1
+'''
+
+BACKFILL_POINTERS = '''
+    UPDATE users SET current_subscription_id = (
+        SELECT id FROM subscriptions WHERE subscriptions.user_id = users.user_id ORDER BY end_date DESC LIMIT 1
+    )
+'''
+
+
+def seed(db, users, rows):
+    """Insert `users` users and `rows` subscriptions spread over the last two years."""
+    now = datetime.now()
+    with db._conn:
+        db._conn.executemany('INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+                             ((i, f"user{i}", "Name") for i in range(users)))
+        db._conn.executemany(
+            'INSERT INTO subscriptions (user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((random.randrange(users), 'basic', 1, (now + timedelta(days=random.randint(-700, 30))).isoformat(),
+              f"user_{i}", "pw", "key") for i in range(rows)))
+
+
+def measure(label, lookup, users, lookups):
+    sample = [random.randrange(users) for _ in range(lookups)]
+    started = time.perf_counter()
+    for user_id in sample:
+        lookup(user_id)
+    per_lookup = (time.perf_counter() - started) / lookups
+    print(f"  {label:<34}{per_lookup * 1e6:>12.1f} µs/lookup")
+    return per_lookup
+
+
+def plan(db, sql, *params):
+    return "; ".join(row[-1] for row in db._conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure get_active_subscription at scale")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        db.create_tables()
+        db._conn.execute("DROP INDEX idx_subscriptions_user_end_date")
+        print(f"Seeding {args.rows:,} subscriptions for {args.users:,} users...")
+        seed(db, args.users, args.rows)
+
+        legacy = lambda user_id: db._conn.execute(LEGACY_QUERY, (user_id,)).fetchone()
+        print(f"Before (no index): {plan(db, LEGACY_QUERY, 0)}")
+        before = measure("legacy query, full scan", legacy, args.users, max(1, args.lookups // 100))
+
+        db._conn.execute("CREATE INDEX idx_subscriptions_user_end_date ON subscriptions (user_id, end_date)")
+        print(f"With composite index: {plan(db, LEGACY_QUERY, 0)}")
+        indexed = measure("legacy query, indexed", legacy, args.users, args.lookups)
+
+        started = time.perf_counter()
+        with db._conn:
+            db._conn.execute(BACKFILL_POINTERS)
+        print(f"Pointer backfill took {time.perf_counter() - started:.2f} s")
+        after = measure("current_subscription_id pointer", db.get_active_subscription, args.users, args.lookups)
+        db.close()
+
+    print(f"Speedup: {before / indexed:,.0f}x with the index, {before / after:,.0f}x with the pointer")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# bench_user_writes.py
+# Benchmark: /start storm from mostly returning users, add_user per hit vs the write-behind buffer
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from async_database import AsyncDatabase
+from database import Database
+from user_writes import UserWriteBuffer
+
+
+def seed(path, users):
+    db = Database(path)
+    db.create_tables()
+    with db._conn:
+        db._conn.executemany('INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+                             ((i, f"user{i}", "Name") for i in range(users)))
+    db.close()
+
+
+def hits(count, users, new_share):
+    """user_ids of /start hits: mostly existing users, some new ones."""
+    sample = []
+    next_new = users
+    for _ in range(count):
+        if random.random() < new_share:
+            sample.append(next_new)
+            next_new += 1
+        else:
+            sample.append(random.randrange(users))
+    return sample
+
+
+async def per_hit(db, sample, concurrency):
+    """The previous /start: one INSERT OR IGNORE and commit per hit."""
+    async def worker(part):
+        for user_id in part:
+            await db.add_user(user_id, f"user{user_id}", "Name", None)
+    await asyncio.gather(*(worker(sample[i::concurrency]) for i in range(concurrency)))
+    return len(sample), None
+
+
+async def buffered(db, sample, concurrency, batch_size, interval):
+    writes = UserWriteBuffer(db, batch_size=batch_size, interval=interval)
+    await writes.start()
+
+    async def worker(part):
+        for user_id in part:
+            writes.add_user(user_id, f"user{user_id}", "Name", None)
+            # A handler yields to the event loop at least once per update
+            await asyncio.sleep(0)
+    await asyncio.gather(*(worker(sample[i::concurrency]) for i in range(concurrency)))
+    await writes.stop()
+    return writes.stats['flushes'], writes.stats
+
+
+def measure(label, path, run):
+    db = AsyncDatabase(path)
+    started = time.perf_counter()
+    commits, stats = asyncio.run(run(db))
+    elapsed = time.perf_counter() - started
+    users = asyncio.run(db.count_users())
+    db.close()
+    print(f"  {label:<22}{elapsed:>8.2f} s{commits:>10}{commits / elapsed:>12.0f}{users:>10}")
+    return elapsed, commits, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure /start user writes during a promo burst")
+    parser.add_argument('--hits', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=100000, help="existing users")
+    parser.add_argument('--new', type=float, default=0.1, help="share of hits from new users")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--interval', type=float, default=1.0)
+    args = parser.parse_args()
+
+    sample = hits(args.hits, args.users, args.new)
+    print(f"{args.hits:,} /start hits, {args.new:.0%} from new users, {args.users:,} existing users")
+    print(f"  {'':<22}{'time':>10}{'commits':>10}{'commits/s':>12}{'users':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ('per_hit', 'buffered'):
+            seed(os.path.join(tmp, f"{name}.db"), args.users)
+        before, before_commits, _ = measure("add_user per hit", os.path.join(tmp, 'per_hit.db'),
+                                            lambda db: per_hit(db, sample, args.concurrency))
+        after, after_commits, stats = measure(
+            "write-behind buffer", os.path.join(tmp, 'buffered.db'),
+            lambda db: buffered(db, sample, args.concurrency, args.batch_size, args.interval))
+    print(f"Commits saved: {before_commits - after_commits:,} ({before_commits / max(1, after_commits):,.0f}x fewer), "
+          f"{before_commits / before - after_commits / after:,.0f} commits/s less at {args.hits / before:,.0f} vs "
+          f"{args.hits / after:,.0f} hits/s")
+    print(f"Buffer: {stats['skipped']:,} known users skipped, {stats['coalesced']:,} coalesced, "
+          f"{stats['written']:,} rows written")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# bulk.py
+# Admin bulk tools: broadcasts to subscribers and table exports streamed from SQLite
+
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from telegram.error import Forbidden, TelegramError
+from config import BROADCAST_BATCH_SIZE, BROADCAST_CONCURRENCY, BULK_REPORT_INTERVAL, EXPORT_BATCH_SIZE, EXPORT_DIR
+from database import Database
+from send_scheduler import BULK
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def format_eta(seconds):
+    """Remaining time for progress messages, e.g. '2 ч 05 мин' or '40 с'."""
+    if seconds is None:
+        return "—"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60:02d} мин"
+    if seconds >= 60:
+        return f"{seconds // 60} мин {seconds % 60:02d} с"
+    return f"{seconds} с"
+
+
+class BulkProgress:
+    """Counters of one bulk job; `done` counts every processed row, `failed` the unsuccessful ones."""
+
+    def __init__(self, total=0):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+
+    def progress(self):
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, self.total - self.done)
+        return {
+            'total': self.total,
+            'done': self.done,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'percent': 100.0 * self.done / self.total if self.total else 100.0,
+            'rate': rate,
+            'elapsed': elapsed,
+            'eta': remaining / rate if self.finished_at is None and rate > 0 else None,
+        }
+
+    def text(self, title):
+        """Progress message for the admin chat."""
+        p = self.progress()
+        state = "завершено" if self.finished_at else f"осталось ~{format_eta(p['eta'])}"
+        return (f"{title}: {p['done']}/{p['total']} ({p['percent']:.1f}%), {p['rate']:.0f}/с, {state}"
+                f"\nОшибок: {p['failed']}, пропущено: {p['skipped']}")
+
+
+async def report_until_done(task, report, progress, interval=BULK_REPORT_INTERVAL):
+    """Await `task`, calling `report(progress)` every `interval` seconds meanwhile."""
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=interval)
+        if done:
+            return task.result()
+        try:
+            await report(progress)
+        except Exception as e:
+            logger.warning("Failed to report bulk progress: %s", e)
+
+
+class Broadcaster:
+    """Sends one text to every user with an active subscription.
+
+    Recipients are read in keyset pages of `batch_size` user_ids, so memory stays flat
+    and no read transaction stays open for the hours a large broadcast takes. Messages
+    go out with BULK priority through the bot's send scheduler, which keeps them under
+    Telegram's limits and behind replies to users; at most `concurrency` are queued at once.
+    """
+
+    def __init__(self, db, batch_size=BROADCAST_BATCH_SIZE, concurrency=BROADCAST_CONCURRENCY):
+        self.db = db
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.current = None
+        self._cancelled = False
+
+    @property
+    def running(self):
+        return self.current is not None and self.current.finished_at is None
+
+    def cancel(self):
+        self._cancelled = True
+
+    async def run(self, bot, text, report=None):
+        """Broadcast `text`; `report(progress)` is awaited every BULK_REPORT_INTERVAL seconds."""
+        if self.running:
+            raise RuntimeError("A broadcast is already running")
+        self._cancelled = False
+        progress = self.current = BulkProgress(await self.db.count_broadcast_recipients())
+        logger.info("Broadcast started to %s subscribers", progress.total)
+        task = asyncio.ensure_future(self._send_all(bot, text, progress))
+        try:
+            if report is None:
+                await task
+            else:
+                await report_until_done(task, report, progress)
+        finally:
+            progress.finish()
+        logger.info("Broadcast finished: %s sent, %s blocked the bot, %s failed",
+                    progress.done - progress.failed - progress.skipped, progress.skipped, progress.failed)
+        return progress
+
+    async def _send_all(self, bot, text, progress):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        priority = BULK if bot.rate_limiter else None
+
+        async def send(user_id):
+            async with semaphore:
+                try:
+                    await bot.send_message(user_id, text, rate_limit_args=priority)
+                except Forbidden:
+                    # The user blocked the bot
+                    progress.skipped += 1
+                except TelegramError as e:
+                    progress.failed += 1
+                    logger.warning("Broadcast to %s failed: %s", user_id, e)
+                progress.done += 1
+
+        after_user_id = 0
+        while not self._cancelled:
+            user_ids = await self.db.get_broadcast_recipients(after_user_id, self.batch_size)
+            if not user_ids:
+                break
+            await asyncio.gather(*(send(user_id) for user_id in user_ids))
+            after_user_id = user_ids[-1]
+
+
+def export_table(db_path, table, fmt, progress, directory=EXPORT_DIR, batch_size=EXPORT_BATCH_SIZE):
+    """Write `table` to a gzip-compressed CSV or JSONL file, batch by batch. Returns the file path.
+
+    Runs in a worker thread on its own read-only connection; rows are fetched with
+    fetchmany and written immediately, so memory does not grow with the table.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{table}-{datetime.now():%Y%m%d-%H%M%S}.{fmt}.gz")
+    db = Database(db_path, read_only=True)
+    try:
+        progress.total = db.count_rows(table)
+        batches = db.iter_export(table, batch_size)
+        columns = next(batches)
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as out:
+            if fmt == 'csv':
+                writer = csv.writer(out)
+                writer.writerow(columns)
+                for rows in batches:
+                    writer.writerows(rows)
+                    progress.done += len(rows)
+            else:
+                for rows in batches:
+                    out.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+                    progress.done += len(rows)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    finally:
+        db.close()
+        progress.finish()
+    return path
+
+
+async def export(db_path, table, fmt, report=None, directory=EXPORT_DIR):
+    """Run export_table in a thread, reporting progress meanwhile. Returns (path, progress)."""
+    progress = BulkProgress()
+    task = asyncio.ensure_future(asyncio.to_thread(export_table, db_path, table, fmt, progress, directory))
+    path = await (task if report is None else report_until_done(task, report, progress))
+    logger.info("Exported %s %s rows to %s", progress.done, table, path)
+    return path, progress
@@ -0,0 +1,62 @@
+# circuit_breaker.py
+# Circuit breaker that fails fast while a dependency is down
+
+import time
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing.
+
+    Closed: calls pass and failures are counted. After `failure_threshold`
+    failures in a row it opens and rejects calls for `reset_timeout` seconds.
+    Then it is half-open: one probe call at a time is let through; a success
+    closes the circuit, a failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=10.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.probe_at = None
+        self.stats = {'opened': 0, 'rejected': 0}
+
+    def allow(self):
+        """Whether a call may go through now. Counts a rejection otherwise."""
+        if self.state == 'closed':
+            return True
+        now = self.clock()
+        if self.state == 'open' and now - self.opened_at >= self.reset_timeout:
+            self.state = 'half_open'
+            self.probe_at = None
+        # A probe that never reported back (e.g. a cancelled call) stops blocking after reset_timeout
+        if self.state == 'half_open' and (self.probe_at is None or now - self.probe_at >= self.reset_timeout):
+            self.probe_at = now
+            return True
+        self.stats['rejected'] += 1
+        return False
+
+    def retry_after(self):
+        """Seconds until the next probe is allowed."""
+        if self.state == 'closed':
+            return 0.0
+        since = self.opened_at if self.state == 'open' else self.probe_at
+        if since is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (self.clock() - since))
+
+    def record_success(self):
+        self.state = 'closed'
+        self.failures = 0
+        self.probe_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                self.stats['opened'] += 1
+            self.state = 'open'
+            self.opened_at = self.clock()
+            self.probe_at = None
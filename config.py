@@ -5,15 +5,182 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 # Telegram Bot Token (get from @BotFather)
-TELEGRAM_BOT_TOKEN = "8228046986:AAE0No9cx6GVD7FGLt5x1qr1xUvf6NusAUQ"
+TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', "8228046986:AAE0No9cx6GVD7FGLt5x1qr1xUvf6NusAUQ")
+
+# Bot API endpoint override (e.g. a local stub for load tests), like http://127.0.0.1:8082/bot
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
+
+# Update delivery: 'polling' (default) or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Webhook mode: public URL registered with Telegram (required), local listener and secret token
+# checked on every request (a random one is generated if empty)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+# Maximum number of received updates waiting in the queue; when full, intake blocks
+# (webhook requests wait, polling stops fetching) instead of growing memory. With
+# CONCURRENT_UPDATES > 1 at most as many again are taken from the queue at once
+# (running or waiting for the same user's earlier updates)
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', '256'))
+# Updates handled in parallel (1 = sequential); updates from one user always run in order
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))
+# Outgoing Bot API messages, kept under Telegram's flood limits (about 30 per second overall,
+# 1 per second per chat, 20 per minute per group): sends per second across all chats
+# (0 sends immediately, without the scheduler), per private chat with burst size, and per
+# group chat per minute
+TELEGRAM_SEND_RATE = float(os.getenv('TELEGRAM_SEND_RATE', '25'))
+TELEGRAM_CHAT_SEND_RATE = float(os.getenv('TELEGRAM_CHAT_SEND_RATE', '1'))
+TELEGRAM_CHAT_SEND_BURST = int(os.getenv('TELEGRAM_CHAT_SEND_BURST', '3'))
+TELEGRAM_GROUP_SENDS_PER_MINUTE = int(os.getenv('TELEGRAM_GROUP_SENDS_PER_MINUTE', '20'))
+# Per-user rate limits by action class: sustained actions per second and burst size.
+# Navigation covers menu buttons and /start, purchase the buy buttons, admin the admin panel
+RATE_LIMIT_NAVIGATION = float(os.getenv('RATE_LIMIT_NAVIGATION', '5'))
+RATE_LIMIT_NAVIGATION_BURST = int(os.getenv('RATE_LIMIT_NAVIGATION_BURST', '10'))
+RATE_LIMIT_PURCHASE = float(os.getenv('RATE_LIMIT_PURCHASE', '0.2'))
+RATE_LIMIT_PURCHASE_BURST = int(os.getenv('RATE_LIMIT_PURCHASE_BURST', '3'))
+RATE_LIMIT_ADMIN = float(os.getenv('RATE_LIMIT_ADMIN', '1'))
+RATE_LIMIT_ADMIN_BURST = int(os.getenv('RATE_LIMIT_ADMIN_BURST', '5'))
+# Limit shared by all users for purchases, which call the panel API
+RATE_LIMIT_PANEL = float(os.getenv('RATE_LIMIT_PANEL', '20'))
+RATE_LIMIT_PANEL_BURST = int(os.getenv('RATE_LIMIT_PANEL_BURST', '40'))
+# Maximum number of tracked (user, action) buckets; idle ones are evicted first
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '50000'))
 
 # Blitz VPN API Configuration
 BLITZ_API_BASE_URL = os.getenv('BLITZ_API_BASE_URL')  # Replace with actual URL
 BLITZ_API_USERNAME = os.getenv('BLITZ_API_USERNAME')
 BLITZ_API_PASSWORD = os.getenv('BLITZ_API_PASSWORD')
 
+# Panel nodes as comma-separated name=url pairs, e.g. "de1=https://de1.example.com/abc,nl1=https://...".
+# Empty means one node named "main" at BLITZ_API_BASE_URL. Credentials default to the ones above and
+# can be set per node with BLITZ_PANEL_<NAME>_USERNAME / _PASSWORD; BLITZ_PANEL_<NAME>_MAX_USERS caps
+# the node's online users for placement. Subscriptions created before nodes were recorded stay on the
+# first node, so list the original panel first
+def _panel_nodes(spec):
+    nodes = []
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, url = entry.partition('=')
+        prefix = f"BLITZ_PANEL_{name.strip().upper()}_"
+        nodes.append({
+            'name': name.strip(),
+            'url': url.strip(),
+            'username': os.getenv(prefix + 'USERNAME', BLITZ_API_USERNAME),
+            'password': os.getenv(prefix + 'PASSWORD', BLITZ_API_PASSWORD),
+            'max_users': int(os.getenv(prefix + 'MAX_USERS', '0')),
+        })
+    return nodes or [{'name': 'main', 'url': BLITZ_API_BASE_URL, 'username': BLITZ_API_USERNAME,
+                      'password': BLITZ_API_PASSWORD, 'max_users': 0}]
+
+BLITZ_PANEL_NODES = _panel_nodes(os.getenv('BLITZ_PANELS', ''))
+# Seconds between node health checks, and the headroom (percentage points) a node is charged
+# per user placed on it since its last check, so a burst of purchases spreads across nodes
+BLITZ_HEALTH_INTERVAL = float(os.getenv('BLITZ_HEALTH_INTERVAL', '30'))
+BLITZ_PLACEMENT_COST = float(os.getenv('BLITZ_PLACEMENT_COST', '0.5'))
+
+# Blitz API client tuning: per-request deadline (seconds) and connection pool size
+BLITZ_API_TIMEOUT = float(os.getenv('BLITZ_API_TIMEOUT', '10'))
+BLITZ_API_MAX_CONNECTIONS = int(os.getenv('BLITZ_API_MAX_CONNECTIONS', '20'))
+BLITZ_API_MAX_KEEPALIVE = int(os.getenv('BLITZ_API_MAX_KEEPALIVE', '10'))
+
+# Panel failure handling: consecutive failures that open an endpoint family's circuit,
+# seconds before a probe is let through, retries of idempotent GETs with their base
+# backoff in seconds, and retries allowed as a share of requests
+BLITZ_BREAKER_FAILURES = int(os.getenv('BLITZ_BREAKER_FAILURES', '5'))
+BLITZ_BREAKER_RESET = float(os.getenv('BLITZ_BREAKER_RESET', '10'))
+BLITZ_API_RETRIES = int(os.getenv('BLITZ_API_RETRIES', '2'))
+BLITZ_API_RETRY_BACKOFF = float(os.getenv('BLITZ_API_RETRY_BACKOFF', '0.2'))
+BLITZ_API_RETRY_BUDGET = float(os.getenv('BLITZ_API_RETRY_BUDGET', '0.2'))
+
+# Panel response cache: TTL in seconds per endpoint (0 disables) and maximum number of entries
+BLITZ_CACHE_TTL_USER = float(os.getenv('BLITZ_CACHE_TTL_USER', '30'))
+BLITZ_CACHE_TTL_URI = float(os.getenv('BLITZ_CACHE_TTL_URI', '300'))
+BLITZ_CACHE_TTL_STATUS = float(os.getenv('BLITZ_CACHE_TTL_STATUS', '15'))
+BLITZ_CACHE_MAX_ENTRIES = int(os.getenv('BLITZ_CACHE_MAX_ENTRIES', '10000'))
+
+# Share of panel requests whose request and response bodies are logged (0 disables,
+# 1 logs every call); passwords are masked. Latency and status of every call go to metrics
+BLITZ_PAYLOAD_LOG_SAMPLE = float(os.getenv('BLITZ_PAYLOAD_LOG_SAMPLE', '0.01'))
+
+# Panel reconciliation job: run interval in seconds (0 disables), rows per batch,
+# concurrent panel requests and panel requests per second
+RECONCILE_INTERVAL = int(os.getenv('RECONCILE_INTERVAL', '3600'))
+RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', '500'))
+RECONCILE_CONCURRENCY = int(os.getenv('RECONCILE_CONCURRENCY', '10'))
+RECONCILE_RATE = float(os.getenv('RECONCILE_RATE', '20'))
+
+# Purchase job queue: worker count, attempts per job and base retry delay in seconds
+# (doubled after each failed attempt)
+PURCHASE_WORKERS = int(os.getenv('PURCHASE_WORKERS', '4'))
+PURCHASE_MAX_ATTEMPTS = int(os.getenv('PURCHASE_MAX_ATTEMPTS', '5'))
+PURCHASE_RETRY_DELAY = float(os.getenv('PURCHASE_RETRY_DELAY', '2'))
+
+# Warm pool of ready panel accounts per plan, bound to a purchase without waiting for the panel:
+# refilling starts when fewer than WARM_POOL_LOW accounts are ready and stops at WARM_POOL_HIGH
+# (0 disables the pool); a plan can override both with a 'warm_pool': (low, high) entry.
+# Accounts are created by WARM_POOL_CONCURRENCY parallel requests, levels are checked every
+# WARM_POOL_INTERVAL seconds, and accounts unclaimed for WARM_POOL_MAX_AGE seconds are retired;
+# an account still not ready after WARM_POOL_MAX_ATTEMPTS failed attempts is given up
+WARM_POOL_LOW = int(os.getenv('WARM_POOL_LOW', '2'))
+WARM_POOL_HIGH = int(os.getenv('WARM_POOL_HIGH', '5'))
+WARM_POOL_CONCURRENCY = int(os.getenv('WARM_POOL_CONCURRENCY', '2'))
+WARM_POOL_INTERVAL = float(os.getenv('WARM_POOL_INTERVAL', '30'))
+WARM_POOL_MAX_AGE = float(os.getenv('WARM_POOL_MAX_AGE', '86400'))
+WARM_POOL_MAX_ATTEMPTS = int(os.getenv('WARM_POOL_MAX_ATTEMPTS', '5'))
+
+# Subscription expiry: users are reminded EXPIRY_REMIND_BEFORE seconds before their last
+# subscription ends and marked expired when it does. Only events due within the next
+# EXPIRY_LOOKAHEAD seconds are kept in memory, loaded and fired EXPIRY_BATCH_SIZE at a time
+# and checked at least every EXPIRY_TICK seconds; events found more than EXPIRY_NOTIFY_GRACE
+# seconds late (after downtime or the first start) update the status without a message
+EXPIRY_REMIND_BEFORE = float(os.getenv('EXPIRY_REMIND_BEFORE', '259200'))
+EXPIRY_LOOKAHEAD = float(os.getenv('EXPIRY_LOOKAHEAD', '600'))
+EXPIRY_BATCH_SIZE = int(os.getenv('EXPIRY_BATCH_SIZE', '500'))
+EXPIRY_TICK = float(os.getenv('EXPIRY_TICK', '5'))
+EXPIRY_NOTIFY_GRACE = float(os.getenv('EXPIRY_NOTIFY_GRACE', '86400'))
+
+# Admin bulk tools: broadcast recipients read per batch and messages queued at once,
+# exported rows fetched per batch, export directory, and seconds between progress updates
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '500'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '50'))
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_DIR = os.getenv('EXPORT_DIR', 'exports')
+BULK_REPORT_INTERVAL = float(os.getenv('BULK_REPORT_INTERVAL', '10'))
+
+# Logging: level, 'json' (one object per line) or 'text', file (empty = stderr), share of
+# records below WARNING kept per logger ('httpx=0.01' keeps 1% of Bot API request lines), and
+# records per second per logger with burst size (0 = unlimited); errors are never dropped
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_FILE = os.getenv('LOG_FILE', '')
+LOG_SAMPLE = os.getenv('LOG_SAMPLE', 'httpx=0.01')
+LOG_RATE_LIMIT = float(os.getenv('LOG_RATE_LIMIT', '50'))
+LOG_RATE_BURST = int(os.getenv('LOG_RATE_BURST', '200'))
+
+# Prometheus metrics endpoint (http://METRICS_LISTEN:METRICS_PORT/metrics); port 0 disables it
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+
+# Write-behind user upserts from /start: users per transaction, seconds between writes,
+# and user_ids whose stored profile is remembered so repeat /start hits skip the database
+USER_WRITE_BATCH_SIZE = int(os.getenv('USER_WRITE_BATCH_SIZE', '500'))
+USER_WRITE_INTERVAL = float(os.getenv('USER_WRITE_INTERVAL', '1'))
+USER_KNOWN_CACHE_SIZE = int(os.getenv('USER_KNOWN_CACHE_SIZE', '100000'))
+
 # Database file
-DATABASE_FILE = 'bot_database.db'
+DATABASE_FILE = os.getenv('DATABASE_FILE', 'bot_database.db')
+
+# SQLite tuning: page cache size in KiB and per-connection prepared statement cache
+DATABASE_CACHE_SIZE_KB = int(os.getenv('DATABASE_CACHE_SIZE_KB', '16384'))
+DATABASE_CACHED_STATEMENTS = int(os.getenv('DATABASE_CACHED_STATEMENTS', '128'))
+
+# Number of reader threads used by the async database facade (writes always use one thread)
+DATABASE_READER_THREADS = int(os.getenv('DATABASE_READER_THREADS', '4'))
+
+# Rows per transaction for background data backfills run after schema migrations
+MIGRATION_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '5000'))
 
 # Admin user IDs (list of Telegram user IDs who have admin access)
 ADMIN_IDS = [1226699653 ]  # Replace with actual admin user IDs
@@ -2,134 +2,592 @@
 # Module for handling SQLite database operations
 
 import sqlite3
-from config import DATABASE_FILE
+import threading
+import migrations
+from config import DATABASE_FILE, DATABASE_CACHE_SIZE_KB, DATABASE_CACHED_STATEMENTS, MIGRATION_BATCH_SIZE
 
-def create_tables():
-    """Create necessary tables if they don't exist."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            subscription_status TEXT DEFAULT 'Не активирована',
-            referral_code TEXT UNIQUE,
-            referred_by INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Subscriptions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS subscriptions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            plan TEXT,
-            device_limit INTEGER,
-            vpn_username TEXT,
-            vpn_password TEXT,
-            vpn_key TEXT,
-            start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            end_date TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-
-    # Add migration for new columns
-    try:
-        cursor.execute("ALTER TABLE subscriptions ADD COLUMN vpn_username TEXT")
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute("ALTER TABLE subscriptions ADD COLUMN vpn_password TEXT")
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute("ALTER TABLE subscriptions ADD COLUMN vpn_key TEXT")
-    except sqlite3.OperationalError:
-        pass
-
-    conn.commit()
-    conn.close()
+# Pragmas applied to every connection. WAL lets readers run alongside the writer,
+# and synchronous=NORMAL is durable in WAL mode while skipping an fsync per commit.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 134217728",
+)
 
-def add_user(user_id, username, first_name, last_name, referral_code=None, referred_by=None):
-    """Add a new user to the database."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+class Database:
+    """Long-lived repository that owns a SQLite connection.
 
-    cursor.execute('''
-        INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, referral_code, referred_by)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (user_id, username, first_name, last_name, referral_code, referred_by))
+    The connection is opened once with tuned pragmas, so repeated queries reuse
+    sqlite3's prepared statement cache instead of reconnecting and re-parsing SQL.
+    """
 
-    conn.commit()
-    conn.close()
+    def __init__(self, path=DATABASE_FILE, cached_statements=DATABASE_CACHED_STATEMENTS, read_only=False):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, cached_statements=cached_statements)
+        for pragma in PRAGMAS:
+            self._conn.execute(pragma)
+        self._conn.execute(f"PRAGMA cache_size = -{DATABASE_CACHE_SIZE_KB}")
+        if read_only:
+            self._conn.execute("PRAGMA query_only = ON")
 
-def get_user(user_id):
-    """Get user information by user_id."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    def close(self):
+        """Close the underlying connection."""
+        with self._lock:
+            self._conn.close()
 
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    user = cursor.fetchone()
+    def create_tables(self):
+        """Create necessary tables if they don't exist and apply pending migrations."""
+        with self._lock:
+            migrations.migrate(self._conn)
 
-    conn.close()
-    return user
+    def run_backfill_batch(self, batch_size=MIGRATION_BATCH_SIZE):
+        """Run one batch of pending data backfills. Returns True while work remains."""
+        with self._lock:
+            return migrations.run_backfill_batch(self._conn, batch_size)
 
-def update_subscription(user_id, plan, device_limit, end_date, vpn_username="", vpn_password="", vpn_key=""):
-    """Update user's subscription."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    def add_user(self, user_id, username, first_name, last_name, referral_code=None, referred_by=None):
+        """Add a new user to the database."""
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, referral_code, referred_by)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, username, first_name, last_name, referral_code, referred_by))
 
-    cursor.execute('''
-        INSERT INTO subscriptions (user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key))
+    def upsert_users(self, rows):
+        """Add users and refresh the names of existing ones in one transaction.
 
-    cursor.execute('''
-        UPDATE users SET subscription_status = 'active' WHERE user_id = ?
-    ''', (user_id,))
+        rows: (user_id, username, first_name, last_name, referral_code, referred_by);
+        referral fields of existing users are left as they are.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany('''
+                INSERT INTO users (user_id, username, first_name, last_name, referral_code, referred_by)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = excluded.username, first_name = excluded.first_name, last_name = excluded.last_name
+                WHERE username IS NOT excluded.username OR first_name IS NOT excluded.first_name
+                    OR last_name IS NOT excluded.last_name
+            ''', rows)
 
-    conn.commit()
-    conn.close()
+    def get_user(self, user_id):
+        """Get user information by user_id."""
+        with self._lock:
+            return self._conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
 
-def get_referral_code(user_id):
-    """Generate or get referral code for user."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    def update_subscription(self, user_id, plan, device_limit, end_date, vpn_username="", vpn_password="", vpn_key=""):
+        """Update user's subscription."""
+        with self._lock, self._conn:
+            self._insert_subscription(user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key)
+
+    def _insert_subscription(self, user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key,
+                             panel_node=None):
+        """Insert a subscription and update the user's pointer; the caller owns the transaction."""
+        cursor = self._conn.execute('''
+            INSERT INTO subscriptions (user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key,
+                                       panel_node)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key, panel_node))
+
+        # Move the current-subscription pointer only if the new one ends later
+        self._conn.execute('''
+            UPDATE users SET
+                subscription_status = 'active',
+                current_subscription_id = CASE
+                    WHEN ? >= COALESCE((SELECT end_date FROM subscriptions WHERE id = users.current_subscription_id), '')
+                    THEN ? ELSE current_subscription_id
+                END
+            WHERE user_id = ?
+        ''', (end_date, cursor.lastrowid, user_id))
+
+    def get_referral_code(self, user_id):
+        """Generate or get referral code for user."""
+        with self._lock, self._conn:
+            result = self._conn.execute('SELECT referral_code FROM users WHERE user_id = ?', (user_id,)).fetchone()
+
+            if result and result[0]:
+                return result[0]
+
+            referral_code = f"REF{user_id}"
+            self._conn.execute('UPDATE users SET referral_code = ? WHERE user_id = ?', (referral_code, user_id))
+            return referral_code
+
+    def get_active_subscription(self, user_id):
+        """Get user's active subscription with VPN details."""
+        with self._lock:
+            # The pointer targets the latest-ending subscription, so if it has
+            # expired every other subscription of the user has expired too.
+            # Users not reached by the pointer backfill yet fall back to the index.
+            return self._conn.execute('''
+                SELECT s.plan, s.device_limit, s.vpn_username, s.vpn_password, s.vpn_key, s.end_date
+                FROM users u
+                JOIN subscriptions s ON s.id = COALESCE(u.current_subscription_id, (
+                    SELECT id FROM subscriptions WHERE user_id = u.user_id ORDER BY end_date DESC LIMIT 1
+                ))
+                WHERE u.user_id = ? AND s.end_date > datetime('now')
+            ''', (user_id,)).fetchone()
+
+    def count_users(self):
+        """Get total number of users."""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def count_panel_subscriptions(self):
+        """Get number of subscriptions that have a panel account."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM subscriptions WHERE vpn_username != ''").fetchone()[0]
+
+    def get_panel_subscriptions(self, after_id, limit):
+        """Get (id, vpn_username, panel_node) of subscriptions with a panel account, paging by id."""
+        with self._lock:
+            return self._conn.execute('''
+                SELECT id, vpn_username, panel_node FROM subscriptions
+                WHERE id > ? AND vpn_username != ''
+                ORDER BY id
+                LIMIT ?
+            ''', (after_id, limit)).fetchall()
+
+    def save_panel_states(self, states):
+        """Store panel status and traffic for many subscriptions in one transaction.
+
+        Args:
+            states: Iterable of (panel_status, traffic_used, subscription_id)
+        """
+        with self._lock, self._conn:
+            self._conn.executemany('''
+                UPDATE subscriptions SET panel_status = ?, traffic_used = ?, panel_synced_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', states)
+
+    # Purchase job queue
+
+    def enqueue_purchase(self, user_id, plan, chat_id, message_id, vpn_username, vpn_password):
+        """Queue a purchase, or join the unfinished job for the same user and plan.
+
+        A user who already has a subscription to the plan gets a renewal of its panel
+        account instead of a new one. Returns (job, created).
+        """
+        key = f"{user_id}:{plan}"
+        with self._lock, self._conn:
+            tapped = self._tapped_purchase_job(key, chat_id, message_id)
+            if tapped is not None:
+                return tapped, False
+            panel_node = extends_end_date = None
+            renewal = self._renewable_subscription(user_id, plan)
+            if renewal is not None:
+                vpn_username, vpn_password, panel_node, extends_end_date = renewal
+            cursor = self._conn.execute('''
+                INSERT OR IGNORE INTO purchase_jobs
+                    (idempotency_key, user_id, plan, chat_id, message_id, vpn_username, vpn_password, panel_node,
+                     extends_end_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (key, user_id, plan, chat_id, message_id, vpn_username, vpn_password, panel_node, extends_end_date))
+            created = cursor.rowcount == 1
+            if not created:
+                # Report the result in the message the user pressed last
+                self._conn.execute('''
+                    UPDATE purchase_jobs SET chat_id = ?, message_id = ?
+                    WHERE idempotency_key = ? AND status IN ('pending', 'running')
+                ''', (chat_id, message_id, key))
+            row = self._conn.execute(f'''
+                SELECT {_JOB_FIELDS} FROM purchase_jobs
+                WHERE idempotency_key = ? AND status IN ('pending', 'running')
+            ''', (key,)).fetchone()
+            return _job(row), created
+
+    def _renewable_subscription(self, user_id, plan):
+        """Panel account of the user's latest subscription to the plan, or None:
+        (vpn_username, vpn_password, panel_node, end_date)."""
+        return self._conn.execute('''
+            SELECT vpn_username, vpn_password, panel_node, end_date FROM subscriptions
+            WHERE user_id = ? AND plan = ? AND vpn_username != ''
+            ORDER BY end_date DESC
+            LIMIT 1
+        ''', (user_id, plan)).fetchone()
+
+    def _tapped_purchase_job(self, key, chat_id, message_id):
+        """A finished job started from the same message: a repeated tap on its button joins it."""
+        row = self._conn.execute(f'''
+            SELECT {_JOB_FIELDS} FROM purchase_jobs
+            WHERE chat_id = ? AND message_id = ? AND idempotency_key = ? AND status = 'done'
+            ORDER BY id DESC
+            LIMIT 1
+        ''', (chat_id, message_id, key)).fetchone()
+        return _job(row) if row else None
+
+    def claim_purchase_job(self, now):
+        """Mark the oldest due pending job as running and return it, or None."""
+        with self._lock, self._conn:
+            row = self._conn.execute(f'''
+                UPDATE purchase_jobs SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM purchase_jobs
+                    WHERE status = 'pending' AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at, id
+                    LIMIT 1
+                )
+                RETURNING {_JOB_FIELDS}
+            ''', (now,)).fetchone()
+            return _job(row) if row else None
+
+    def next_purchase_due(self):
+        """Time of the earliest pending job, or None if the queue is empty."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM purchase_jobs WHERE status = 'pending'").fetchone()[0]
+
+    def mark_purchase_create_sent(self, job_id, panel_node=None):
+        """Record that the panel account request has been sent at least once, and to which node."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE purchase_jobs SET create_sent = 1, panel_node = ? WHERE id = ?",
+                               (panel_node, job_id))
+
+    def retry_purchase_job(self, job_id, next_attempt_at, error, counted=True):
+        """Put a running job back in the queue after a transient failure.
+
+        An uncounted retry gives back the attempt claim_purchase_job took.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('''
+                UPDATE purchase_jobs SET status = 'pending', next_attempt_at = ?, last_error = ?,
+                    attempts = attempts - ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (next_attempt_at, error, 0 if counted else 1, job_id))
+
+    def fail_purchase_job(self, job_id, error):
+        """Mark a job as permanently failed."""
+        with self._lock, self._conn:
+            self._conn.execute('''
+                UPDATE purchase_jobs SET status = 'failed', last_error = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (error, job_id))
+
+    def complete_purchase_job(self, job_id, device_limit, end_date, vpn_key):
+        """Save the subscription and mark the job done in one transaction."""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT user_id, plan, vpn_username, vpn_password, panel_node FROM purchase_jobs "
+                "WHERE id = ? AND status = 'running'",
+                (job_id,)).fetchone()
+            if row is None:
+                return False
+            user_id, plan, vpn_username, vpn_password, panel_node = row
+            self._insert_subscription(user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key,
+                                      panel_node)
+            self._conn.execute('''
+                UPDATE purchase_jobs SET status = 'done', vpn_key = ?, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (vpn_key, job_id))
+            return True
+
+    def requeue_running_purchase_jobs(self):
+        """Return jobs left running by a previous process to the queue. Returns their count."""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE purchase_jobs SET status = 'pending', next_attempt_at = 0 WHERE status = 'running'").rowcount
+
+    def get_unnotified_purchase_jobs(self):
+        """Finished jobs whose result has not been shown to the user yet."""
+        with self._lock:
+            rows = self._conn.execute(f'''
+                SELECT {_JOB_FIELDS} FROM purchase_jobs
+                WHERE status IN ('done', 'failed') AND notified = 0 AND message_id IS NOT NULL
+                ORDER BY id
+            ''').fetchall()
+            return [_job(row) for row in rows]
+
+    def get_purchase_job(self, job_id):
+        """Get a purchase job by id."""
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_JOB_FIELDS} FROM purchase_jobs WHERE id = ?", (job_id,)).fetchone()
+            return _job(row) if row else None
+
+    def mark_purchase_job_notified(self, job_id):
+        """Record that the job result was shown to the user."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE purchase_jobs SET notified = 1 WHERE id = ?", (job_id,))
+
+    def count_purchase_jobs(self):
+        """Number of purchase jobs per status."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM purchase_jobs GROUP BY status").fetchall())
+
+    # Warm pool of pre-provisioned panel accounts
+
+    def add_warm_account(self, plan, panel_node, vpn_username, vpn_password, created_at):
+        """Record an account about to be created on the panel. Returns its id."""
+        with self._lock, self._conn:
+            return self._conn.execute('''
+                INSERT INTO warm_accounts (plan, panel_node, vpn_username, vpn_password, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (plan, panel_node, vpn_username, vpn_password, created_at)).lastrowid
+
+    def get_creating_warm_accounts(self, max_attempts):
+        """Accounts whose creation or key lookup has not finished and has failed fewer than
+        `max_attempts` times: (id, plan, panel_node, vpn_username, vpn_password)."""
+        with self._lock:
+            return self._conn.execute('''
+                SELECT id, plan, panel_node, vpn_username, vpn_password FROM warm_accounts
+                WHERE status = 'creating' AND attempts < ? ORDER BY id
+            ''', (max_attempts,)).fetchall()
+
+    def mark_warm_account_ready(self, account_id, vpn_key):
+        """Make an account available to purchases once its key is known."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE warm_accounts SET status = 'ready', vpn_key = ? WHERE id = ?", (vpn_key, account_id))
+
+    def fail_warm_account(self, account_id, max_attempts):
+        """Count a failed attempt to create an account; after `max_attempts` it is marked 'failed'.
 
-    cursor.execute('SELECT referral_code FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
+        Returns True if the account was given up.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute('''
+                UPDATE warm_accounts SET
+                    attempts = attempts + 1,
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END
+                WHERE id = ?
+                RETURNING status
+            ''', (max_attempts, account_id)).fetchone()
+            return row is not None and row[0] == 'failed'
 
-    if result and result[0]:
-        referral_code = result[0]
-    else:
-        referral_code = f"REF{user_id}"
-        cursor.execute('UPDATE users SET referral_code = ? WHERE user_id = ?', (referral_code, user_id))
-        conn.commit()
+    def delete_warm_account(self, account_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM warm_accounts WHERE id = ?", (account_id,))
 
-    conn.close()
-    return referral_code
+    def discard_warm_account(self, account_id):
+        """Give up an account; it is removed from the panel before its row is dropped."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE warm_accounts SET status = 'failed' WHERE id = ?", (account_id,))
+
+    def retire_warm_accounts(self, created_before):
+        """Take ready accounts created before `created_before` out of the pool for removal. Returns their count."""
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE warm_accounts SET status = 'retired' WHERE status = 'ready' AND created_at < ?",
+                                      (created_before,)).rowcount
+
+    def get_discarded_warm_accounts(self, limit):
+        """Given-up and retired accounts still to be removed from the panel: (id, panel_node, vpn_username)."""
+        with self._lock:
+            return self._conn.execute('''
+                SELECT id, panel_node, vpn_username FROM warm_accounts
+                WHERE status IN ('failed', 'retired') ORDER BY id LIMIT ?
+            ''', (limit,)).fetchall()
+
+    def count_warm_accounts(self):
+        """Number of accounts per plan and status: {plan: {status: count}}."""
+        with self._lock:
+            counts = {}
+            for plan, status, count in self._conn.execute(
+                    "SELECT plan, status, COUNT(*) FROM warm_accounts GROUP BY plan, status"):
+                counts.setdefault(plan, {})[status] = count
+            return counts
+
+    def claim_warm_account(self, user_id, plan, chat_id, message_id, device_limit, end_date, created_after):
+        """Bind the oldest ready account of the plan to a purchase in one transaction.
+
+        Saves the subscription and a finished purchase job. Returns (job, created): the
+        finished job of a repeated tap on the same message with created False, or
+        (None, False) if no account is ready, the user already has an unfinished job for
+        the plan or the purchase renews an existing account.
+        """
+        key = f"{user_id}:{plan}"
+        with self._lock, self._conn:
+            tapped = self._tapped_purchase_job(key, chat_id, message_id)
+            if tapped is not None:
+                return tapped, False
+            if self._conn.execute("SELECT 1 FROM purchase_jobs WHERE idempotency_key = ? AND status IN ('pending', 'running')",
+                                  (key,)).fetchone():
+                return None, False
+            # A renewal extends the user's existing account through the queue, keeping their key
+            if self._renewable_subscription(user_id, plan) is not None:
+                return None, False
+            row = self._conn.execute('''
+                DELETE FROM warm_accounts WHERE id = (
+                    SELECT id FROM warm_accounts
+                    WHERE plan = ? AND status = 'ready' AND created_at >= ?
+                    ORDER BY id
+                    LIMIT 1
+                )
+                RETURNING vpn_username, vpn_password, vpn_key, panel_node
+            ''', (plan, created_after)).fetchone()
+            if row is None:
+                return None, False
+            vpn_username, vpn_password, vpn_key, panel_node = row
+            self._insert_subscription(user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key,
+                                      panel_node)
+            # The handler shows the result itself, so the job is stored as already reported
+            job = self._conn.execute(f'''
+                INSERT INTO purchase_jobs
+                    (idempotency_key, user_id, plan, chat_id, message_id, vpn_username, vpn_password, vpn_key,
+                     status, create_sent, attempts, notified, panel_node)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'done', 1, 1, 1, ?)
+                RETURNING {_JOB_FIELDS}
+            ''', (key, user_id, plan, chat_id, message_id, vpn_username, vpn_password, vpn_key, panel_node)).fetchone()
+            return _job(job), True
+
+    # Subscription expiry notices
+
+    def get_pending_expiries(self, stage, after, until, limit):
+        """Subscriptions waiting for a reminder (stage 0) or the expiry (stage 1), by end_date.
+
+        Pages through the partial index of pending rows: (end_date, id) greater than `after`
+        (None for the start) and end_date <= `until`. Returns [(id, user_id, end_date)].
+        """
+        pending = 'expiry_stage = 0' if stage == 0 else 'expiry_stage < 2'
+        after_end_date, after_id = after or ('', 0)
+        with self._lock:
+            return self._conn.execute(f'''
+                SELECT id, user_id, end_date FROM subscriptions
+                WHERE {pending} AND end_date <= ? AND (end_date, id) > (?, ?)
+                ORDER BY end_date, id
+                LIMIT ?
+            ''', (until, after_end_date, after_id, limit)).fetchall()
+
+    def mark_subscriptions_reminded(self, subscription_ids):
+        """Move subscriptions past their reminder.
+
+        Returns (user_id, plan, end_date) for those that are still their user's latest
+        subscription; a user who has already renewed gets no reminder.
+        """
+        marks = ','.join('?' * len(subscription_ids))
+        with self._lock, self._conn:
+            rows = self._conn.execute(f'''
+                SELECT s.user_id, s.plan, s.end_date FROM subscriptions s
+                WHERE s.id IN ({marks}) AND s.expiry_stage = 0
+                  AND NOT EXISTS (SELECT 1 FROM subscriptions l WHERE l.user_id = s.user_id AND l.end_date > s.end_date)
+            ''', subscription_ids).fetchall()
+            self._conn.execute(f"UPDATE subscriptions SET expiry_stage = 1 WHERE id IN ({marks}) AND expiry_stage = 0",
+                               subscription_ids)
+            return rows
+
+    def expire_subscriptions(self, subscription_ids, now):
+        """Move ended subscriptions to their final stage and mark users left without one as expired.
+
+        Returns (user_id, plan, end_date) per user who lost access; users with a
+        subscription ending after `now` keep their status.
+        """
+        marks = ','.join('?' * len(subscription_ids))
+        with self._lock, self._conn:
+            rows = self._conn.execute(f'''
+                SELECT s.user_id, s.plan, MAX(s.end_date) FROM subscriptions s
+                WHERE s.id IN ({marks}) AND s.expiry_stage < 2
+                  AND NOT EXISTS (SELECT 1 FROM subscriptions l WHERE l.user_id = s.user_id AND l.end_date > ?)
+                GROUP BY s.user_id
+            ''', (*subscription_ids, now)).fetchall()
+            self._conn.execute(f"UPDATE subscriptions SET expiry_stage = 2 WHERE id IN ({marks}) AND expiry_stage < 2",
+                               subscription_ids)
+            self._conn.executemany("UPDATE users SET subscription_status = 'expired' WHERE user_id = ?",
+                                   ((row[0],) for row in rows))
+            return rows
+
+    # Bulk reads for admin broadcasts and exports
+
+    def count_broadcast_recipients(self):
+        """Number of users with an active subscription."""
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM ({_RECIPIENTS})", (0, -1)).fetchone()[0]
+
+    def get_broadcast_recipients(self, after_user_id, limit):
+        """Get user_ids with an active subscription, paging by user_id."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(_RECIPIENTS, (after_user_id, limit)).fetchall()]
+
+    def count_rows(self, table):
+        """Number of rows an export of `table` will write."""
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {_export_table(table)}").fetchone()[0]
+
+    def iter_export(self, table, batch_size=1000):
+        """Yield the column names, then batches of rows of `table`, streamed with fetchmany.
+
+        The cursor keeps one read snapshot for the whole export; use a dedicated connection.
+        """
+        columns = EXPORT_COLUMNS[_export_table(table)]
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+        try:
+            yield columns
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+# Active subscription through the current_subscription_id pointer, with the same
+# index fallback as get_active_subscription for users the backfill has not reached
+_RECIPIENTS = '''
+    SELECT u.user_id FROM users u
+    JOIN subscriptions s ON s.id = COALESCE(u.current_subscription_id, (
+        SELECT id FROM subscriptions WHERE user_id = u.user_id ORDER BY end_date DESC LIMIT 1
+    ))
+    WHERE u.user_id > ? AND s.end_date > datetime('now')
+    ORDER BY u.user_id
+    LIMIT ?
+'''
+
+# Columns written by admin exports; panel passwords and keys are never exported
+EXPORT_COLUMNS = {
+    'users': ('user_id', 'username', 'first_name', 'last_name', 'referral_code', 'referred_by', 'created_at'),
+    'subscriptions': ('id', 'user_id', 'plan', 'device_limit', 'vpn_username', 'start_date', 'end_date',
+                      'panel_node', 'panel_status', 'traffic_used', 'panel_synced_at'),
+}
+
+def _export_table(table):
+    if table not in EXPORT_COLUMNS:
+        raise ValueError(f"Unknown export table: {table}")
+    return table
+
+PURCHASE_JOB_COLUMNS = ('id', 'user_id', 'plan', 'chat_id', 'message_id', 'vpn_username', 'vpn_password', 'vpn_key',
+                        'status', 'create_sent', 'attempts', 'last_error', 'panel_node', 'extends_end_date')
+_JOB_FIELDS = ', '.join(PURCHASE_JOB_COLUMNS)
+
+def _job(row):
+    return dict(zip(PURCHASE_JOB_COLUMNS, row))
+
+_database = None
+_database_lock = threading.Lock()
+
+def get_database():
+    """Get the process-wide Database instance, opening it on first use."""
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = Database()
+    return _database
+
+# Module-level helpers kept for existing callers; they share one connection.
+
+def create_tables():
+    """Create necessary tables if they don't exist."""
+    get_database().create_tables()
+
+def add_user(user_id, username, first_name, last_name, referral_code=None, referred_by=None):
+    """Add a new user to the database."""
+    get_database().add_user(user_id, username, first_name, last_name, referral_code, referred_by)
+
+def get_user(user_id):
+    """Get user information by user_id."""
+    return get_database().get_user(user_id)
+
+def update_subscription(user_id, plan, device_limit, end_date, vpn_username="", vpn_password="", vpn_key=""):
+    """Update user's subscription."""
+    get_database().update_subscription(user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key)
+
+def get_referral_code(user_id):
+    """Generate or get referral code for user."""
+    return get_database().get_referral_code(user_id)
 
 def get_active_subscription(user_id):
     """Get user's active subscription with VPN details."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT plan, device_limit, vpn_username, vpn_password, vpn_key, end_date
-        FROM subscriptions
-        WHERE user_id = ? AND end_date > datetime('now')
-        ORDER BY end_date DESC
-        LIMIT 1
-    ''', (user_id,))
-
-    subscription = cursor.fetchone()
-    conn.close()
-    return subscription
\ No newline at end of file
+    return get_database().get_active_subscription(user_id)
+
+def count_users():
+    """Get total number of users."""
+    return get_database().count_users()
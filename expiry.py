@@ -0,0 +1,163 @@
+# expiry.py
+# Scheduler for renewal reminders and subscription expiry, driven by an in-memory queue of due dates
+
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime
+from config import EXPIRY_REMIND_BEFORE, EXPIRY_LOOKAHEAD, EXPIRY_BATCH_SIZE, EXPIRY_TICK, EXPIRY_NOTIFY_GRACE
+
+logger = logging.getLogger(__name__)
+
+REMINDER = 0
+EXPIRY = 1
+
+def _timestamp(end_date):
+    try:
+        return datetime.fromisoformat(end_date).timestamp()
+    except (TypeError, ValueError):
+        # An unreadable date is treated as already passed
+        return 0.0
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+class ExpiryScheduler:
+    """Fires renewal reminders and expiries at each subscription's due time.
+
+    Pending subscriptions live in two partial (end_date, id) indexes, one per event;
+    a row leaves its index once the event fires. Only events due within `lookahead`
+    seconds are held in a min-heap, loaded by keyset cursors one page per event per
+    tick, so memory and work per tick stay bounded however many subscriptions exist.
+    A restart rebuilds the heap from the start of the indexes, which begin at the
+    oldest unfired event.
+
+    Rows written behind a cursor (a plan shorter than the reminder offset, a manual
+    edit) are found when the cursors are rewound, once per `lookahead` seconds.
+
+    The `notify(kind, rows)` callback given to start() is awaited with kind 'reminder'
+    or 'expired' and rows of (user_id, plan, end_date); events more than `grace`
+    seconds late are recorded without a notification.
+    """
+
+    def __init__(self, db, remind_before=EXPIRY_REMIND_BEFORE, lookahead=EXPIRY_LOOKAHEAD,
+                 batch_size=EXPIRY_BATCH_SIZE, tick=EXPIRY_TICK, grace=EXPIRY_NOTIFY_GRACE):
+        self.db = db
+        self.notify = None
+        self.remind_before = remind_before
+        self.lookahead = lookahead
+        self.batch_size = batch_size
+        self.tick_interval = tick
+        self.grace = grace
+        self.stats = {'loaded': 0, 'reminded': 0, 'expired': 0, 'skipped': 0, 'late': 0}
+        self._heap = []
+        self._queued = set()
+        # Per event: (end_date, id) of the last loaded row, and the due time up to which
+        # every pending event is in the heap
+        self._cursors = {REMINDER: None, EXPIRY: None}
+        self._loaded_until = {REMINDER: 0.0, EXPIRY: 0.0}
+        self._rewind_at = 0.0
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    def _offset(self, stage):
+        return self.remind_before if stage == REMINDER else 0.0
+
+    async def start(self, notify=None):
+        self.notify = notify
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop firing events. Unfired events stay pending in the database."""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def queued(self):
+        """Events held in memory."""
+        return len(self._heap)
+
+    async def _load(self, stage, horizon):
+        """Load one page of pending events due by `horizon` into the heap."""
+        offset = self._offset(stage)
+        rows = await self.db.get_pending_expiries(stage, self._cursors[stage], _isoformat(horizon + offset),
+                                                  self.batch_size)
+        for subscription_id, user_id, end_date in rows:
+            if (stage, subscription_id) not in self._queued:
+                heapq.heappush(self._heap, (_timestamp(end_date) - offset, stage, subscription_id))
+                self._queued.add((stage, subscription_id))
+                self.stats['loaded'] += 1
+        if rows:
+            self._cursors[stage] = (rows[-1][2], rows[-1][0])
+        # A short page means the cursor has reached the horizon; otherwise rows due at the
+        # last loaded time may still follow
+        self._loaded_until[stage] = horizon if len(rows) < self.batch_size else _timestamp(rows[-1][2]) - offset
+
+    async def tick(self, now=None):
+        """Load the next pages and fire up to `batch_size` due events. Returns the number fired."""
+        now = time.time() if now is None else now
+        if now >= self._rewind_at:
+            self._cursors = {REMINDER: None, EXPIRY: None}
+            self._rewind_at = now + self.lookahead
+        for stage in (REMINDER, EXPIRY):
+            await self._load(stage, now + self.lookahead)
+
+        # Nothing later than a cursor that has not reached the horizon is known to be complete
+        until = min(now, *self._loaded_until.values())
+        due = {REMINDER: [], EXPIRY: []}
+        fired = 0
+        while self._heap and self._heap[0][0] <= until and fired < self.batch_size:
+            _, stage, subscription_id = heapq.heappop(self._heap)
+            self._queued.discard((stage, subscription_id))
+            due[stage].append(subscription_id)
+            fired += 1
+
+        if due[REMINDER]:
+            # No reminder after a renewal or for a subscription that has already ended
+            rows = [row for row in await self.db.mark_subscriptions_reminded(due[REMINDER]) if _timestamp(row[2]) > now]
+            self.stats['reminded'] += len(rows)
+            self.stats['skipped'] += len(due[REMINDER]) - len(rows)
+            await self._notify('reminder', rows, lambda row: _timestamp(row[2]) - self.remind_before, now)
+        if due[EXPIRY]:
+            rows = await self.db.expire_subscriptions(due[EXPIRY], _isoformat(now))
+            self.stats['expired'] += len(rows)
+            await self._notify('expired', rows, lambda row: _timestamp(row[2]), now)
+        return fired
+
+    async def _notify(self, kind, rows, due_at, now):
+        timely = [row for row in rows if due_at(row) >= now - self.grace]
+        self.stats['late'] += len(rows) - len(timely)
+        if timely and self.notify is not None:
+            try:
+                await self.notify(kind, timely)
+            except Exception:
+                logger.exception("Expiry notification failed")
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                fired = await self.tick()
+            except Exception:
+                logger.exception("Expiry scheduler tick failed")
+                fired = 0
+            if fired:
+                logger.info("Expiry scheduler fired %s events", fired)
+            if fired >= self.batch_size:
+                # A backlog: keep going, letting other tasks run in between
+                await asyncio.sleep(0)
+                continue
+            timeout = self.tick_interval
+            if self._heap:
+                timeout = max(0.0, min(timeout, self._heap[0][0] - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
@@ -0,0 +1,78 @@
+# keyboards.py
+# Render cache: static inline keyboards and plan listings built once and reused by every handler
+
+import logging
+import config
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+MAIN_MENU_TEXT = "Привет, {first_name}! Добро пожаловать в Blitz VPN Bot.\n\nВыберите действие:"
+PLANS_TEXT = "Выберите план подписки:"
+HELP_TEXT = "Помощь:\n\n- Профиль: Просмотр информации о вашем аккаунте\n- Реферальная ссылка: Получите ссылку для приглашения друзей\n- Купить подписку: Выберите и оплатите план\n\nЕсли есть вопросы, обратитесь в поддержку."
+
+
+def plan_button_text(plan, details):
+    """Button label for a subscription plan."""
+    device_text = f", {details['device_limit']} устройств" if details['device_limit'] else ", безлимит устройств"
+    traffic_text = f"{details['traffic_gb']}GB" if details['traffic_gb'] else "безлимит трафика"
+    return f"{plan.capitalize()} - {details['price']}$ ({traffic_text}{device_text}, {details['expiration_days']} дней)"
+
+
+class RenderCache:
+    """Keyboards built once and shared between all chats.
+
+    PTB 20 telegram objects are immutable after construction, so one markup instance can be
+    sent any number of times. Everything derived from the plan config is rebuilt on first use
+    after config.SUBSCRIPTION_PLANS is replaced (a config reload) or invalidate() is called.
+    """
+
+    def __init__(self, plans_source=None):
+        self._plans_source = plans_source or (lambda: config.SUBSCRIPTION_PLANS)
+        self._plans = None
+        self._plan_listing = None
+        self.builds = 0
+
+        back = InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')
+        self.back_to_menu = InlineKeyboardMarkup([[back]])
+        self.profile = InlineKeyboardMarkup([
+            [InlineKeyboardButton("Ключи", callback_data='show_keys')],
+            [back]
+        ])
+        menu = [
+            [InlineKeyboardButton("Профиль", callback_data='profile')],
+            [InlineKeyboardButton("Реферальная ссылка", callback_data='referral')],
+            [InlineKeyboardButton("Купить подписку", callback_data='buy_subscription')],
+            [InlineKeyboardButton("Помощь", callback_data='help')]
+        ]
+        self._main_menu_user = InlineKeyboardMarkup(menu)
+        self._main_menu_admin = InlineKeyboardMarkup(menu + [[InlineKeyboardButton("Админ панель", callback_data='admin_panel')]])
+
+    def main_menu(self, is_admin):
+        """Main menu keyboard; admins get the extra admin panel row."""
+        return self._main_menu_admin if is_admin else self._main_menu_user
+
+    def plans(self):
+        """Plan listing as (text, reply_markup), rebuilt if the plan config was reloaded."""
+        plans = self._plans_source()
+        if plans is not self._plans or self._plan_listing is None:
+            self._plan_listing = self._build_plans(plans)
+            self._plans = plans
+        return self._plan_listing
+
+    def invalidate(self):
+        """Drop everything derived from the plan config (call after changing it in place)."""
+        self._plans = None
+        self._plan_listing = None
+
+    def _build_plans(self, plans):
+        keyboard = [[InlineKeyboardButton(plan_button_text(plan, details), callback_data=f'buy_{plan}')]
+                    for plan, details in plans.items()]
+        keyboard.append(list(self.back_to_menu.inline_keyboard[0]))
+        self.builds += 1
+        logger.info("Plan keyboard rendered for %s plans", len(plans))
+        return PLANS_TEXT, InlineKeyboardMarkup(keyboard)
+
+
+# Shared render cache used by the bot handlers
+render_cache = RenderCache()
@@ -0,0 +1,197 @@
+# loadgen_updates.py
+# Load generator: feeds synthetic updates to the bot in polling and webhook mode and
+# reports throughput and end-to-end dispatch latency
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from stub_panel import StubPanel
+from stub_telegram import StubTelegram, make_callback_update, make_start_update, response_key
+
+# Default traffic mix: mostly menu navigation, as in production
+MIX = (
+    ('start', 0.2),
+    ('profile', 0.3),
+    ('help', 0.2),
+    ('back_to_menu', 0.2),
+    ('referral', 0.1),
+)
+WEBHOOK_SECRET = 'loadgen-secret'
+
+
+def make_updates(count, users, mix=MIX, first_id=1):
+    kinds, weights = zip(*mix)
+    updates = []
+    for update_id in range(first_id, first_id + count):
+        user_id = random.randint(1, users)
+        kind = random.choices(kinds, weights)[0]
+        if kind == 'start':
+            updates.append(make_start_update(update_id, user_id))
+        else:
+            updates.append(make_callback_update(update_id, user_id, kind))
+    # One reply is matched per update key, so keep keys unique within a run
+    seen, unique = set(), []
+    for update in updates:
+        key = response_key(update)
+        if key not in seen:
+            seen.add(key)
+            unique.append(update)
+    return unique
+
+
+def with_purchases(mix, share, plan='basic'):
+    """Replace `share` of the traffic with purchases of `plan`."""
+    if not share:
+        return mix
+    return tuple((kind, weight * (1 - share)) for kind, weight in mix) + ((f'buy_{plan}', share),)
+
+
+def start_bot(mode, telegram, panel, db_path, webhook_port, concurrent_updates=None, send_rate=0, extra_env=None):
+    env = dict(os.environ,
+               TELEGRAM_BOT_TOKEN='123456:loadgen',
+               TELEGRAM_API_BASE_URL=telegram.api_url,
+               BLITZ_API_BASE_URL=panel.base_url,
+               BLITZ_API_USERNAME='admin',
+               BLITZ_API_PASSWORD='admin',
+               DATABASE_FILE=db_path,
+               RECONCILE_INTERVAL='0',
+               BOT_MODE=mode,
+               WEBHOOK_URL=f"http://127.0.0.1:{webhook_port}/telegram",
+               WEBHOOK_LISTEN='127.0.0.1',
+               WEBHOOK_PORT=str(webhook_port),
+               WEBHOOK_SECRET_TOKEN=WEBHOOK_SECRET,
+               TELEGRAM_SEND_RATE=str(send_rate))
+    if concurrent_updates:
+        env['CONCURRENT_UPDATES'] = str(concurrent_updates)
+    env.update(extra_env or {})
+    return subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def feed_polling(telegram, updates, rate):
+    started = time.perf_counter()
+    for i, update in enumerate(updates):
+        if rate:
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        telegram.push_update(update)
+
+
+async def feed_webhook(telegram, updates, rate, port, concurrency):
+    url = f"http://127.0.0.1:{port}/telegram"
+    headers = {'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET}
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency)) as client:
+        # A request with the wrong secret must be rejected
+        rejected = await client.post(url, json=updates[0], headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+        assert rejected.status_code == 403, f"webhook accepted a bad secret token ({rejected.status_code})"
+
+        async def post(update):
+            async with semaphore:
+                telegram.call_soon(telegram.mark_sent, update, time.perf_counter())
+                await client.post(url, json=update, headers=headers)
+
+        started = time.perf_counter()
+        tasks = []
+        for i, update in enumerate(updates):
+            if rate:
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(update)))
+        await asyncio.gather(*tasks)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float('nan')
+
+
+def run_mode(mode, args):
+    telegram = StubTelegram()
+    panel = StubPanel(latency=args.panel_latency)
+    telegram.start()
+    panel.start()
+    webhook_port = args.webhook_port
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = start_bot(mode, telegram, panel, os.path.join(tmp, 'loadgen.db'), webhook_port,
+                        args.concurrent_updates, args.send_rate)
+        try:
+            if not telegram.ready.wait(30):
+                raise RuntimeError("bot did not start")
+            if mode == 'webhook':
+                _wait_for_port(webhook_port)
+
+            updates = make_updates(args.updates, args.users, with_purchases(MIX, args.purchases))
+            started = time.perf_counter()
+            if mode == 'webhook':
+                asyncio.run(feed_webhook(telegram, updates, args.rate, webhook_port, args.concurrency))
+            else:
+                asyncio.run(feed_polling(telegram, updates, args.rate))
+
+            deadline = time.monotonic() + args.timeout
+            while len(telegram.latencies) < len(updates) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            elapsed = time.perf_counter() - started
+        finally:
+            bot.terminate()
+            bot.wait()
+            telegram.stop()
+            panel.stop()
+
+    latencies = list(telegram.latencies.values())
+    return {
+        'mode': mode,
+        'updates': len(updates),
+        'answered': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+
+def _wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"webhook listener on port {port} did not come up")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare polling and webhook throughput and latency")
+    parser.add_argument('--mode', choices=['polling', 'webhook', 'both'], default='both')
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--rate', type=float, default=0, help="updates per second, 0 = as fast as possible")
+    parser.add_argument('--concurrency', type=int, default=40, help="parallel webhook requests")
+    parser.add_argument('--webhook-port', type=int, default=8443)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--purchases', type=float, default=0, help="share of updates that are purchases")
+    parser.add_argument('--panel-latency', type=float, default=0, help="stub panel latency per request, s")
+    parser.add_argument('--concurrent-updates', type=int, default=None, help="CONCURRENT_UPDATES for the bot")
+    parser.add_argument('--send-rate', type=float, default=0,
+                        help="TELEGRAM_SEND_RATE for the bot; 0 sends unshaped (the stub has no flood limits)")
+    args = parser.parse_args()
+
+    modes = ['polling', 'webhook'] if args.mode == 'both' else [args.mode]
+    print(f"{'mode':<10}{'answered':>12}{'updates/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for mode in modes:
+        r = run_mode(mode, args)
+        print(f"{r['mode']:<10}{r['answered']:>6}/{r['updates']:<5}{r['throughput']:>12.0f}"
+              f"{r['p50'] * 1000:>10.1f}{r['p95'] * 1000:>10.1f}{r['p99'] * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
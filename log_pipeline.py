@@ -0,0 +1,136 @@
+# log_pipeline.py
+# Logging pipeline: records go through a queue to a writer thread, with JSON output and per-logger sampling and rate limits
+
+import json
+import logging
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_SAMPLE, LOG_RATE_LIMIT, LOG_RATE_BURST
+from ratelimit import TokenBucket
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RECORD_FIELDS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, `extra` fields and the traceback."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LoggerPolicy(logging.Filter):
+    """Per-logger sampling and rate limiting, applied before a record is queued.
+
+    `sample` maps logger names to the share of records below WARNING that are kept
+    (a name covers its children, so 'httpx' also covers 'httpx._client'). Every logger
+    also gets its own token bucket of `rate` records per second; records over it are
+    dropped and counted, and the next record let through carries the count in its
+    `suppressed` field. Errors and above are never sampled or limited.
+    """
+
+    def __init__(self, sample=None, rate=0, burst=None):
+        super().__init__()
+        self.sample = dict(sample or {})
+        self.rate = rate
+        self.burst = burst
+        self.dropped = {'sampled': 0, 'rate_limited': 0}
+        self._shares = {}
+        self._buckets = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        name = record.name
+        if record.levelno < logging.WARNING:
+            share = self._shares.get(name)
+            if share is None:
+                share = self._shares[name] = self._share(name)
+            if share < 1 and random.random() >= share:
+                self.dropped['sampled'] += 1
+                return False
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = self._buckets[name] = TokenBucket(self.rate, self.burst)
+            if not bucket.try_acquire():
+                self._suppressed[name] = self._suppressed.get(name, 0) + 1
+                self.dropped['rate_limited'] += 1
+                return False
+            suppressed = self._suppressed.pop(name, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+    def _share(self, name):
+        while True:
+            if name in self.sample:
+                return self.sample[name]
+            if '.' not in name:
+                return 1.0
+            name = name.rsplit('.', 1)[0]
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the writer thread.
+
+    The stock prepare() merges the message with its arguments on the calling thread;
+    here the record is queued as is, so `logger.info("... %s", value)` costs the event
+    loop little more than a queue put. Arguments are formatted a moment later, so pass
+    values rather than objects that are about to change.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def parse_sample(text):
+    """'httpx=0.01,api_client=0.1' -> {'httpx': 0.01, 'api_client': 0.1}."""
+    sample = {}
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        name, _, share = item.partition('=')
+        sample[name.strip()] = min(1.0, max(0.0, float(share)))
+    return sample
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, path=LOG_FILE, sample=LOG_SAMPLE, rate=LOG_RATE_LIMIT,
+                  burst=LOG_RATE_BURST):
+    """Route the root logger through a queue to a background writer. Returns (listener, policy).
+
+    Call listener.stop() on exit: it writes out everything still queued.
+    """
+    output = logging.FileHandler(path, encoding='utf-8') if path else logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    policy = LoggerPolicy(parse_sample(sample) if isinstance(sample, str) else sample, rate, burst)
+    handler.addFilter(policy)
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener = QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    return listener, policy
+
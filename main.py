@@ -1,53 +1,109 @@
 # main.py
 # Main Telegram bot file
 
+import asyncio
 import logging
-import sqlite3
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import os
+import secrets
+import sys
+from datetime import datetime
+from telegram import Update
+from telegram.error import Forbidden, TelegramError
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from config import TELEGRAM_BOT_TOKEN, SUBSCRIPTION_PLANS, ADMIN_IDS
-from database import create_tables, add_user, get_user, update_subscription, get_referral_code, get_active_subscription
-from config import DATABASE_FILE
-from api_client import api_client
-import random
-import string
-
-# Enable logging
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+from config import (TELEGRAM_BOT_TOKEN, SUBSCRIPTION_PLANS, ADMIN_IDS, RECONCILE_INTERVAL, TELEGRAM_API_BASE_URL,
+                    BOT_MODE, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN,
+                    WEBHOOK_MAX_CONNECTIONS, UPDATE_QUEUE_SIZE, CONCURRENT_UPDATES,
+                    TELEGRAM_SEND_RATE, TELEGRAM_CHAT_SEND_RATE, TELEGRAM_CHAT_SEND_BURST, TELEGRAM_GROUP_SENDS_PER_MINUTE,
+                    RATE_LIMIT_NAVIGATION, RATE_LIMIT_NAVIGATION_BURST, RATE_LIMIT_PURCHASE, RATE_LIMIT_PURCHASE_BURST,
+                    RATE_LIMIT_ADMIN, RATE_LIMIT_ADMIN_BURST, RATE_LIMIT_PANEL, RATE_LIMIT_PANEL_BURST, RATE_LIMIT_MAX_KEYS,
+                    METRICS_LISTEN, METRICS_PORT)
+from async_database import async_db
+from api_client import panel_pool
+from reconcile import Reconciler
+from update_processor import PerUserUpdateProcessor, UpdateQueue
+from purchases import PurchaseWorkerPool
+from warm_pool import WarmPool
+from expiry import ExpiryScheduler
+from ratelimit import KeyedRateLimiter
+from send_scheduler import SendScheduler, NOTIFICATION, BULK
+from user_writes import UserWriteBuffer
+from bulk import Broadcaster, export, EXPORT_FORMATS
+from database import EXPORT_COLUMNS
+from metrics import Gauge, MetricsServer
+from log_pipeline import setup_logging
+from keyboards import render_cache, MAIN_MENU_TEXT, HELP_TEXT
+from router import CallbackRouter, timing, allow_users, rate_limit
+
+# Logging is configured in main(): records go through a queue to a writer thread
 logger = logging.getLogger(__name__)
 
-def generate_password(length=12):
-    """Generate a random password with only letters and digits."""
-    characters = string.ascii_letters + string.digits  # Only letters and digits, no special characters
-    return ''.join(random.choice(characters) for i in range(length))
+# Background job syncing local subscriptions with panel state
+reconciler = Reconciler(async_db, panel_pool)
+
+# Ready panel accounts per plan, so most purchases finish without waiting for the panel
+warm_pool = WarmPool(async_db, panel_pool)
+
+# Worker pool running queued purchases; new users go to the panel node with the most headroom
+purchase_pool = PurchaseWorkerPool(async_db, panel_pool, warm_pool=warm_pool)
+
+# Renewal reminders and expiry of ended subscriptions
+expiry_scheduler = ExpiryScheduler(async_db)
+
+# /start upserts, written in batches; returning users are skipped
+user_writes = UserWriteBuffer(async_db)
+
+# Admin broadcasts to subscribers
+broadcaster = Broadcaster(async_db)
+
+# Local Prometheus endpoint and the queue depths it reports; sizes are read at scrape time
+metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT)
+UPDATE_QUEUE_SIZE_GAUGE = Gauge('bot_update_queue_size', "Received updates waiting to be processed")
+SEND_QUEUE_SIZE_GAUGE = Gauge('bot_send_queue_size', "Outgoing Bot API requests waiting in the send scheduler")
+DB_QUEUE_SIZE_GAUGE = Gauge('sqlite_queue_size', "Database operations waiting for a database thread", ['executor'])
+USER_WRITES_PENDING_GAUGE = Gauge('bot_user_writes_pending', "User upserts waiting to be written")
+BROADCAST_REMAINING_GAUGE = Gauge('bot_broadcast_remaining', "Recipients the running broadcast has not reached yet")
+PANEL_UP_GAUGE = Gauge('blitz_panel_up', "1 if the panel node passed its last health check", ['node'])
+PANEL_HEADROOM_GAUGE = Gauge('blitz_panel_headroom_percent', "Placement headroom of the panel node", ['node'])
+EXPIRY_QUEUED_GAUGE = Gauge('bot_expiry_events_queued', "Reminders and expiries due soon, held by the expiry scheduler")
+LOG_DROPPED_GAUGE = Gauge('log_records_dropped', "Log records dropped by sampling or per-logger rate limits", ['reason'])
+
+# Per-user limits by action class; purchases also share one panel-wide limit
+rate_limiter = KeyedRateLimiter(
+    {'navigation': (RATE_LIMIT_NAVIGATION, RATE_LIMIT_NAVIGATION_BURST),
+     'purchase': (RATE_LIMIT_PURCHASE, RATE_LIMIT_PURCHASE_BURST),
+     'admin': (RATE_LIMIT_ADMIN, RATE_LIMIT_ADMIN_BURST)},
+    global_limits={'panel': (RATE_LIMIT_PANEL, RATE_LIMIT_PANEL_BURST)},
+    shared={'purchase': 'panel'},
+    max_keys=RATE_LIMIT_MAX_KEYS)
+
+# Replies to rejected button presses: answering the callback is the only API call made
+REJECTED_TEXTS = {
+    'throttled': "Слишком много нажатий, подождите немного.",
+    'dropped': "Сервис сейчас перегружен, попробуйте через минуту.",
+}
+ACTION_NAMES = {'navigation': "навигация", 'purchase': "покупки", 'admin': "админ"}
 
 def get_main_menu_keyboard(user_id):
     """Get main menu keyboard."""
-    keyboard = [
-        [InlineKeyboardButton("Профиль", callback_data='profile')],
-        [InlineKeyboardButton("Реферальная ссылка", callback_data='referral')],
-        [InlineKeyboardButton("Купить подписку", callback_data='buy_subscription')],
-        [InlineKeyboardButton("Помощь", callback_data='help')]
-    ]
-    if user_id in ADMIN_IDS:
-        keyboard.append([InlineKeyboardButton("Админ панель", callback_data='admin_panel')])
-
-    return InlineKeyboardMarkup(keyboard)
+    return render_cache.main_menu(user_id in ADMIN_IDS)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /start command."""
     user = update.effective_user
     user_id = user.id
+    if rate_limiter.check(user_id, 'navigation'):
+        # Repeated /start spam: drop without touching the database or replying
+        return
     username = user.username
     first_name = user.first_name
     last_name = user.last_name
 
-    # Add user to database
-    add_user(user_id, username, first_name, last_name)
+    # Add user to database (written in the next batch)
+    user_writes.add_user(user_id, username, first_name, last_name)
 
     reply_markup = get_main_menu_keyboard(user_id)
 
-    text = f"Привет, {first_name}! Добро пожаловать в Blitz VPN Bot.\n\nВыберите действие:"
+    text = MAIN_MENU_TEXT.format(first_name=first_name)
 
     await update.message.reply_text(text, reply_markup=reply_markup)
 
@@ -58,51 +114,18 @@ async def show_main_menu(query):
 
     reply_markup = get_main_menu_keyboard(user_id)
 
-    text = f"Привет, {user.first_name}! Добро пожаловать в Blitz VPN Bot.\n\nВыберите действие:"
+    text = MAIN_MENU_TEXT.format(first_name=user.first_name)
 
     await query.edit_message_text(text, reply_markup=reply_markup)
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle button presses."""
-    query = update.callback_query
-    await query.answer()
-
-    user_id = query.from_user.id
-    data = query.data
-
-    if data == 'profile':
-        await show_profile(query, user_id)
-    elif data == 'referral':
-        await show_referral(query, user_id)
-    elif data == 'buy_subscription':
-        await show_subscription_plans(query)
-    elif data == 'help':
-        await show_help(query)
-    elif data == 'admin_panel':
-        if user_id in ADMIN_IDS:
-            await show_admin_panel(query)
-        else:
-            keyboard = [[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text("У вас нет доступа к админ панели.", reply_markup=reply_markup)
-    elif data == 'back_to_menu':
-        await show_main_menu(query)
-    elif data == 'show_keys':
-        await show_keys(query, user_id)
-    elif data.startswith('buy_'):
-        plan = data.split('_')[1]
-        await process_purchase(query, user_id, plan)
-
-async def show_profile(query, user_id):
+async def show_profile(query):
     """Show user profile."""
-    user = get_user(user_id)
-    subscription = get_active_subscription(user_id)
+    user_id = query.from_user.id
+    await user_writes.ensure(user_id)
+    user = await async_db.get_user(user_id)
+    subscription = await async_db.get_active_subscription(user_id)
     
-    keyboard = [
-        [InlineKeyboardButton("Ключи", callback_data='show_keys')],
-        [InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = render_cache.profile
     
     if user:
         status = "Активна" if subscription else "Не активирована"
@@ -112,12 +135,12 @@ async def show_profile(query, user_id):
 
     await query.edit_message_text(text=text, reply_markup=reply_markup)
 
-async def show_keys(query, user_id):
+async def show_keys(query):
     """Show user's VPN keys."""
-    subscription = get_active_subscription(user_id)
+    user_id = query.from_user.id
+    subscription = await async_db.get_active_subscription(user_id)
     
-    keyboard = [[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = render_cache.back_to_menu
     
     if subscription:
         plan, device_limit, vpn_username, vpn_password, vpn_key, end_date = subscription
@@ -130,13 +153,14 @@ async def show_keys(query, user_id):
 
     await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode='HTML')
 
-async def show_referral(query, user_id):
+async def show_referral(query):
     """Show referral link."""
-    referral_code = get_referral_code(user_id)
+    user_id = query.from_user.id
+    await user_writes.ensure(user_id)
+    referral_code = await async_db.get_referral_code(user_id)
     referral_link = f"https://t.me/your_bot_username?start={referral_code}"
     
-    keyboard = [[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = render_cache.back_to_menu
     
     text = f"Ваша реферальная ссылка:\n{referral_link}\n\nПригласите друзей и получите бонусы!"
 
@@ -144,159 +168,353 @@ async def show_referral(query, user_id):
 
 async def show_subscription_plans(query):
     """Show available subscription plans."""
-    keyboard = []
-    for plan, details in SUBSCRIPTION_PLANS.items():
-        device_text = f", {details['device_limit']} устройств" if details['device_limit'] else ", безлимит устройств"
-        traffic_text = f"{details['traffic_gb']}GB" if details['traffic_gb'] else "безлимит трафика"
-        button_text = f"{plan.capitalize()} - {details['price']}$ ({traffic_text}{device_text}, {details['expiration_days']} дней)"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f'buy_{plan}')])
-
-    # Add back button
-    keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    text = "Выберите план подписки:"
-
+    text, reply_markup = render_cache.plans()
     await query.edit_message_text(text=text, reply_markup=reply_markup)
 
-async def process_purchase(query, user_id, plan):
-    """Process subscription purchase."""
+async def process_purchase(query, plan):
+    """Bind a warm account or queue a subscription purchase; a queued job updates the message when it finishes."""
+    user_id = query.from_user.id
     details = SUBSCRIPTION_PLANS.get(plan)
     if not details:
-        keyboard = [[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = render_cache.back_to_menu
         await query.edit_message_text("Неверный план.", reply_markup=reply_markup)
         return
 
-    # Generate username and password
-    username = f"user_{user_id}_{plan}"
-    password = generate_password()
-
-    # Create user via API
-    try:
-        logger.info(f"Starting purchase process for user {user_id}, plan: {plan}")
-        
-        # Prepare traffic_limit - API might expect GB instead of bytes
-        traffic_limit_gb = details['traffic_gb'] if details['traffic_gb'] else 0
-        
-        response = api_client.create_user(
-            username=username,
-            password=password,
-            traffic_limit=traffic_limit_gb,  # Send GB directly
-            expiration_days=details['expiration_days'],
-            unlimited=details['device_limit'] is None,  # True if unlimited devices
-            note=f"Telegram user {user_id} - Plan: {plan}"
-        )
-        
-        logger.info(f"User creation response: {response}")
-        
-        # Update database after successful creation
-        from datetime import datetime, timedelta
-        end_date = datetime.now() + timedelta(days=details['expiration_days'])
-        
-        # Get user URI
-        uri_response = None
-        vpn_key = ""
-        try:
-            uri_response = api_client.get_user_uri(username)
-            logger.info(f"URI response: {uri_response}")
-            
-            # Use IPv4 key only
-            if uri_response.get('ipv4'):
-                vpn_key = uri_response['ipv4']
-        except Exception as e:
-            logger.error(f"Error getting user URI: {e}")
-        
-        # Save subscription to database with VPN credentials
-        update_subscription(user_id, plan, details['device_limit'], end_date.isoformat(), 
-                           vpn_username=username, vpn_password=password, vpn_key=vpn_key)
-        
-        # Get user URI
+    logger.info("Starting purchase process for user %s, plan: %s", user_id, plan, extra={'user_id': user_id, 'plan': plan})
+    await user_writes.ensure(user_id)
+    job, _ = await purchase_pool.submit(user_id, plan, query.message.chat_id, query.message.message_id)
+    if job['status'] == 'done':
+        await query.edit_message_text(purchase_result_text(job), reply_markup=render_cache.back_to_menu, parse_mode='HTML')
+        return
+    text = "⏳ Оформляем подписку...\n\nСообщение обновится, как только всё будет готово."
+    if not panel_pool.is_available('users'):
+        text += "\n\n⚠️ Панель VPN сейчас недоступна, подписка будет оформлена автоматически после её восстановления."
+    await query.edit_message_text(text)
+
+def purchase_result_text(job):
+    """Message shown to the user when a purchase job finishes."""
+    if job['status'] == 'failed':
+        return f"❌ Ошибка при активации подписки:\n{job['last_error']}\n\nПожалуйста, свяжитесь с поддержкой."
+    title = "✅ Подписка продлена!" if job.get('extends_end_date') else "✅ Подписка активирована!"
+    if job['vpn_key']:
+        return f"{title}\n\n📝 <b>Ваш ключ:</b>\n<code>{job['vpn_key']}</code>\n\nСохраните его в безопасном месте."
+    # If no keys available, show username and password as fallback
+    logger.warning("No key available for %s", job['vpn_username'], extra={'job_id': job['id']})
+    return f"{title}\n\n👤 <b>Ваше имя пользователя:</b> {job['vpn_username']}\n🔑 <b>Пароль:</b> {job['vpn_password']}\n\n⚠️ Используйте эти учетные данные для входа в VPN."
+
+async def notify_purchase(bot, job):
+    """Replace the "processing" message with the purchase result."""
+    reply_markup = render_cache.back_to_menu
+    await bot.edit_message_text(text=purchase_result_text(job), chat_id=job['chat_id'], message_id=job['message_id'],
+                                reply_markup=reply_markup, parse_mode='HTML',
+                                rate_limit_args=NOTIFICATION if bot.rate_limiter else None)
+
+def expiry_text(kind, plan, end_date):
+    if kind == 'reminder':
+        ends = datetime.fromisoformat(end_date).strftime('%d.%m.%Y %H:%M')
+        return (f"⏳ Ваша подписка {plan} заканчивается {ends}.\n\n"
+                "Чтобы не остаться без VPN, продлите её в разделе «Купить подписку».")
+    return f"⌛ Срок вашей подписки {plan} истёк.\n\nЧтобы снова пользоваться VPN, оформите новую подписку в разделе «Купить подписку»."
+
+async def notify_expiry(bot, kind, subscriptions):
+    """Send renewal reminders or expiry notices; they yield to replies and purchase results."""
+    priority = BULK if bot.rate_limiter else None
+
+    async def send(user_id, plan, end_date):
         try:
-            if not uri_response:  # Only get if not already fetched
-                uri_response = api_client.get_user_uri(username)
-                logger.info(f"URI response: {uri_response}")
-            
-            key = vpn_key if vpn_key else None
-            
-            # Use IPv4 key only
-            if not key and uri_response.get('ipv4'):
-                key = uri_response['ipv4']
-            
-            if key:
-                keyboard = [[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                text = f"✅ Подписка активирована!\n\n📝 <b>Ваш ключ:</b>\n<code>{key}</code>\n\nСохраните его в безопасном месте."
-            else:
-                # If no keys available, show username and password as fallback
-                logger.warning(f"No keys available in response: {uri_response}")
-                keyboard = [[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                text = f"✅ Подписка активирована!\n\n👤 <b>Ваше имя пользователя:</b> {username}\n🔑 <b>Пароль:</b> {password}\n\n⚠️ Используйте эти учетные данные для входа в VPN."
-        except Exception as e:
-            logger.error(f"Error getting user URI: {e}")
-            # If URI fails but user was created, still show success with credentials
-            keyboard = [[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            text = f"✅ Подписка активирована!\n\n👤 <b>Ваше имя пользователя:</b> {username}\n🔑 <b>Пароль:</b> {password}\n\nПожалуйста, используйте эти учетные данные для входа."
-            
-    except Exception as e:
-        logger.error(f"Error processing purchase: {e}")
-        keyboard = [[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        text = f"❌ Ошибка при активации подписки:\n{str(e)}\n\nПожалуйста, свяжитесь с поддержкой."
+            await bot.send_message(user_id, expiry_text(kind, plan, end_date), reply_markup=render_cache.back_to_menu,
+                                   rate_limit_args=priority)
+        except Forbidden:
+            # The user blocked the bot
+            pass
+        except TelegramError as e:
+            logger.warning("Expiry notice to %s failed: %s", user_id, e)
 
-    await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode='HTML')
+    await asyncio.gather(*(send(*row) for row in subscriptions))
 
 async def show_help(query):
     """Show help information."""
-    keyboard = [[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = render_cache.back_to_menu
     
-    text = "Помощь:\n\n- Профиль: Просмотр информации о вашем аккаунте\n- Реферальная ссылка: Получите ссылку для приглашения друзей\n- Купить подписку: Выберите и оплатите план\n\nЕсли есть вопросы, обратитесь в поддержку."
-    await query.edit_message_text(text=text, reply_markup=reply_markup)
+    await query.edit_message_text(text=HELP_TEXT, reply_markup=reply_markup)
 
 async def show_admin_panel(query):
     """Show admin panel."""
     try:
-        # Get server status
-        status = api_client.get_server_status()
-        online_users = status.get('online_users', 'N/A')
-        cpu_usage = status.get('cpu_usage', 'N/A')
-        ram_usage = status.get('ram_usage', 'N/A')
-
         # Get user count from database
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM users')
-        user_count = cursor.fetchone()[0]
-        conn.close()
-
-        keyboard = [[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        user_count = await async_db.count_users()
+
+        reply_markup = render_cache.back_to_menu
         
-        text = f"Админ панель:\n\nОбщее количество пользователей: {user_count}\nОнлайн пользователей: {online_users}\nCPU: {cpu_usage}\nRAM: {ram_usage}"
+        cache = panel_pool.cache_stats()
+
+        text = f"Админ панель:\n\nОбщее количество пользователей: {user_count}"
+        # Server status of every panel node as of its last health check
+        for node in panel_pool.stats():
+            if node['healthy']:
+                text += (f"\n{node['name']}: онлайн {node['online_users']}, CPU {node['cpu_usage']}, "
+                         f"RAM {node['ram_usage']}, запас {node['headroom']:.0f}%")
+            else:
+                text += f"\n{node['name']}: ⚠️ недоступна ({node['error'] or 'нет данных'})"
+        text += f"\n\nКэш API: попаданий {cache['hits']}, промахов {cache['misses']}, объединено {cache['coalesced']}"
+        jobs = await async_db.count_purchase_jobs()
+        text += f"\nПокупки: в очереди {jobs.get('pending', 0)}, в работе {jobs.get('running', 0)}, ошибок {jobs.get('failed', 0)}"
+        warm = await warm_pool.levels_report()
+        if warm:
+            text += "\nГотовые аккаунты: " + ", ".join(
+                f"{plan} {counts['ready']}" + (f" (+{counts['creating']})" if counts['creating'] else "")
+                for plan, counts in warm.items())
+            text += f", выдано сразу {warm_pool.stats['claimed']}, через очередь {warm_pool.stats['missed']}"
+        expiry = expiry_scheduler.stats
+        text += (f"\nОкончание подписок: напоминаний {expiry['reminded']}, истекло {expiry['expired']}, "
+                 f"в ближайшей очереди {expiry_scheduler.queued()}")
+        sync = reconciler.progress()
+        if sync['total']:
+            state = "идёт" if sync['running'] else "завершена"
+            text += f"\nСверка с панелью ({state}): {sync['processed']}/{sync['total']} ({sync['percent']:.0f}%), нет на панели: {sync['missing']}, ошибок: {sync['failed']}"
+        scheduler = query.get_bot().rate_limiter
+        if scheduler is not None:
+            sends = scheduler.stats
+            text += f"\nИсходящие сообщения: в очереди {scheduler.queued()}, отправлено {sends['sent']}, правок объединено {sends['coalesced']}, ответов 429: {sends['flood_waits']}"
+        limits = rate_limiter.stats()['actions']
+        text += "\nОграничение частоты (отклонено / общий лимит): " + ", ".join(
+            f"{ACTION_NAMES[name]} {counters['throttled']} / {counters['dropped']}" for name, counters in limits.items())
+        if broadcaster.running:
+            text += "\n" + broadcaster.current.text("Рассылка")
+        text += "\n\nКоманды: /broadcast <текст>, /broadcast_stop, /export <users|subscriptions> [csv|jsonl]"
+        slowest = list(router.latency_report().items())[:3]
+        if slowest:
+            text += "\n\nСамые медленные кнопки (p95): " + ", ".join(f"{name} {stats['p95_ms']:.0f} мс" for name, stats in slowest)
     except Exception as e:
-        keyboard = [[InlineKeyboardButton("Вернуться в меню", callback_data='back_to_menu')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = render_cache.back_to_menu
         text = f"Ошибка получения данных: {e}"
 
     await query.edit_message_text(text=text, reply_markup=reply_markup)
 
-def main() -> None:
-    """Start the bot."""
-    # Create database tables
-    create_tables()
+async def deny_admin_panel(call):
+    """Reply to a non-admin who opened the admin panel."""
+    await call.answer()
+    await call.query.edit_message_text("У вас нет доступа к админ панели.", reply_markup=render_cache.back_to_menu)
+
+async def rejected(call, reason):
+    """Reply to a rate-limited button press without touching the database or the panel."""
+    await call.answer(REJECTED_TEXTS[reason])
+
+navigation = [rate_limit(rate_limiter, 'navigation', rejected)]
+
+# Callback data -> handler; every route is timed and rate limited by its action class
+router = CallbackRouter([timing])
+router.add('profile', show_profile, navigation)
+router.add('referral', show_referral, navigation)
+router.add('buy_subscription', show_subscription_plans, navigation)
+router.add('help', show_help, navigation)
+router.add('admin_panel', show_admin_panel,
+           [allow_users(ADMIN_IDS, deny_admin_panel), rate_limit(rate_limiter, 'admin', rejected)])
+router.add('back_to_menu', show_main_menu, navigation)
+router.add('show_keys', show_keys, navigation)
+router.add('buy_{plan}', process_purchase, [rate_limit(rate_limiter, 'purchase', rejected)])
+
+# Bots may upload documents up to 50 MB
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+def admin_command(update):
+    """True if the command comes from an admin within the admin rate limit."""
+    user_id = update.effective_user.id
+    return user_id in ADMIN_IDS and not rate_limiter.check(user_id, 'admin')
+
+def progress_reporter(bot, message, title):
+    """Edit the status message in the admin chat with the job's progress."""
+    priority = NOTIFICATION if bot.rate_limiter else None
+
+    async def report(progress):
+        await bot.edit_message_text(progress.text(title), chat_id=message.chat_id, message_id=message.message_id,
+                                    rate_limit_args=priority)
+    return report
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/broadcast <text>: send a message to every user with an active subscription."""
+    if not admin_command(update):
+        return
+    text = update.message.text.partition(' ')[2].strip()
+    if not text:
+        await update.message.reply_text("Использование: /broadcast <текст сообщения>")
+        return
+    if broadcaster.running:
+        await update.message.reply_text("Рассылка уже идёт. Остановить: /broadcast_stop")
+        return
+    status = await update.message.reply_text("📣 Рассылка: подготовка...")
+    # Runs as a task: the admin's next updates are not blocked behind it
+    context.application.create_task(run_broadcast(context.bot, status, text))
 
-    # Create application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def run_broadcast(bot, status, text):
+    report = progress_reporter(bot, status, "📣 Рассылка")
+    try:
+        progress = await broadcaster.run(bot, text, report)
+        await report(progress)
+    except Exception as e:
+        logger.exception("Broadcast failed")
+        await status.edit_text(f"❌ Рассылка прервана: {e}")
+
+async def broadcast_stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/broadcast_stop: stop the running broadcast after the current batch."""
+    if not admin_command(update):
+        return
+    if not broadcaster.running:
+        await update.message.reply_text("Рассылка не запущена.")
+        return
+    broadcaster.cancel()
+    await update.message.reply_text("Рассылка будет остановлена после текущей пачки.")
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/export <users|subscriptions> [csv|jsonl]: send a table as a gzip file."""
+    if not admin_command(update):
+        return
+    args = context.args or []
+    table = args[0] if args else None
+    fmt = args[1] if len(args) > 1 else 'csv'
+    if table not in EXPORT_COLUMNS or fmt not in EXPORT_FORMATS:
+        await update.message.reply_text(f"Использование: /export <{'|'.join(EXPORT_COLUMNS)}> [{'|'.join(EXPORT_FORMATS)}]")
+        return
+    status = await update.message.reply_text(f"📦 Выгрузка {table}: подготовка...")
+    context.application.create_task(run_export(context.bot, status, table, fmt))
+
+async def run_export(bot, status, table, fmt):
+    try:
+        path, progress = await export(async_db.path, table, fmt, progress_reporter(bot, status, f"📦 Выгрузка {table}"))
+        size = os.path.getsize(path)
+        text = progress.text(f"📦 Выгрузка {table}") + f"\nФайл: {path} ({size / 1024 / 1024:.1f} МБ)"
+        await status.edit_text(text)
+        if size <= MAX_UPLOAD_BYTES:
+            with open(path, 'rb') as document:
+                await bot.send_document(status.chat_id, document, filename=os.path.basename(path))
+        else:
+            await bot.send_message(status.chat_id, "Файл больше 50 МБ и не может быть отправлен ботом, он сохранён на сервере.")
+    except Exception as e:
+        logger.exception("Export of %s failed", table)
+        await status.edit_text(f"❌ Выгрузка прервана: {e}")
+
+async def post_init(application: Application) -> None:
+    """Apply migrations, check panel nodes, start purchase workers and background jobs once the event loop is running."""
+    # Migrations run on the database writer thread; connections open here, not at import
+    await async_db.create_tables()
+    # Node health first: purchase workers place new users by it
+    await panel_pool.start()
+    await purchase_pool.start(lambda job: notify_purchase(application.bot, job))
+    await warm_pool.start()
+    await user_writes.start()
+    await expiry_scheduler.start(lambda kind, rows: notify_expiry(application.bot, kind, rows))
+    application.create_task(async_db.run_backfills())
+    if RECONCILE_INTERVAL > 0:
+        application.create_task(reconciler.run_forever(RECONCILE_INTERVAL))
+    if METRICS_PORT:
+        register_queue_gauges(application)
+        await metrics_server.start()
+
+def register_queue_gauges(application: Application) -> None:
+    """Report the application's queue depths on /metrics."""
+    UPDATE_QUEUE_SIZE_GAUGE.set_function(application.update_queue.qsize)
+    USER_WRITES_PENDING_GAUGE.set_function(user_writes.pending)
+    EXPIRY_QUEUED_GAUGE.set_function(expiry_scheduler.queued)
+    scheduler = application.bot.rate_limiter
+    if scheduler is not None:
+        SEND_QUEUE_SIZE_GAUGE.set_function(scheduler.queued)
+    for executor in ('writer', 'readers'):
+        DB_QUEUE_SIZE_GAUGE.labels(executor).set_function(lambda executor=executor: async_db.queue_depths()[executor])
+    BROADCAST_REMAINING_GAUGE.set_function(
+        lambda: broadcaster.current.total - broadcaster.current.done if broadcaster.running else 0)
+    for node in panel_pool.nodes.values():
+        PANEL_UP_GAUGE.labels(node.name).set_function(lambda node=node: int(node.healthy))
+        PANEL_HEADROOM_GAUGE.labels(node.name).set_function(lambda node=node: node.headroom(panel_pool.placement_cost))
+
+async def post_shutdown(application: Application) -> None:
+    """Stop background work, write pending users, close pooled panel connections and database threads."""
+    try:
+        await purchase_pool.stop()
+        await warm_pool.stop()
+        await expiry_scheduler.stop()
+        await panel_pool.stop()
+        await metrics_server.stop()
+    finally:
+        # Pending users are written even if stopping other work failed
+        try:
+            await user_writes.stop()
+        except Exception:
+            logger.exception("Failed to write %d pending users on shutdown", user_writes.pending())
+        await panel_pool.aclose()
+        async_db.close()
+
+def build_application() -> Application:
+    """Create the application and register handlers. No network or database I/O happens here."""
+    if BOT_MODE not in ('polling', 'webhook'):
+        raise ValueError(f"BOT_MODE must be 'polling' or 'webhook', got {BOT_MODE!r}")
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        raise ValueError("BOT_MODE=webhook requires WEBHOOK_URL, the public HTTPS URL registered with Telegram")
+    # Create application. The bounded update queue gives backpressure: when it is
+    # full, polling stops fetching and webhook requests wait for free space.
+    if CONCURRENT_UPDATES > 1:
+        # Application starts a task per update taken from the queue; bound those too
+        update_queue = UpdateQueue(UPDATE_QUEUE_SIZE, UPDATE_QUEUE_SIZE)
+    else:
+        update_queue = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .update_queue(update_queue)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    if TELEGRAM_SEND_RATE > 0:
+        # Sends and edits go through a queue shaped to Telegram's flood limits
+        builder = builder.rate_limiter(SendScheduler(
+            global_rate=TELEGRAM_SEND_RATE, global_burst=max(1, int(TELEGRAM_SEND_RATE / 5)),
+            chat_rate=TELEGRAM_CHAT_SEND_RATE, chat_burst=TELEGRAM_CHAT_SEND_BURST,
+            group_rate=TELEGRAM_GROUP_SENDS_PER_MINUTE / 60))
+    if CONCURRENT_UPDATES > 1:
+        # Different users in parallel, one user's updates in order
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    application = builder.build()
 
     # Add handlers
     application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(CommandHandler("broadcast", broadcast))
+    application.add_handler(CommandHandler("broadcast_stop", broadcast_stop))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CallbackQueryHandler(router.dispatch))
+    return application
 
-    # Start the bot
-    application.run_polling()
+def main() -> None:
+    """Start the bot."""
+    log_listener, policy = setup_logging()
+    for reason in policy.dropped:
+        LOG_DROPPED_GAUGE.labels(reason).set_function(lambda reason=reason: policy.dropped[reason])
+    try:
+        if '--startup-profile' in sys.argv:
+            # Report the startup budget and exit without serving updates
+            from startup_profile import run_profile
+            run_profile(build_application)
+            return
+
+        application = build_application()
+
+        # Start the bot
+        if BOT_MODE == 'webhook':
+            secret_token = WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+            logger.info("Starting webhook listener on %s:%s/%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=WEBHOOK_URL,
+                secret_token=secret_token,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+        else:
+            application.run_polling()
+    finally:
+        # Writes out the records still queued
+        log_listener.stop()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,266 @@
+# metrics.py
+# In-process metrics (counters, gauges, histograms) and a local Prometheus /metrics endpoint
+
+import asyncio
+import logging
+import math
+import threading
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds: 1 ms to 10 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """Metrics rendered together by the /metrics endpoint."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self.metrics.get(name)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, child in list(metric.children.items()):
+                try:
+                    lines.extend(child.render(metric.name, _labels(metric.labelnames, labels)))
+                except Exception as e:
+                    logger.warning("Failed to collect %s%s: %s", metric.name, labels, e)
+        return '\n'.join(lines) + '\n'
+
+
+# Metrics registered by the bot's modules
+REGISTRY = Registry()
+
+
+class _Metric:
+    """A named metric with one child per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = self._child()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """Child for these label values, created on first use. Keep the values low-cardinality."""
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self.children.setdefault(values, self._child())
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labels):
+        return [f"{name}{labels} {_number(self.value)}"]
+
+
+class _GaugeChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Read the value from `function()` at scrape time instead."""
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def render(self, name, labels):
+        return [f"{name}{labels} {_number(self.get())}"]
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, labels):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        inner = labels[1:-1] + ',' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.bounds + (math.inf,), counts):
+            cumulative += bucket
+            lines.append(f'{name}_bucket{{{inner}le="{_number(bound)}"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {_number(total)}")
+        lines.append(f"{name}_count{labels} {count}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count: `counter.labels('profile').inc()`, or `counter.inc()` without labels."""
+
+    kind = 'counter'
+
+    def _child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+
+class Gauge(_Metric):
+    """Current value, set directly or read from a function at scrape time (e.g. a queue size)."""
+
+    kind = 'gauge'
+
+    def _child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.children[()].set(value)
+
+    def set_function(self, function):
+        self.children[()].set_function(function)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets (`le` = less or equal)."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f'{{{pairs}}}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# Hot-path metrics shared by the bot's modules
+HANDLER_LATENCY = Histogram('bot_handler_seconds', "Callback handler latency by route, including middleware", ['route'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', "Callback handlers that raised, by route", ['route'])
+PANEL_LATENCY = Histogram('blitz_api_request_seconds', "Blitz panel API request latency by endpoint and status",
+                          ['method', 'endpoint', 'status'])
+DB_LATENCY = Histogram('sqlite_query_seconds', "Time spent in database.py functions on database threads", ['function'])
+WARM_POOL_CLAIMS = Counter('bot_warm_pool_claims_total', "Purchases served from the warm account pool (hit) or queued (miss)",
+                           ['plan', 'result'])
+
+
+class MetricsServer:
+    """Minimal HTTP server answering GET /metrics with the registry, for a local Prometheus scraper.
+
+    Runs on the bot's event loop; rendering is a few hundred lines of text, so it is not
+    worth a thread. Anything but GET /metrics gets 404.
+    """
+
+    def __init__(self, host, port, registry=REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+
+    async def start(self):
+        """Start listening. A port that is already taken is logged, not fatal."""
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            logger.warning("Metrics endpoint not started on %s:%s: %s", self.host, self.port, e)
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Metrics endpoint listening on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # Skip the headers; the request has no body
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            method, _, rest = request.decode('latin-1').partition(' ')
+            path = rest.split(' ', 1)[0].split('?', 1)[0]
+            if method == 'GET' and path == '/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                status, body, content_type = '404 Not Found', b'Not found\n', 'text/plain'
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
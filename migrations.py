@@ -0,0 +1,271 @@
+# migrations.py
+# Versioned schema migrations tracked with PRAGMA user_version
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ordered schema steps: (version, description, function). Each step runs in its
+# own transaction together with the user_version bump, so a crash never leaves
+# a half-applied step behind. Steps must be idempotent for databases created
+# before versioning existed (user_version 0 with tables already present).
+MIGRATIONS = []
+
+# Long-running data backfills: name -> function(conn, after_key, batch_size)
+# returning the last key processed, or None when nothing is left.
+BACKFILLS = {}
+
+def migration(version, description):
+    """Register a schema migration step."""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda step: step[0])
+        return func
+    return decorator
+
+def backfill(name):
+    """Register a resumable backfill."""
+    def decorator(func):
+        BACKFILLS[name] = func
+        return func
+    return decorator
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def has_column(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+def add_column(conn, table, column, definition):
+    """Add a column unless it already exists."""
+    if not has_column(conn, table, column):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def schedule_backfill(conn, name):
+    """Queue a registered backfill to run in batches after startup."""
+    conn.execute("INSERT OR IGNORE INTO schema_backfills (name) VALUES (?)", (name,))
+
+def migrate(conn):
+    """Apply pending migrations. Returns the number of steps applied."""
+    current = get_version(conn)
+    if current >= latest_version():
+        return 0
+
+    applied = 0
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Applying migration %s: %s", version, description)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            func(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception("Migration %s failed", version)
+            raise
+        applied += 1
+    return applied
+
+def run_backfill_batch(conn, batch_size):
+    """Run one batch of the first unfinished backfill in its own transaction.
+
+    Returns True while more work is pending, so callers can interleave batches
+    with regular traffic instead of blocking startup.
+    """
+    row = conn.execute("SELECT name, last_key FROM schema_backfills WHERE done = 0 ORDER BY name LIMIT 1").fetchone()
+    if row is None:
+        return False
+
+    name, last_key = row
+    func = BACKFILLS.get(name)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if func is None:
+            logger.warning("Unknown backfill %s, marking as done", name)
+            new_key = None
+        else:
+            new_key = func(conn, last_key, batch_size)
+        if new_key is None:
+            conn.execute("UPDATE schema_backfills SET done = 1 WHERE name = ?", (name,))
+            logger.info("Backfill %s finished", name)
+        else:
+            conn.execute("UPDATE schema_backfills SET last_key = ? WHERE name = ?", (new_key, name))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return True
+
+# Schema history
+
+@migration(1, "Create users and subscriptions tables")
+def _create_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            subscription_status TEXT DEFAULT 'Не активирована',
+            referral_code TEXT UNIQUE,
+            referred_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            plan TEXT,
+            device_limit INTEGER,
+            vpn_username TEXT,
+            vpn_password TEXT,
+            vpn_key TEXT,
+            start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_date TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_backfills (
+            name TEXT PRIMARY KEY,
+            last_key INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+@migration(2, "Add VPN credential columns to subscriptions")
+def _add_vpn_columns(conn):
+    add_column(conn, 'subscriptions', 'vpn_username', 'TEXT')
+    add_column(conn, 'subscriptions', 'vpn_password', 'TEXT')
+    add_column(conn, 'subscriptions', 'vpn_key', 'TEXT')
+
+@migration(3, "Index subscriptions by user and end date")
+def _index_subscriptions(conn):
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_user_end_date
+        ON subscriptions (user_id, end_date)
+    ''')
+
+@migration(4, "Add users.current_subscription_id")
+def _add_current_subscription(conn):
+    add_column(conn, 'users', 'current_subscription_id', 'INTEGER')
+    schedule_backfill(conn, 'current_subscription_id')
+
+@backfill('current_subscription_id')
+def _backfill_current_subscription(conn, after_key, batch_size):
+    last = conn.execute('''
+        SELECT MAX(user_id) FROM (SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?)
+    ''', (after_key, batch_size)).fetchone()[0]
+    if last is None:
+        return None
+    conn.execute('''
+        UPDATE users SET current_subscription_id = (
+            SELECT id FROM subscriptions
+            WHERE subscriptions.user_id = users.user_id
+            ORDER BY end_date DESC
+            LIMIT 1
+        )
+        WHERE user_id > ? AND user_id <= ?
+    ''', (after_key, last))
+    return last
+
+@migration(5, "Add panel sync state to subscriptions")
+def _add_panel_sync_columns(conn):
+    add_column(conn, 'subscriptions', 'panel_status', 'TEXT')
+    add_column(conn, 'subscriptions', 'traffic_used', 'INTEGER')
+    add_column(conn, 'subscriptions', 'panel_synced_at', 'TIMESTAMP')
+
+@migration(6, "Create purchase job queue")
+def _create_purchase_jobs(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS purchase_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            plan TEXT NOT NULL,
+            chat_id INTEGER,
+            message_id INTEGER,
+            vpn_username TEXT NOT NULL,
+            vpn_password TEXT NOT NULL,
+            vpn_key TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            create_sent INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            notified INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # At most one unfinished job per user and plan: a repeated purchase joins it
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_purchase_jobs_active_key
+        ON purchase_jobs (idempotency_key) WHERE status IN ('pending', 'running')
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_purchase_jobs_due
+        ON purchase_jobs (status, next_attempt_at)
+    ''')
+
+@migration(7, "Record the panel node of subscriptions and purchase jobs")
+def _add_panel_node(conn):
+    # NULL means the first configured node, where every earlier account was created
+    add_column(conn, 'subscriptions', 'panel_node', 'TEXT')
+    add_column(conn, 'purchase_jobs', 'panel_node', 'TEXT')
+
+@migration(8, "Create warm pool of pre-provisioned panel accounts")
+def _create_warm_accounts(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS warm_accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan TEXT NOT NULL,
+            panel_node TEXT,
+            vpn_username TEXT NOT NULL,
+            vpn_password TEXT NOT NULL,
+            vpn_key TEXT,
+            status TEXT NOT NULL DEFAULT 'creating',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        )
+    ''')
+    # A purchase claims the oldest ready account of its plan
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_warm_accounts_ready
+        ON warm_accounts (plan, status, id)
+    ''')
+
+@migration(9, "Track subscription expiry notices and index pending due dates")
+def _add_expiry_stage(conn):
+    # 0: nothing sent yet, 1: reminded, 2: expired
+    add_column(conn, 'subscriptions', 'expiry_stage', 'INTEGER NOT NULL DEFAULT 0')
+    # Partial indexes hold only subscriptions still waiting for an event, so the expiry
+    # scheduler pages through upcoming due dates without touching handled rows
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_reminder_due
+        ON subscriptions (end_date, id) WHERE expiry_stage = 0
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_expiry_due
+        ON subscriptions (end_date, id) WHERE expiry_stage < 2
+    ''')
+
+@migration(10, "Index purchase jobs by the message they were started from")
+def _index_purchase_job_message(conn):
+    # A repeated tap on a finished purchase's message joins that job instead of buying again
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_purchase_jobs_message
+        ON purchase_jobs (chat_id, message_id)
+    ''')
+
+@migration(11, "Record the subscription end date a renewal extends")
+def _add_purchase_renewal(conn):
+    # NULL for a new account; otherwise the job extends the panel account of the user's
+    # latest subscription to the plan, which ended or ends at this date
+    add_column(conn, 'purchase_jobs', 'extends_end_date', 'TEXT')
@@ -0,0 +1,279 @@
+# purchases.py
+# Durable purchase pipeline: purchases are queued in SQLite and run by a worker pool
+
+import asyncio
+import logging
+import math
+import random
+import string
+import time
+from datetime import datetime, timedelta
+from api_client import BlitzAPIError, CircuitOpenError, UserAlreadyExistsError
+from config import SUBSCRIPTION_PLANS, PURCHASE_WORKERS, PURCHASE_MAX_ATTEMPTS, PURCHASE_RETRY_DELAY
+
+logger = logging.getLogger(__name__)
+
+# Longest sleep of an idle worker between queue checks
+IDLE_POLL_INTERVAL = 5.0
+MAX_RETRY_DELAY = 300.0
+
+def generate_password(length=12):
+    """Generate a random password with only letters and digits."""
+    characters = string.ascii_letters + string.digits  # Only letters and digits, no special characters
+    return ''.join(random.choice(characters) for i in range(length))
+
+def is_transient(error):
+    """Whether a failed step is worth retrying: timeouts, connection errors, 5xx and 429."""
+    if isinstance(error, ValueError):
+        return False
+    if isinstance(error, BlitzAPIError):
+        return error.status_code is None or error.status_code >= 500 or error.status_code == 429
+    return True
+
+class PurchaseWorkerPool:
+    """Runs queued purchases: creates the panel account, fetches its key and saves the subscription.
+
+    Jobs are rows in `purchase_jobs`, so a restart resumes them. Once a job has
+    sent the account request, a later "user already exists" answer means an
+    earlier attempt succeeded and the job carries on instead of failing. Failures while
+    the job's panel is down (open circuit, no healthy node) do not use up attempts: the
+    job waits for the panel to recover.
+
+    `panels` is a PanelPool: the first attempt picks the node with the most headroom
+    and records it on the job, so retries and the saved subscription use that node.
+    With a `warm_pool`, submit() first tries to bind a pre-provisioned account, which
+    finishes the purchase at once; only when none is ready is a job queued.
+
+    `notify(job)` is awaited when a job finishes (status 'done' or 'failed').
+    """
+
+    def __init__(self, db, panels, plans=SUBSCRIPTION_PLANS, workers=PURCHASE_WORKERS,
+                 max_attempts=PURCHASE_MAX_ATTEMPTS, retry_delay=PURCHASE_RETRY_DELAY, warm_pool=None):
+        self.db = db
+        self.panels = panels
+        self.plans = plans
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.warm_pool = warm_pool
+        self.notify = None
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self._wakeup = None
+        self._tasks = []
+
+    async def start(self, notify=None):
+        """Requeue jobs interrupted by a previous shutdown and start the workers."""
+        self.notify = notify
+        requeued = await self.db.requeue_running_purchase_jobs()
+        if requeued:
+            logger.info("Resuming %s interrupted purchase jobs", requeued)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._notify_unnotified()))
+
+    async def stop(self):
+        """Stop the workers. Jobs in progress stay 'running' and resume on the next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, user_id, plan, chat_id=None, message_id=None):
+        """Queue a purchase. Returns (job, created); a repeat of an unfinished purchase, or a
+        repeated tap on the message of a finished one, joins it.
+
+        A purchase served from the warm pool is returned already 'done'.
+        """
+        if self.warm_pool is not None:
+            job, created = await self.warm_pool.claim(user_id, plan, chat_id, message_id)
+            if job is not None:
+                if created:
+                    self.completed += 1
+                    logger.info("Purchase job %s for user %s, plan: %s served from the warm pool", job['id'], user_id,
+                                plan, extra={'job_id': job['id'], 'user_id': user_id, 'plan': plan,
+                                             'node': job['panel_node']})
+                return job, created
+        job, created = await self.db.enqueue_purchase(user_id, plan, chat_id, message_id,
+                                                      f"user_{user_id}_{plan}", generate_password())
+        if created:
+            logger.info("Queued purchase job %s for user %s, plan: %s", job['id'], user_id, plan,
+                        extra={'job_id': job['id'], 'user_id': user_id, 'plan': plan})
+        self.wake()
+        return job, created
+
+    def wake(self):
+        """Tell idle workers that a job is due."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker(self):
+        while True:
+            # Cleared before claiming, so a job queued after the claim still wakes us
+            self._wakeup.clear()
+            try:
+                job = await self.db.claim_purchase_job(time.time())
+            except Exception:
+                logger.exception("Failed to claim a purchase job")
+                job = None
+            if job is None:
+                await self._wait_for_due()
+                continue
+            try:
+                await self._run(job)
+            except Exception:
+                logger.exception("Purchase job %s could not be updated", job['id'], extra={'job_id': job['id']})
+
+    async def _wait_for_due(self):
+        timeout = IDLE_POLL_INTERVAL
+        try:
+            due = await self.db.next_purchase_due()
+            if due is not None:
+                timeout = min(timeout, max(0.0, due - time.time()))
+        except Exception:
+            logger.exception("Failed to read the purchase queue")
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self, job):
+        try:
+            await self._execute(job)
+        except Exception as e:
+            panel_down = self._panel_down(job, e)
+            if panel_down or (is_transient(e) and job['attempts'] < self.max_attempts):
+                delay = min(MAX_RETRY_DELAY, self.retry_delay * 2 ** (job['attempts'] - 1)) * random.uniform(0.5, 1.5)
+                # No point retrying before the panel's circuit lets requests through again
+                delay = max(delay, getattr(e, 'retry_after', 0))
+                if panel_down:
+                    logger.warning("Purchase job %s is waiting for the panel: %s, retrying in %.1fs",
+                                   job['id'], e, delay, extra={'job_id': job['id']})
+                else:
+                    logger.warning("Purchase job %s attempt %s failed: %s, retrying in %.1fs",
+                                   job['id'], job['attempts'], e, delay, extra={'job_id': job['id']})
+                self.retried += 1
+                await self.db.retry_purchase_job(job['id'], time.time() + delay, str(e), counted=not panel_down)
+                return
+            logger.error("Purchase job %s failed after %s attempts: %s", job['id'], job['attempts'], e,
+                         extra={'job_id': job['id']})
+            self.failed += 1
+            await self.db.fail_purchase_job(job['id'], str(e))
+            job.update(status='failed', last_error=str(e))
+            await self._notify(job)
+
+    def _panel_down(self, job, error):
+        """Whether a failure is explained by the job's panel being unavailable rather than by the job."""
+        if isinstance(error, CircuitOpenError):
+            return True
+        return is_transient(error) and not self.panels.is_available('users', job['panel_node'])
+
+    async def _execute(self, job):
+        details = self.plans.get(job['plan'])
+        if not details:
+            raise ValueError("Неверный план.")
+
+        username = job['vpn_username']
+        node = job['panel_node']
+        if job['extends_end_date']:
+            client, end_date = await self._renew(job, details)
+            await self._finish(job, client, end_date, details)
+            return
+
+        sent_before = job['create_sent']
+        if not sent_before:
+            node = self.panels.choose()
+            await self.db.mark_purchase_create_sent(job['id'], node)
+            job['panel_node'] = node
+        client = self.panels.client(node)
+        try:
+            await client.create_user(
+                username=username,
+                password=job['vpn_password'],
+                traffic_limit=details['traffic_gb'] or 0,  # Send GB directly
+                expiration_days=details['expiration_days'],
+                unlimited=details['device_limit'] is None,  # True if unlimited devices
+                note=f"Telegram user {job['user_id']} - Plan: {job['plan']}"
+            )
+        except UserAlreadyExistsError:
+            if not sent_before:
+                raise
+            logger.info("Panel user %s was created by an earlier attempt of job %s", username, job['id'],
+                        extra={'job_id': job['id']})
+        await self._finish(job, client, datetime.now() + timedelta(days=details['expiration_days']), details)
+
+    async def _renew(self, job, details):
+        """Extend the panel account of the user's latest subscription to the plan.
+
+        The new term starts when the current one ends, or now if it has ended.
+        Returns (client, end_date).
+        """
+        now = datetime.now()
+        try:
+            start = max(now, datetime.fromisoformat(job['extends_end_date']))
+        except ValueError:
+            start = now
+        end_date = start + timedelta(days=details['expiration_days'])
+        days = math.ceil((end_date - now).total_seconds() / 86400)
+        client = self.panels.client(job['panel_node'])
+        try:
+            await client.edit_user(job['vpn_username'], expiration_days=days, traffic_limit=details['traffic_gb'] or 0,
+                                   unlimited=details['device_limit'] is None, renew_creation_date=True,
+                                   renew_traffic=True)
+        except BlitzAPIError as e:
+            if e.status_code != 404:
+                raise
+            # The panel has already removed the expired account: create it again under the same name
+            logger.info("Panel user %s is gone, creating it again for job %s", job['vpn_username'], job['id'],
+                        extra={'job_id': job['id']})
+            try:
+                await client.create_user(
+                    username=job['vpn_username'],
+                    password=job['vpn_password'],
+                    traffic_limit=details['traffic_gb'] or 0,
+                    expiration_days=days,
+                    unlimited=details['device_limit'] is None,
+                    note=f"Telegram user {job['user_id']} - Plan: {job['plan']}"
+                )
+            except UserAlreadyExistsError:
+                pass
+        return client, end_date
+
+    async def _finish(self, job, client, end_date, details):
+        """Fetch the key, save the subscription and report the result."""
+        username = job['vpn_username']
+        node = job['panel_node']
+        # The key is optional: without it the user gets the credentials instead
+        vpn_key = ""
+        try:
+            uri_response = await client.get_user_uri(username)
+            vpn_key = uri_response.get('ipv4') or ""
+        except Exception as e:
+            logger.error("Error getting user URI: %s", e, extra={'job_id': job['id']})
+
+        if not await self.db.complete_purchase_job(job['id'], details['device_limit'], end_date.isoformat(), vpn_key):
+            logger.warning("Purchase job %s is no longer running, result discarded", job['id'], extra={'job_id': job['id']})
+            return
+        self.completed += 1
+        logger.info("Purchase job %s done for user %s, plan: %s, node: %s", job['id'], job['user_id'], job['plan'], node,
+                    extra={'job_id': job['id'], 'user_id': job['user_id'], 'plan': job['plan'], 'node': node})
+        job.update(status='done', vpn_key=vpn_key)
+        await self._notify(job)
+
+    async def _notify(self, job):
+        if self.notify is None or job['message_id'] is None:
+            return
+        try:
+            await self.notify(job)
+            await self.db.mark_purchase_job_notified(job['id'])
+        except Exception as e:
+            logger.error("Failed to report purchase job %s: %s", job['id'], e, extra={'job_id': job['id']})
+
+    async def _notify_unnotified(self):
+        """Report results finished before a restart but never shown to the user."""
+        try:
+            for job in await self.db.get_unnotified_purchase_jobs():
+                await self._notify(job)
+        except Exception:
+            logger.exception("Failed to report finished purchase jobs")
@@ -0,0 +1,125 @@
+# ratelimit.py
+# Token bucket rate limiting
+
+import asyncio
+import time
+from collections import OrderedDict
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available. Returns True on success."""
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens=1):
+        """Seconds until `tokens` would be available."""
+        self._refill(time.monotonic())
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    async def acquire(self, tokens=1):
+        """Wait until tokens are available and take them."""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+class RetryBudget:
+    """Caps retries at `ratio` of recent requests, plus `min_per_second` so quiet periods can still retry.
+
+    Every request deposits `ratio` tokens and every retry spends one, so during
+    an outage retries add at most `ratio` extra load instead of multiplying it.
+    """
+
+    def __init__(self, ratio, min_per_second=1.0, capacity=10.0):
+        self.ratio = ratio
+        self.bucket = TokenBucket(min_per_second, capacity)
+        self.spent = 0
+        self.denied = 0
+
+    def deposit(self):
+        """Record a request."""
+        self.bucket._refill(time.monotonic())
+        self.bucket.tokens = min(self.bucket.capacity, self.bucket.tokens + self.ratio)
+
+    def try_spend(self):
+        """Take a token for one retry. Returns False when the budget is exhausted."""
+        if self.bucket.try_acquire():
+            self.spent += 1
+            return True
+        self.denied += 1
+        return False
+
+class KeyedRateLimiter:
+    """Token buckets per (user, action class) plus an optional shared bucket per class.
+
+    `limits` maps an action class to (rate, burst) for each user; `shared` maps a class
+    to the name of a global bucket in `global_limits` that all users draw from as well
+    (e.g. everything that calls the panel API). Memory is bounded: buckets idle long
+    enough to have refilled completely are dropped (a new one would be identical), and
+    at most `max_keys` buckets are kept, least recently used first out.
+    """
+
+    def __init__(self, limits, global_limits=None, shared=None, max_keys=50000):
+        self.limits = limits
+        self.global_buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in (global_limits or {}).items()}
+        self.shared = shared or {}
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.counters = {action: {'allowed': 0, 'throttled': 0, 'dropped': 0} for action in limits}
+        self.evicted = 0
+
+    def check(self, user_id, action):
+        """Take a token for one `action` by `user_id`.
+
+        Returns None if allowed, 'throttled' if the user is over their limit, or 'dropped'
+        if the shared bucket for the action is empty.
+        """
+        now = time.monotonic()
+        key = (user_id, action)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self._evict(now)
+            rate, burst = self.limits[action]
+            bucket = self.buckets[key] = TokenBucket(rate, burst)
+        else:
+            self.buckets.move_to_end(key)
+        counters = self.counters[action]
+        if not bucket.try_acquire():
+            counters['throttled'] += 1
+            return 'throttled'
+        shared = self.global_buckets.get(self.shared.get(action))
+        if shared is not None and not shared.try_acquire():
+            # Not the user's fault: give their token back
+            bucket.tokens += 1
+            counters['dropped'] += 1
+            return 'dropped'
+        counters['allowed'] += 1
+        return None
+
+    def _evict(self, now):
+        """Drop buckets from the LRU end while they are full again or the table is at max_keys."""
+        while self.buckets:
+            key, bucket = next(iter(self.buckets.items()))
+            idle_full = now - bucket.updated_at >= (bucket.capacity - bucket.tokens) / bucket.rate
+            if not idle_full and len(self.buckets) < self.max_keys:
+                break
+            del self.buckets[key]
+            self.evicted += 1
+
+    def stats(self):
+        """Counters per action class plus table size."""
+        return {'actions': {action: dict(counters) for action, counters in self.counters.items()},
+                'keys': len(self.buckets), 'evicted': self.evicted}
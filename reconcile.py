@@ -0,0 +1,108 @@
+# reconcile.py
+# Background job that syncs local subscriptions with the state of their panel accounts
+
+import asyncio
+import logging
+import time
+from api_client import BlitzAPIError
+from config import RECONCILE_BATCH_SIZE, RECONCILE_CONCURRENCY, RECONCILE_RATE
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+class Reconciler:
+    """Walks the subscriptions table in batches and stores panel status and traffic usage.
+
+    Panel lookups go to each subscription's node of the PanelPool, run with bounded
+    concurrency behind a token bucket, and each batch of results is written back in
+    a single transaction.
+    """
+
+    def __init__(self, db, panels, batch_size=RECONCILE_BATCH_SIZE, concurrency=RECONCILE_CONCURRENCY,
+                 rate=RECONCILE_RATE):
+        self.db = db
+        self.panels = panels
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, capacity=concurrency) if rate > 0 else None
+        self.running = False
+        self.total = 0
+        self.processed = 0
+        self.failed = 0
+        self.missing = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def progress(self):
+        """Progress of the current (or last) run."""
+        elapsed = ((self.finished_at or time.monotonic()) - self.started_at) if self.started_at else 0.0
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, self.total - self.processed)
+        return {
+            'running': self.running,
+            'total': self.total,
+            'processed': self.processed,
+            'failed': self.failed,
+            'missing': self.missing,
+            'percent': 100.0 * self.processed / self.total if self.total else 100.0,
+            'rate': rate,
+            'eta': remaining / rate if self.running and rate > 0 else None,
+        }
+
+    async def run(self):
+        """Reconcile every subscription that has a panel account once."""
+        if self.running:
+            return self.progress()
+
+        self.running = True
+        self.processed = self.failed = self.missing = 0
+        self.started_at, self.finished_at = time.monotonic(), None
+        semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            self.total = await self.db.count_panel_subscriptions()
+            logger.info("Reconciliation started for %s subscriptions", self.total)
+            after_id = 0
+            while True:
+                rows = await self.db.get_panel_subscriptions(after_id, self.batch_size)
+                if not rows:
+                    break
+                states = await asyncio.gather(*(self._fetch_state(semaphore, sub_id, username, node)
+                                                for sub_id, username, node in rows))
+                await self.db.save_panel_states([state for state in states if state is not None])
+                after_id = rows[-1][0]
+                self.processed += len(rows)
+        finally:
+            self.running = False
+            self.finished_at = time.monotonic()
+
+        progress = self.progress()
+        logger.info("Reconciliation finished: %s synced, %s missing on panel, %s failed, %.0f/s",
+                    progress['processed'], progress['missing'], progress['failed'], progress['rate'])
+        return progress
+
+    async def run_forever(self, interval):
+        """Run reconciliation every `interval` seconds."""
+        while True:
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Reconciliation failed")
+            await asyncio.sleep(interval)
+
+    async def _fetch_state(self, semaphore, subscription_id, username, node=None):
+        """Get (panel_status, traffic_used, subscription_id) for one subscription, or None on error."""
+        async with semaphore:
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            try:
+                user = await self.panels.client(node).get_user(username, fresh=True)
+            except BlitzAPIError as e:
+                if e.status_code == 404:
+                    self.missing += 1
+                    return ('deleted', None, subscription_id)
+                self.failed += 1
+                return None
+
+        status = 'blocked' if user.get('blocked') else user.get('status')
+        traffic_used = int(user.get('upload_bytes') or 0) + int(user.get('download_bytes') or 0)
+        return (status, traffic_used, subscription_id)
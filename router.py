@@ -0,0 +1,244 @@
+# router.py
+# Table-driven callback query router: exact routes in a dict, parameterized routes in a prefix trie
+
+import logging
+import time
+from collections import deque
+from metrics import HANDLER_LATENCY, HANDLER_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Argument types usable in route templates, e.g. 'buy_{plan}' or 'page_{number:int}'
+CONVERTERS = {'str': str, 'int': int}
+
+
+class RouteStats:
+    """Call count, errors and latency of one route; percentiles come from the most recent samples."""
+
+    def __init__(self, samples=1024):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=samples)
+
+    def record(self, elapsed, failed=False):
+        self.calls += 1
+        self.errors += failed
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.samples.append(elapsed)
+
+    def percentile(self, pct):
+        if not self.samples:
+            return 0.0
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'mean_ms': self.total / self.calls * 1000 if self.calls else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p95_ms': self.percentile(95) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class Route:
+    """A callback pattern bound to a handler and its middleware."""
+
+    def __init__(self, pattern, handler, middleware=()):
+        self.pattern = pattern
+        self.handler = handler
+        self.middleware = tuple(middleware)
+        self.prefix, self.params = self._compile(pattern)
+        self.stats = RouteStats()
+
+    @staticmethod
+    def _compile(pattern):
+        """Split 'buy_{plan}' into the literal prefix 'buy_' and [(name, converter)].
+
+        Parameters are separated by '_'; the last one takes the rest of the data.
+        """
+        if '{' not in pattern:
+            return pattern, []
+        prefix, rest = pattern.split('{', 1)
+        params = []
+        for part in ('{' + rest).split('_'):
+            if not (part.startswith('{') and part.endswith('}')):
+                raise ValueError(f"Route {pattern!r}: only '_'-separated parameters may follow the prefix")
+            name, _, type_name = part[1:-1].partition(':')
+            if type_name and type_name not in CONVERTERS:
+                raise ValueError(f"Route {pattern!r}: unknown parameter type {type_name!r}")
+            params.append((name, CONVERTERS[type_name or 'str']))
+        return prefix, params
+
+    def parse(self, rest):
+        """Typed arguments from the data after the prefix, or None if it does not fit."""
+        if not rest:
+            return None
+        values = rest.split('_', len(self.params) - 1)
+        if len(values) != len(self.params):
+            return None
+        try:
+            return {name: convert(value) for (name, convert), value in zip(self.params, values)}
+        except ValueError:
+            return None
+
+
+class CallbackCall:
+    """One dispatched callback, passed through middleware to the handler."""
+
+    __slots__ = ('route', 'query', 'context', 'args', 'user_id', 'answered')
+
+    def __init__(self, route, query, context, args):
+        self.route = route
+        self.query = query
+        self.context = context
+        self.args = args
+        self.user_id = query.from_user.id
+        self.answered = False
+
+    async def answer(self, text=None, show_alert=False):
+        """Answer the callback query once; later calls are no-ops."""
+        if not self.answered:
+            self.answered = True
+            await self.query.answer(text, show_alert=show_alert)
+
+
+class CallbackRouter:
+    """Routes callback data to handlers.
+
+    Exact callbacks ('profile') are a single dict lookup. Parameterized ones ('buy_{plan}')
+    sit in a character trie keyed by their literal prefix; the longest matching prefix whose
+    arguments parse wins, so adding screens does not slow down dispatch. Exact routes take
+    precedence, so 'buy_subscription' never reaches 'buy_{plan}'.
+
+    Middleware are `async def mw(call, call_next)` and run outermost first: router-wide
+    ones, then the route's own. A middleware may skip `call_next` to stop the call,
+    optionally answering it with `call.answer(text)`. Handlers are called as
+    `handler(query, **args)`; the query is answered right before the handler runs.
+    """
+
+    def __init__(self, middleware=()):
+        self.middleware = list(middleware)
+        self.exact = {}
+        self.trie = {}
+        self.routes = []
+        self.unmatched = 0
+
+    def add(self, pattern, handler, middleware=()):
+        route = Route(pattern, handler, middleware)
+        if route.params:
+            node = self.trie
+            for char in route.prefix:
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(route)
+        else:
+            if pattern in self.exact:
+                raise ValueError(f"Route {pattern!r} is already registered")
+            self.exact[pattern] = route
+        self.routes.append(route)
+        return route
+
+    def route(self, pattern, middleware=()):
+        """Decorator form of add()."""
+        def decorator(handler):
+            self.add(pattern, handler, middleware)
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """(route, args) for callback data, or (None, None)."""
+        route = self.exact.get(data)
+        if route is not None:
+            return route, {}
+        # Walk the trie along the data, remembering every node that ends a prefix
+        candidates = []
+        node = self.trie
+        for depth, char in enumerate(data):
+            if None in node:
+                candidates.append((depth, node[None]))
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            if None in node:
+                candidates.append((len(data), node[None]))
+        for depth, routes in reversed(candidates):
+            for route in routes:
+                args = route.parse(data[depth:])
+                if args is not None:
+                    return route, args
+        return None, None
+
+    async def dispatch(self, update, context):
+        """CallbackQueryHandler callback: run the matching route and make sure the query is answered."""
+        query = update.callback_query
+        route, args = self.resolve(query.data or '')
+        if route is None:
+            self.unmatched += 1
+            logger.warning("No route for callback data %r from user %s", query.data, query.from_user.id)
+            await query.answer()
+            return
+        call = CallbackCall(route, query, context, args)
+        try:
+            await self._run(call, self.middleware + list(route.middleware), 0)
+        finally:
+            if not call.answered:
+                await call.answer()
+
+    async def _run(self, call, chain, index):
+        if index == len(chain):
+            await call.answer()
+            await call.route.handler(call.query, **call.args)
+            return
+        await chain[index](call, lambda: self._run(call, chain, index + 1))
+
+    def latency_report(self):
+        """Per-route stats, slowest p95 first."""
+        report = {route.pattern: route.stats.summary() for route in self.routes if route.stats.calls}
+        return dict(sorted(report.items(), key=lambda item: -item[1]['p95_ms']))
+
+
+async def timing(call, call_next):
+    """Record the latency of every call (including inner middleware) in the route's stats and metrics."""
+    started = time.perf_counter()
+    failed = True
+    try:
+        await call_next()
+        failed = False
+    finally:
+        elapsed = time.perf_counter() - started
+        call.route.stats.record(elapsed, failed)
+        HANDLER_LATENCY.labels(call.route.pattern).observe(elapsed)
+        if failed:
+            HANDLER_ERRORS.labels(call.route.pattern).inc()
+
+
+def allow_users(user_ids, denied):
+    """Auth middleware: only `user_ids` reach the handler; others get `denied(call)` instead."""
+    async def middleware(call, call_next):
+        if call.user_id in user_ids:
+            await call_next()
+        else:
+            logger.warning("User %s denied access to %s", call.user_id, call.route.pattern)
+            await denied(call)
+    return middleware
+
+
+def rate_limit(limiter, action, rejected):
+    """Rate limit middleware for one action class of a KeyedRateLimiter.
+
+    Over the limit, `rejected(call, reason)` runs instead of the handler, with reason
+    'throttled' (this user) or 'dropped' (shared limit).
+    """
+    async def middleware(call, call_next):
+        reason = limiter.check(call.user_id, action)
+        if reason is None:
+            await call_next()
+        else:
+            await rejected(call, reason)
+    return middleware
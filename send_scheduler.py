@@ -0,0 +1,284 @@
+# send_scheduler.py
+# Outbound Bot API scheduler: priority queue with per-chat and global shaping under Telegram flood limits
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Priorities passed as `rate_limit_args`; lower is sent first
+INTERACTIVE = 0
+NOTIFICATION = 1
+BULK = 2
+
+# Edits of the same message that are still queued collapse into the latest one
+COALESCED_METHODS = frozenset({'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption'})
+
+
+class _Send:
+    __slots__ = ('priority', 'seq', 'chat_id', 'callback', 'args', 'kwargs', 'futures', 'key', 'attempts')
+
+    def __init__(self, priority, seq, chat_id, callback, args, kwargs, key):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.futures = []
+        self.key = key
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Chat:
+    __slots__ = ('queue', 'bucket', 'busy')
+
+    def __init__(self, bucket):
+        self.queue = []
+        self.bucket = bucket
+        self.busy = False
+
+
+class SendScheduler(BaseRateLimiter):
+    """Rate limiter for the application's bot that queues every request addressed to a chat.
+
+    Requests wait in a priority queue (INTERACTIVE replies before NOTIFICATION before BULK,
+    FIFO within a priority) and are released under a global token bucket and one bucket
+    per chat; group chats (negative ids) get their own, slower rate. A chat has at most
+    one request in flight, so its messages arrive in order, while different chats are sent
+    concurrently. A 429 pauses all sending for `retry_after` seconds, as Telegram asks,
+    and the request is retried up to `max_retries` times. A queued edit of a message that
+    is edited again is replaced by the newer one; both callers get the final result.
+
+    Requests without a chat_id (answerCallbackQuery, getMe, webhook calls) bypass the queue.
+
+    Args:
+        global_rate, global_burst: Requests per second across all chats, and burst. Keep
+            rate + burst under Telegram's limit: any one-second window may see both.
+        chat_rate, chat_burst: Per private chat.
+        group_rate, group_burst: Per group chat.
+        max_retries: Retries of a request answered with 429.
+        drain_timeout: Seconds shutdown() waits for queued requests before failing them.
+    """
+
+    __slots__ = ('global_bucket', 'chat_rate', 'chat_burst', 'group_rate', 'group_burst', 'max_retries',
+                 'drain_timeout', 'stats', '_chats', '_ready', '_waiting', '_pending', '_in_flight',
+                 '_queued', '_seq', '_wakeup', '_paused_until', '_task', '_stopping', '_clock')
+
+    def __init__(self, global_rate=25, global_burst=5, chat_rate=1, chat_burst=3, group_rate=20 / 60,
+                 group_burst=3, max_retries=3, drain_timeout=5.0):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.drain_timeout = drain_timeout
+        self.stats = {'sent': 0, 'coalesced': 0, 'flood_waits': 0, 'failed': 0, 'max_queued': 0}
+        self._chats = {}
+        # Chats whose head request may go now: (priority, seq, chat_id); stale entries are skipped
+        self._ready = []
+        # Chats waiting for a token, or idle until their bucket is full: (at, chat_id)
+        self._waiting = []
+        # Coalescing key -> queued request
+        self._pending = {}
+        self._in_flight = set()
+        self._queued = 0
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._paused_until = 0.0
+        self._task = None
+        self._stopping = False
+        self._clock = time.monotonic
+
+    async def initialize(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._drain())
+
+    async def shutdown(self):
+        if self._task is None:
+            return
+        deadline = self._clock() + self.drain_timeout
+        while (self.queued() or self._in_flight) and self._clock() < deadline:
+            await asyncio.sleep(0.05)
+        # A flag, not cancel(): wait_for may swallow a cancellation that races with the wakeup
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        if self._in_flight:
+            await asyncio.wait(self._in_flight, timeout=max(0.0, deadline - self._clock()))
+        dropped = 0
+        for chat in self._chats.values():
+            for send in chat.queue:
+                dropped += 1
+                for future in send.futures:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Send scheduler stopped before the request was sent"))
+        if dropped:
+            logger.warning("Send scheduler stopped with %s unsent requests", dropped)
+        self._chats.clear()
+        self._pending.clear()
+
+    def queued(self):
+        """Number of requests waiting to be sent."""
+        return self._queued
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None or self._task is None:
+            return await callback(*args, **kwargs)
+
+        future = asyncio.get_running_loop().create_future()
+        key = None
+        if endpoint in COALESCED_METHODS and data.get('message_id') is not None:
+            key = (endpoint, chat_id, data['message_id'])
+            queued = self._pending.get(key)
+            if queued is not None:
+                # Not sent yet: send the newer edit in its place
+                queued.callback, queued.args, queued.kwargs = callback, args, kwargs
+                queued.futures.append(future)
+                self.stats['coalesced'] += 1
+                return await future
+
+        priority = rate_limit_args if isinstance(rate_limit_args, int) else INTERACTIVE
+        send = _Send(priority, next(self._seq), chat_id, callback, args, kwargs, key)
+        send.futures.append(future)
+        if key is not None:
+            self._pending[key] = send
+        chat = self._chat(chat_id)
+        heapq.heappush(chat.queue, send)
+        self._queued += 1
+        self.stats['max_queued'] = max(self.stats['max_queued'], self._queued)
+        if not chat.busy:
+            self._schedule(chat_id, chat)
+        return await future
+
+    def _chat(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(self.group_rate, self.group_burst) if group else TokenBucket(self.chat_rate, self.chat_burst)
+            chat = self._chats[chat_id] = _Chat(bucket)
+        return chat
+
+    def _schedule(self, chat_id, chat):
+        """Put an idle chat with queued requests into the ready or waiting heap."""
+        delay = chat.bucket.delay()
+        if delay > 0:
+            heapq.heappush(self._waiting, (self._clock() + delay, chat_id))
+        else:
+            head = chat.queue[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        self._wakeup.set()
+
+    async def _drain(self):
+        while not self._stopping:
+            now = self._clock()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, chat_id = heapq.heappop(self._waiting)
+                chat = self._chats.get(chat_id)
+                if chat is not None and not chat.busy:
+                    if chat.queue:
+                        self._schedule(chat_id, chat)
+                    else:
+                        self._release(chat_id, chat)
+
+            timeout = None
+            if now < self._paused_until:
+                timeout = self._paused_until - now
+            elif self._ready:
+                if self.global_bucket.try_acquire():
+                    self._start_next()
+                    continue
+                timeout = self.global_bucket.delay()
+            if self._waiting:
+                next_ready = self._waiting[0][0] - now
+                timeout = next_ready if timeout is None else min(timeout, next_ready)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_next(self):
+        """Send the best ready request; skips heap entries made stale by newer ones."""
+        while self._ready:
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.busy or not chat.queue or chat.queue[0].seq != seq:
+                continue
+            if not chat.bucket.try_acquire():
+                self._schedule(chat_id, chat)
+                continue
+            send = heapq.heappop(chat.queue)
+            self._queued -= 1
+            if send.key is not None:
+                self._pending.pop(send.key, None)
+            chat.busy = True
+            task = asyncio.create_task(self._send(chat_id, chat, send))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            return
+        # Nothing was sendable: give the global token back
+        self.global_bucket.tokens = min(self.global_bucket.capacity, self.global_bucket.tokens + 1)
+
+    async def _send(self, chat_id, chat, send):
+        try:
+            result = await send.callback(*send.args, **send.kwargs)
+        except RetryAfter as e:
+            send.attempts += 1
+            self.stats['flood_waits'] += 1
+            retry_after = float(e.retry_after)
+            logger.warning("Flood limit hit sending to chat %s, pausing all sends for %ss", chat_id, retry_after)
+            self._paused_until = max(self._paused_until, self._clock() + retry_after)
+            if send.attempts <= self.max_retries:
+                heapq.heappush(chat.queue, send)
+                self._queued += 1
+                if send.key is not None and send.key not in self._pending:
+                    self._pending[send.key] = send
+            else:
+                self._finish(send, error=e)
+        except Exception as e:
+            self._finish(send, error=e)
+        else:
+            self.stats['sent'] += 1
+            self._finish(send, result=result)
+        finally:
+            chat.busy = False
+            if chat.queue:
+                self._schedule(chat_id, chat)
+            else:
+                self._release(chat_id, chat)
+            self._wakeup.set()
+
+    def _release(self, chat_id, chat):
+        """Forget an idle chat once its bucket is full again (a new one would be identical)."""
+        bucket = chat.bucket
+        refill = (bucket.capacity - bucket.tokens) / bucket.rate - (self._clock() - bucket.updated_at)
+        if refill <= 0:
+            self._chats.pop(chat_id, None)
+        else:
+            heapq.heappush(self._waiting, (self._clock() + refill, chat_id))
+
+    def _finish(self, send, result=None, error=None):
+        if error is not None:
+            self.stats['failed'] += 1
+        for future in send.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,79 @@
+# startup_profile.py
+# Startup budget report for `python main.py --startup-profile`
+
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import time
+
+_IMPORT_LINE = re.compile(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)')
+
+
+def import_times(module='main'):
+    """Import `module` in a fresh interpreter with -X importtime.
+
+    Returns (total, [(name, seconds)]) where the list holds the cumulative cost
+    of each module `module` imports directly, in import order.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    # Children are printed before their parent: collect depth-1 lines until the top-level line
+    total, direct, pending = 0.0, [], []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(1)) / 1e6, len(match.group(2)), match.group(3)
+        if indent == 2:
+            pending.append((name, cumulative))
+        elif indent == 0:
+            if name == module:
+                total, direct = cumulative, pending
+            pending = []
+    return total, direct
+
+
+async def init_times(application):
+    """Run the startup sequence of run_polling once, timing each phase, then shut down cleanly."""
+    phases = []
+
+    async def phase(name, coroutine):
+        started = time.perf_counter()
+        await coroutine
+        phases.append((name, time.perf_counter() - started))
+
+    await phase('telegram initialize (getMe)', application.initialize())
+    if application.post_init:
+        await phase('post_init (migrations, workers)', application.post_init(application))
+    await phase('start polling (deleteWebhook)', application.updater.start_polling())
+    await phase('application start', application.start())
+
+    await application.updater.stop()
+    await application.stop()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    await application.shutdown()
+    return phases
+
+
+def run_profile(build_application):
+    """Print import time per module and init time per phase."""
+    total_import, modules = import_times()
+    print(f"{'import main':<36}{total_import * 1000:>9.1f} ms")
+    for name, seconds in sorted(modules, key=lambda item: -item[1]):
+        if seconds >= 0.0005:
+            print(f"  {name:<34}{seconds * 1000:>9.1f} ms")
+
+    started = time.perf_counter()
+    application = build_application()
+    phases = [('build application', time.perf_counter() - started)]
+    try:
+        phases += asyncio.run(init_times(application))
+    except Exception as e:
+        print(f"init failed: {e}")
+    for name, seconds in phases:
+        print(f"{name:<36}{seconds * 1000:>9.1f} ms")
+    total = total_import + sum(seconds for _, seconds in phases)
+    print(f"{'total to first getUpdates':<36}{total * 1000:>9.1f} ms")
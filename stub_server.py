@@ -0,0 +1,151 @@
+# stub_server.py
+# Minimal asyncio HTTP/1.1 server shared by the local stub services
+
+import asyncio
+import json
+import threading
+
+_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+            409: "Conflict", 422: "Unprocessable Entity", 429: "Too Many Requests", 503: "Service Unavailable"}
+
+
+class StubServer:
+    """Keep-alive HTTP/1.1 server answering JSON; subclasses implement `_dispatch`.
+
+    Can run on the caller's event loop (`start_async`) or in a background thread
+    with its own loop (`start`), so both async and blocking clients can use it.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def _dispatch(self, method, path, headers, body):
+        """Handle one request. Returns (status, payload, extra_headers)."""
+        raise NotImplementedError
+
+    # Server lifecycle
+
+    async def start_async(self):
+        """Start serving on the running event loop."""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.base_url
+
+    async def stop_async(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def start(self):
+        """Start serving from a background thread with its own event loop."""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start_async())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop_async())
+            # Drop idle keep-alive connections and pending long polls
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.base_url
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def call_soon(self, func, *args):
+        """Run func on the server's loop, from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(func, *args)
+        else:
+            func(*args)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # HTTP handling
+
+    async def _handle_connection(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if headers.get('transfer-encoding', '').lower() == 'chunked':
+                    # requests sends form bodies it cannot size up front in chunks
+                    body = await _read_chunked(reader)
+                else:
+                    length = int(headers.get('content-length', 0))
+                    body = await reader.readexactly(length) if length else b''
+
+                self.inflight += 1
+                self.max_inflight = max(self.max_inflight, self.inflight)
+                try:
+                    status, payload, extra_headers = await self._dispatch(method, target.split('?', 1)[0], headers, body)
+                finally:
+                    self.inflight -= 1
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                head = [f"HTTP/1.1 {status} {_REASONS.get(status, 'Unknown')}",
+                        f"Content-Type: {extra_headers.pop('Content-Type', 'application/json')}",
+                        f"Content-Length: {len(data)}"]
+                head.extend(f"{k}: {v}" for k, v in extra_headers.items())
+                close = headers.get('connection', '').lower() == 'close'
+                head.append("Connection: close" if close else "Connection: keep-alive")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + data)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _read_chunked(reader):
+    """Read a chunked request body, including the trailer section."""
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b';', 1)[0].strip() or b'0', 16)
+        if size == 0:
+            while await reader.readline() not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
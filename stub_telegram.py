@@ -0,0 +1,200 @@
+# stub_telegram.py
+# Local stub of the Telegram Bot API for load tests
+
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qsl
+from stub_server import StubServer
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+def make_user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+
+def make_start_update(update_id, user_id):
+    """A /start command sent in a private chat."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "from": make_user(user_id),
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+def make_callback_update(update_id, user_id, data):
+    """An inline keyboard button press on a bot menu message."""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": make_user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+                "from": BOT_USER,
+                "text": "menu",
+            },
+        },
+    }
+
+
+def response_key(update):
+    """Key under which the bot's first reply to `update` is recorded."""
+    if 'callback_query' in update:
+        return ('callback', update['callback_query']['id'])
+    return ('chat', update['message']['chat']['id'])
+
+
+class StubTelegram(StubServer):
+    """Stub HTTP server answering the Bot API methods the bot uses.
+
+    Updates queued with `push_update` are served through getUpdates. The first
+    reply the bot sends for an update (answerCallbackQuery for button presses,
+    sendMessage for commands) is timed against the moment the update was pushed
+    or posted, giving end-to-end dispatch latency for polling and webhook modes.
+
+    With `flood_limits=(per_second, per_chat_per_second)` set, message sends and edits
+    beyond those rates over the last second are answered with 429 and retry_after,
+    like Telegram's flood control; `delivered` records what got through per chat.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, flood_limits=None, retry_after=1):
+        super().__init__(host, port)
+        self.flood_limits = flood_limits
+        self.retry_after = retry_after
+        self.flood_errors = 0
+        self.delivered = {}
+        self._sent_times = deque()
+        self._chat_sent_times = {}
+        self.calls = {}
+        self.webhook_url = None
+        self.pending = []
+        self.sent_at = {}
+        self.latencies = {}
+        self.ready = threading.Event()
+        self._new_updates = None
+        self._message_id = 1000
+
+    @property
+    def api_url(self):
+        """Value for TELEGRAM_API_BASE_URL."""
+        return f"{self.base_url}/bot"
+
+    def mark_sent(self, update, sent_at=None):
+        """Record when an update was handed to the bot."""
+        self.sent_at[response_key(update)] = sent_at if sent_at is not None else time.perf_counter()
+
+    def push_update(self, update):
+        """Queue an update for getUpdates. Safe to call from any thread."""
+        self.call_soon(self._push, update, time.perf_counter())
+
+    def _push(self, update, sent_at):
+        self.mark_sent(update, sent_at)
+        self.pending.append(update)
+        if self._new_updates is not None:
+            self._new_updates.set()
+
+    def _record_reply(self, key):
+        sent_at = self.sent_at.pop(key, None)
+        if sent_at is not None:
+            self.latencies[key] = time.perf_counter() - sent_at
+
+    async def _dispatch(self, method, path, headers, body):
+        _, _, api_method = path.rpartition('/')
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = _parse_params(headers, body)
+
+        if api_method == 'getMe':
+            return 200, _ok(BOT_USER), {}
+        if api_method in ('deleteWebhook', 'close', 'logOut'):
+            return 200, _ok(True), {}
+        if api_method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            self.ready.set()
+            return 200, _ok(True), {}
+        if api_method == 'getUpdates':
+            self.ready.set()
+            return 200, _ok(await self._get_updates(params)), {}
+        if api_method == 'answerCallbackQuery':
+            self._record_reply(('callback', str(params.get('callback_query_id'))))
+            return 200, _ok(True), {}
+        if api_method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            chat_id = params.get('chat_id')
+            if self._flooded(chat_id):
+                self.flood_errors += 1
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {self.retry_after}",
+                             "parameters": {"retry_after": self.retry_after}}, {}
+            self.delivered.setdefault(chat_id, []).append(params.get('text', ''))
+            self._record_reply(('chat', chat_id))
+            self._message_id += 1
+            return 200, _ok({"message_id": params.get('message_id') or self._message_id,
+                             "date": int(time.time()),
+                             "chat": {"id": chat_id, "type": "private"},
+                             "from": BOT_USER,
+                             "text": params.get('text', '')}), {}
+        return 200, _ok(True), {}
+
+    def _flooded(self, chat_id):
+        """Record a send and tell whether it breaks the flood limits over the last second."""
+        if not self.flood_limits:
+            return False
+        per_second, per_chat = self.flood_limits
+        now = time.monotonic()
+        chat_times = self._chat_sent_times.setdefault(chat_id, deque())
+        for times in (self._sent_times, chat_times):
+            while times and times[0] <= now - 1:
+                times.popleft()
+        if len(self._sent_times) >= per_second or len(chat_times) >= per_chat:
+            return True
+        self._sent_times.append(now)
+        chat_times.append(now)
+        return False
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        self.pending = [update for update in self.pending if update['update_id'] >= offset]
+        if not self.pending and timeout:
+            self._new_updates = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._new_updates = None
+        return self.pending[:limit]
+
+
+def _ok(result):
+    return {"ok": True, "result": result}
+
+
+def _parse_params(headers, body):
+    """Decode Bot API parameters: JSON body, or form fields with JSON-encoded values."""
+    if not body:
+        return {}
+    if headers.get('content-type', '').startswith('application/json'):
+        return json.loads(body)
+    params = {}
+    for key, value in parse_qsl(body.decode()):
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
@@ -0,0 +1,93 @@
+# test_api_cache.py
+# Script to test the panel client's read cache against a local stub panel
+
+import asyncio
+import logging
+from api_client import AsyncBlitzAPIClient, UserAlreadyExistsError
+from testkit import with_panel
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.CRITICAL)
+
+USER_ROUTE = 'GET /api/v1/users/{username}'
+
+
+async def ttl_expiry(panel):
+    panel.add_user('user_1_basic')
+    client = AsyncBlitzAPIClient(base_url=panel.base_url)
+    client.cache_ttls['user'] = 0.3
+    for _ in range(5):
+        await client.get_user('user_1_basic')
+    assert panel.requests[USER_ROUTE] == 1
+    await asyncio.sleep(0.35)
+    await client.get_user('user_1_basic')
+    await client.get_user('user_1_basic')
+    assert panel.requests[USER_ROUTE] == 2
+    assert client.cache_stats()['hits'] == 5, client.cache_stats()
+    await client.aclose()
+
+
+async def coalescing(panel, callers=50):
+    panel.add_user('user_1_basic')
+    client = AsyncBlitzAPIClient(base_url=panel.base_url)
+    client.cache_ttls['user'] = 60
+    await client.login()
+    users = await asyncio.gather(*(client.get_user('user_1_basic') for _ in range(callers)))
+    assert all(user['username'] == 'user_1_basic' for user in users)
+    assert panel.requests[USER_ROUTE] == 1
+    stats = client.cache_stats()
+    assert stats['misses'] == 1 and stats['coalesced'] == callers - 1 and stats['inflight'] == 0, stats
+    await client.aclose()
+
+
+async def invalidation(panel):
+    panel.add_user('user_1_basic')
+    client = AsyncBlitzAPIClient(base_url=panel.base_url)
+    client.cache_ttls['user'] = 60
+    await client.login()
+    await client.get_user('user_1_basic')
+    await client.get_user('user_1_basic')
+    assert panel.requests[USER_ROUTE] == 1
+
+    # Even a rejected create drops the cached lookup, since the panel state may have changed
+    try:
+        await client.create_user('user_1_basic', 'password', 0, 30)
+    except UserAlreadyExistsError:
+        pass
+    await client.get_user('user_1_basic')
+    assert panel.requests[USER_ROUTE] == 2
+
+    # A lookup in flight when the user changes is returned to its callers but not stored
+    client.cache.clear()
+    lookup = asyncio.create_task(client.get_user('user_1_basic'))
+    await asyncio.sleep(0.05)
+    client.invalidate_user('user_1_basic')
+    assert (await lookup)['username'] == 'user_1_basic'
+    await client.get_user('user_1_basic')
+    await client.get_user('user_1_basic')
+    assert panel.requests[USER_ROUTE] == 4, panel.requests
+    await client.aclose()
+
+
+def test_ttl_expiry():
+    with_panel(ttl_expiry)
+    print("✅ Запись кэша живёт TTL, после него запрос уходит в панель")
+
+
+def test_coalescing():
+    with_panel(coalescing, latency=0.1)
+    print("✅ 50 одновременных промахов по одному ключу — один запрос к панели")
+
+
+def test_invalidation():
+    with_panel(invalidation, latency=0.1)
+    print("✅ create_user сбрасывает кэш пользователя, в том числе запрос в полёте")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест кэша клиента панели")
+    print("=" * 60)
+    test_ttl_expiry()
+    test_coalescing()
+    test_invalidation()
+    print("✅ Тест пройден!")
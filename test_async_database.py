@@ -0,0 +1,77 @@
+# test_async_database.py
+# Script to test the AsyncDatabase facade: one writer thread, read-only reader threads
+
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from async_database import AsyncDatabase
+from database import Database
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.CRITICAL)
+
+
+def current_thread(db):
+    return threading.current_thread().name
+
+
+def insert_user(db):
+    db._conn.execute("INSERT INTO users (user_id, username) VALUES (999, 'intruder')")
+
+
+async def writer_and_readers(path, users):
+    db = AsyncDatabase(path, readers=4)
+    await db.create_tables()
+
+    # Record the thread every write runs on
+    threads = set()
+    add_user = Database.add_user
+
+    def recording_add_user(self, *args):
+        threads.add(threading.current_thread().name)
+        return add_user(self, *args)
+
+    Database.add_user = recording_add_user
+    try:
+        await asyncio.gather(*(db.add_user(i, f"user{i}", None, None) for i in range(1, users + 1)))
+    finally:
+        Database.add_user = add_user
+    end_date = (datetime.now() + timedelta(days=30)).isoformat()
+    await asyncio.gather(*(db.update_subscription(i, 'basic', 1, end_date) for i in range(1, users + 1)))
+
+    readers = set(await asyncio.gather(*(db.run_read(current_thread) for _ in range(50))))
+    active = await asyncio.gather(*(db.get_active_subscription(i) for i in range(1, users + 1)))
+    count = await db.count_users()
+
+    # A reader connection refuses writes even if one is sent to it by mistake
+    try:
+        await db.run_read(insert_user)
+        read_only = False
+    except sqlite3.OperationalError:
+        read_only = True
+    writer = await db.run_write(current_thread)
+    db.close()
+    return threads, writer, readers, active, count, read_only
+
+
+def test_writer_and_readers(users=200):
+    with tempfile.TemporaryDirectory() as tmp:
+        threads, writer, readers, active, count, read_only = asyncio.run(
+            writer_and_readers(os.path.join(tmp, 'bot.db'), users))
+    assert len(threads) == 1 and threads == {writer} and writer.startswith('db-writer'), (threads, writer)
+    assert readers and all(name.startswith('db-reader') for name in readers), readers
+    assert count == users and all(row is not None for row in active)
+    assert read_only
+    print(f"✅ {users} одновременных записей выполнены одним потоком записи ({writer})")
+    print(f"✅ Чтения идут в {len(readers)} потоках чтения, их соединения только для чтения")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест асинхронного доступа к базе")
+    print("=" * 60)
+    test_writer_and_readers()
+    print("✅ Тест пройден!")
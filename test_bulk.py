@@ -0,0 +1,102 @@
+# test_bulk.py
+# Script to test admin broadcasts and streamed exports
+
+import asyncio
+import csv
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from telegram.error import Forbidden
+from async_database import AsyncDatabase
+from bulk import Broadcaster, export
+from database import Database
+
+
+class FakeBot:
+    """Records sends; users in `blocked` have blocked the bot."""
+
+    rate_limiter = None
+
+    def __init__(self, blocked=()):
+        self.sent = []
+        self.blocked = set(blocked)
+
+    async def send_message(self, chat_id, text, rate_limit_args=None):
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        self.sent.append(chat_id)
+
+
+def seed(path, users):
+    """Every third user has an expired subscription, every fifth none at all."""
+    db = Database(path)
+    db.create_tables()
+    now = datetime.now()
+    with db._conn:
+        db._conn.executemany('INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+                             ((i, f"user{i}", "Имя") for i in range(1, users + 1)))
+        db._conn.executemany(
+            'INSERT INTO subscriptions (user_id, plan, device_limit, end_date, vpn_username, vpn_password, vpn_key) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((i, 'basic', 1, (now + timedelta(days=-5 if i % 3 == 0 else 20)).isoformat(), f"user_{i}", "secret", "key")
+             for i in range(1, users + 1) if i % 5))
+    db.close()
+    return [i for i in range(1, users + 1) if i % 5 and i % 3]
+
+
+def test_broadcast(users=3000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bulk.db')
+        active = seed(path, users)
+        db = AsyncDatabase(path)
+        bot = FakeBot(blocked=active[:10])
+        broadcaster = Broadcaster(db, batch_size=128, concurrency=16)
+        reports = []
+
+        async def report(progress):
+            reports.append(progress.text("Рассылка"))
+
+        async def run():
+            progress = await broadcaster.run(bot, "Новости", report)
+            # A second broadcast starts fresh
+            await broadcaster.run(FakeBot(), "Ещё")
+            return progress
+        progress = asyncio.run(run())
+        db.close()
+    assert sorted(bot.sent) == active[10:]
+    p = progress.progress()
+    assert p['total'] == len(active) and p['done'] == len(active) and p['skipped'] == 10 and p['failed'] == 0
+    print(f"✅ Рассылка дошла до {len(bot.sent)} подписчиков из {users} пользователей, 10 заблокировали бота")
+
+
+def test_export(users=3000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bulk.db')
+        seed(path, users)
+        reports = []
+
+        async def report(progress):
+            reports.append(progress.progress())
+
+        csv_path, progress = asyncio.run(export(path, 'subscriptions', 'csv', report, tmp))
+        with gzip.open(csv_path, 'rt', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        assert rows[0][:3] == ['id', 'user_id', 'plan'] and 'vpn_password' not in rows[0] and 'vpn_key' not in rows[0]
+        assert len(rows) - 1 == progress.total == users - users // 5
+
+        jsonl_path, progress = asyncio.run(export(path, 'users', 'jsonl', directory=tmp))
+        with gzip.open(jsonl_path, 'rt', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        assert len(records) == users and records[0]['first_name'] == "Имя"
+    print("✅ Выгрузка в CSV и JSONL (gzip) без паролей и ключей VPN")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест рассылок и выгрузок")
+    print("=" * 60)
+    test_broadcast()
+    test_export()
+    print("✅ Тест пройден!")
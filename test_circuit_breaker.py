@@ -0,0 +1,156 @@
+# test_circuit_breaker.py
+# Fault-injection harness: panel outages against the client's circuit breakers and GET retries
+
+import asyncio
+import logging
+import time
+from api_client import AsyncBlitzAPIClient, BlitzAPIClient, BlitzAPIError, CircuitOpenError
+from circuit_breaker import CircuitBreaker
+from stub_panel import StubPanel
+from testkit import with_panel
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.CRITICAL)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float('nan')
+
+
+def make_client(panel, threshold, reset_timeout=1.0, timeout=0.3, retries=None):
+    client = AsyncBlitzAPIClient(base_url=panel.base_url, timeout=timeout)
+    client.cache_ttls['status'] = 0
+    for family in ('users', 'server'):
+        client.breakers[family] = CircuitBreaker(family, threshold, reset_timeout)
+    if retries is not None:
+        client.retries = retries
+    return client
+
+
+async def outage(panel, threshold, rounds=20, burst=10):
+    """The panel hangs; bursts of status requests (admin panel clicks) keep arriving."""
+    client = make_client(panel, threshold)
+    latencies, rejected, failed = [], 0, 0
+
+    async def call():
+        nonlocal rejected, failed
+        started = time.perf_counter()
+        try:
+            await client.get_server_status()
+        except CircuitOpenError:
+            rejected += 1
+        except BlitzAPIError:
+            failed += 1
+        latencies.append(time.perf_counter() - started)
+
+    panel.latency = 5.0
+    tasks = []
+    for _ in range(rounds):
+        tasks.extend(asyncio.create_task(call()) for _ in range(burst))
+        await asyncio.sleep(0.05)
+    await asyncio.gather(*tasks)
+
+    # Recovery: after reset_timeout a probe goes through and closes the circuit
+    panel.latency = 0
+    recovered = None
+    if threshold < 1000:
+        await asyncio.sleep(1.0)
+        await client.get_server_status()
+        recovered = client.breakers['server'].state
+    await client.aclose()
+    return latencies, rejected, failed, recovered
+
+
+async def flaky(panel, retries, calls=300):
+    """Every request fails with probability panel.error_rate; GETs may be retried."""
+    client = make_client(panel, threshold=10 ** 9, retries=retries)
+    client.retry_budget.ratio = 1.0  # Let the budget cover every retry here
+    panel.add_user('flaky')
+    ok = 0
+    for _ in range(calls):
+        try:
+            await client.get_user('flaky', fresh=True)
+            ok += 1
+        except BlitzAPIError:
+            pass
+    await client.aclose()
+    return ok / calls
+
+
+async def budget(panel, calls=200):
+    """Hard outage: the budget keeps retries to a fraction of requests."""
+    client = make_client(panel, threshold=10 ** 9, retries=2)
+    client.retry_backoff = 0.001
+    started = time.monotonic()
+    for _ in range(calls):
+        try:
+            await client.get_user('missing', fresh=True)
+        except BlitzAPIError:
+            pass
+    elapsed = time.monotonic() - started
+    await client.aclose()
+    return client.retry_budget.spent, elapsed
+
+
+def test_outage_latency():
+    (base, _, base_failed, _), _ = with_panel(outage, 10 ** 9)
+    (latencies, rejected, failed, recovered), panel = with_panel(outage, 5)
+    print(f"   без автомата:  p50 {percentile(base, 50) * 1000:.0f} мс, p95 {percentile(base, 95) * 1000:.0f} мс, "
+          f"таймаутов {base_failed}")
+    print(f"   с автоматом:   p50 {percentile(latencies, 50) * 1000:.1f} мс, p95 {percentile(latencies, 95) * 1000:.0f} мс, "
+          f"таймаутов {failed}, отклонено сразу {rejected}")
+    assert percentile(base, 50) >= 0.25
+    assert percentile(latencies, 50) < 0.01
+    # Only requests already in flight when the first timeouts hit wait out the deadline
+    assert failed < base_failed / 2 and rejected + failed == len(latencies)
+    assert recovered == 'closed'
+    print("✅ Во время сбоя запросы отклоняются сразу, после восстановления автомат закрывается")
+
+
+def test_retries():
+    (without, _) = with_panel(flaky, 0, error_rate=0.3)
+    (with_retries, _) = with_panel(flaky, 2, error_rate=0.3)
+    print(f"   успешных GET при 30% ошибок: без повторов {without:.0%}, с повторами {with_retries:.0%}")
+    assert with_retries > without + 0.15
+    print("✅ Повторы GET с джиттером скрывают единичные ошибки")
+
+
+def test_retry_budget(calls=200):
+    (spent, elapsed), panel = with_panel(budget, calls, error_rate=1.0)
+    # Every first attempt that reached the panel (logins included) earns 0.2 retries
+    first_attempts = sum(panel.requests.values()) - spent
+    limit = 0.2 * first_attempts + 10 + elapsed
+    print(f"   {calls} запросов к лежащей панели: повторов {spent} (лимит {limit:.0f}), без бюджета было бы {2 * calls}")
+    assert spent <= limit
+    print("✅ Бюджет ограничивает повторы во время сбоя")
+
+
+def test_sync_client():
+    with StubPanel() as panel:
+        client = BlitzAPIClient(base_url=panel.base_url)
+        client.breakers['server'] = CircuitBreaker('server', 3, 60)
+        client.retries = 0
+        panel.error_rate = 1.0
+        errors = []
+        for _ in range(5):
+            try:
+                client.get_server_status()
+            except BlitzAPIError as e:
+                errors.append(e)
+        assert [type(e) for e in errors[3:]] == [CircuitOpenError, CircuitOpenError], errors
+        assert client.breakers['server'].state == 'open'
+        assert panel.requests['GET /api/v1/server/status'] == 3
+        # One failed login, not one per probe
+        assert panel.requests['POST /login'] == 1
+    print("✅ Синхронный клиент тоже отклоняет запросы при открытом автомате")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест автомата отключения и повторов запросов к панели")
+    print("=" * 60)
+    test_outage_latency()
+    test_retries()
+    test_retry_budget()
+    test_sync_client()
+    print("✅ Тест пройден!")
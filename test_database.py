@@ -0,0 +1,127 @@
+# test_database.py
+# Script to test the long-lived Database repository
+
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from database import Database
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.CRITICAL)
+
+
+def open_database(tmp):
+    db = Database(os.path.join(tmp, 'bot.db'))
+    db.create_tables()
+    return db
+
+
+def days_from_now(days):
+    return (datetime.now() + timedelta(days=days)).isoformat()
+
+
+def test_pragmas():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = open_database(tmp)
+        pragma = lambda name: db._conn.execute(f"PRAGMA {name}").fetchone()[0]
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('synchronous') == 1  # NORMAL
+        assert pragma('busy_timeout') == 5000
+        db.close()
+    print("✅ Соединение открыто в режиме WAL с настроенными pragma")
+
+
+def test_round_trip():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = open_database(tmp)
+        db.add_user(1, 'user1', 'First', 'Last')
+        db.add_user(1, 'renamed', 'First', 'Last')  # Existing users are kept as they are
+        assert db.get_user(1)[1] == 'user1'
+        assert db.get_referral_code(1) == db.get_referral_code(1) == 'REF1'
+        assert db.get_active_subscription(1) is None
+
+        db.update_subscription(1, 'basic', 1, days_from_now(30), 'user_1_basic', 'secret', 'hy2://key')
+        plan, device_limit, vpn_username, vpn_password, vpn_key, _ = db.get_active_subscription(1)
+        assert (plan, device_limit, vpn_username, vpn_password, vpn_key) == ('basic', 1, 'user_1_basic', 'secret',
+                                                                             'hy2://key')
+        db.add_user(2, 'user2', 'Second', 'Last')
+        db.update_subscription(2, 'basic', 1, days_from_now(-1))
+        assert db.get_active_subscription(2) is None
+        assert db.count_users() == 2
+        db.close()
+
+        # The data outlives the connection
+        db = open_database(tmp)
+        assert db.get_active_subscription(1)[0] == 'basic'
+        db.close()
+    print("✅ Пользователи, реферальные коды и подписки читаются обратно; истёкшая подписка не активна")
+
+
+def test_shared_between_threads(threads=8, users=200):
+    """One connection serves every thread; the lock keeps their transactions apart."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = open_database(tmp)
+        errors = []
+
+        def worker(offset):
+            try:
+                for user_id in range(offset, offset + users):
+                    db.add_user(user_id, f"user{user_id}", None, None)
+                    db.update_subscription(user_id, 'basic', 1, days_from_now(30))
+                    assert db.get_active_subscription(user_id) is not None
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=worker, args=(i * users,)) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        assert not errors, errors
+        assert db.count_users() == threads * users
+        db.close()
+    print(f"✅ {threads} потоков на одном соединении: {threads * users} пользователей без ошибок")
+
+
+def test_current_subscription_pointer():
+    """The pointer stays on the latest-ending subscription whatever order they are written in."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = open_database(tmp)
+        db.add_user(1, 'user1', None, None)
+        db.update_subscription(1, 'basic', 1, days_from_now(30))
+        db.update_subscription(1, 'premium', None, days_from_now(90))
+        # Written later but ends sooner: the pointer does not move
+        db.update_subscription(1, 'trial', 1, days_from_now(7))
+        pointer = db._conn.execute('SELECT current_subscription_id FROM users WHERE user_id = 1').fetchone()[0]
+        latest = db._conn.execute("SELECT id FROM subscriptions WHERE plan = 'premium'").fetchone()[0]
+        assert pointer == latest
+        assert db.get_active_subscription(1)[0] == 'premium'
+        db.close()
+    print("✅ Указатель на текущую подписку остаётся на подписке с самым поздним окончанием")
+
+
+def test_pointer_fallback():
+    """Users the pointer backfill has not reached yet are served by the subquery."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = open_database(tmp)
+        db.add_user(1, 'user1', None, None)
+        db.update_subscription(1, 'basic', 1, days_from_now(30))
+        db.update_subscription(1, 'premium', None, days_from_now(90))
+        with db._conn:
+            db._conn.execute('UPDATE users SET current_subscription_id = NULL')
+        assert db.get_active_subscription(1)[0] == 'premium'
+        db.close()
+    print("✅ Без указателя активная подписка находится подзапросом по индексу")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест базы данных")
+    print("=" * 60)
+    test_pragmas()
+    test_round_trip()
+    test_shared_between_threads()
+    test_current_subscription_pointer()
+    test_pointer_fallback()
+    print("✅ Тест пройден!")
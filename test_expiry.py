@@ -0,0 +1,161 @@
+# test_expiry.py
+# Script to test renewal reminders and subscription expiry on a simulated clock
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from async_database import AsyncDatabase
+from database import Database
+from expiry import ExpiryScheduler
+from testkit import temp_database
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.CRITICAL)
+
+NOW = float(int(time.time()))
+DAY = 86400
+
+
+def at(offset):
+    return datetime.fromtimestamp(NOW + offset).isoformat()
+
+
+def statuses(db):
+    return {user_id: db.get_user(user_id)[4] for user_id in range(1, db.count_users() + 1)}
+
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+
+    async def __call__(self, kind, rows):
+        self.sent.extend((kind, row[0]) for row in rows)
+
+
+async def run_clock(scheduler, start, end, step):
+    """Tick the scheduler from `start` to `end` seconds after NOW. Returns the largest heap size seen."""
+    largest = 0
+    for offset in range(start, end + 1, step):
+        while await scheduler.tick(NOW + offset) >= scheduler.batch_size:
+            pass
+        largest = max(largest, scheduler.queued())
+    return largest
+
+
+async def timeline(path, db):
+    # 1: ends in 100 s; 2: renewed before the old subscription ended; 3: ended ten days ago
+    db.update_subscription(1, 'basic', 1, at(100))
+    db.update_subscription(2, 'basic', 1, at(100))
+    db.update_subscription(2, 'basic', 1, at(1000))
+    db.update_subscription(3, 'basic', 1, at(-10 * DAY))
+
+    adb = AsyncDatabase(path)
+    recorder = Recorder()
+    scheduler = ExpiryScheduler(adb, remind_before=50, lookahead=30, batch_size=100, grace=DAY)
+    scheduler.notify = recorder
+    await run_clock(scheduler, 0, 20, 10)
+    # Long-ended subscription: status updated, no message
+    assert statuses(db)[3] == 'expired' and recorder.sent == [], recorder.sent
+    assert scheduler.stats['late'] == 1
+
+    # 4: written behind the reminder cursor, which has already passed subscription 1, found when it rewinds
+    db.update_subscription(4, 'basic', 1, at(80))
+    sent_at = {}
+    for offset in range(25, 1100, 5):
+        before = len(recorder.sent)
+        await scheduler.tick(NOW + offset)
+        for event in recorder.sent[before:]:
+            sent_at[event] = offset
+    adb.close()
+    return sent_at, statuses(db)
+
+
+async def many(path, db, subscriptions, batch_size):
+    """Subscriptions ending every few seconds over a day; a restart half way through."""
+    with db._conn:
+        db._conn.executemany(
+            "INSERT INTO subscriptions (user_id, plan, end_date) VALUES (?, 'basic', ?)",
+            ((i, at(i * DAY // subscriptions)) for i in range(1, subscriptions + 1)))
+        db._conn.execute("UPDATE users SET subscription_status = 'active'")
+    adb = AsyncDatabase(path)
+    recorder = Recorder()
+    scheduler = ExpiryScheduler(adb, remind_before=3600, lookahead=600, batch_size=batch_size, grace=DAY)
+    scheduler.notify = recorder
+    started = time.perf_counter()
+    largest = await run_clock(scheduler, 0, DAY // 2, 60)
+
+    scheduler = ExpiryScheduler(adb, remind_before=3600, lookahead=600, batch_size=batch_size, grace=DAY)
+    scheduler.notify = recorder
+    largest = max(largest, await run_clock(scheduler, DAY // 2, DAY + 60, 60))
+    elapsed = time.perf_counter() - started
+    adb.close()
+    return recorder.sent, largest, elapsed
+
+
+async def live(path, db):
+    """The background loop sleeps until the next due event rather than a full tick."""
+    db.update_subscription(1, 'basic', 1, datetime.fromtimestamp(time.time() + 0.6).isoformat())
+    adb = AsyncDatabase(path)
+    recorder = Recorder()
+    scheduler = ExpiryScheduler(adb, remind_before=0.3, lookahead=5, tick=10)
+    await scheduler.start(recorder)
+    started = time.monotonic()
+    while len(recorder.sent) < 2:
+        assert time.monotonic() - started < 5, "timed out"
+        await asyncio.sleep(0.02)
+    elapsed = time.monotonic() - started
+    await scheduler.stop()
+    adb.close()
+    return recorder.sent, elapsed
+
+
+def test_timeline():
+    with temp_database(4) as path:
+        db = Database(path)
+        sent_at, final = asyncio.run(timeline(path, db))
+        db.close()
+    assert set(sent_at) == {('reminder', 1), ('expired', 1), ('reminder', 2), ('expired', 2),
+                            ('reminder', 4), ('expired', 4)}, sent_at
+    assert sent_at[('reminder', 1)] == 50 and sent_at[('expired', 1)] == 100
+    # The renewed user hears about the new subscription only
+    assert sent_at[('reminder', 2)] == 950 and sent_at[('expired', 2)] == 1000
+    # The rewind runs every 30 s, so the late-written reminder fires within one lookahead
+    assert 30 <= sent_at[('reminder', 4)] <= 60 and sent_at[('expired', 4)] == 80
+    assert set(final.values()) == {'expired'}
+    print("✅ Напоминание и окончание срабатывают вовремя, продлившим — только по новой подписке")
+    print("✅ Давно истёкшие подписки закрываются без сообщения, записанные позже курсора — находятся")
+
+
+def test_live():
+    with temp_database(1) as path:
+        db = Database(path)
+        sent, elapsed = asyncio.run(live(path, db))
+        db.close()
+    assert sent == [('reminder', 1), ('expired', 1)] and elapsed < 1.5, (sent, elapsed)
+    print(f"✅ Фоновый цикл просыпается к ближайшему событию: оба сообщения за {elapsed:.2f} с при интервале 10 с")
+
+
+def test_many(subscriptions=20000, batch_size=200):
+    with temp_database(subscriptions) as path:
+        db = Database(path)
+        sent, largest, elapsed = asyncio.run(many(path, db, subscriptions, batch_size))
+        final = statuses(db)
+        db.close()
+    assert sorted(sent) == sorted([('reminder', i) for i in range(1, subscriptions + 1)] +
+                                  [('expired', i) for i in range(1, subscriptions + 1)])
+    assert set(final.values()) == {'expired'}
+    # Only the next ten minutes are held in memory: about 140 events per event type
+    window = subscriptions * 600 // DAY
+    assert largest <= 2 * (window + batch_size), largest
+    print(f"✅ {subscriptions} подписок за сутки: каждое событие ровно один раз, в том числе после перезапуска; "
+          f"в памяти не больше {largest} событий, {elapsed:.1f} с на {DAY // 60} проходов")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест окончания подписок")
+    print("=" * 60)
+    test_timeline()
+    test_live()
+    test_many()
+    print("✅ Тест пройден!")
@@ -0,0 +1,49 @@
+# test_keyboards.py
+# Script to test the keyboard render cache
+
+import config
+from keyboards import RenderCache
+
+
+def button_texts(markup):
+    return [button.text for row in markup.inline_keyboard for button in row]
+
+
+def test_reuse():
+    cache = RenderCache()
+    assert cache.main_menu(False) is cache.main_menu(False)
+    assert cache.plans() is cache.plans()
+    assert cache.builds == 1
+    assert "Админ панель" in button_texts(cache.main_menu(True))
+    assert "Админ панель" not in button_texts(cache.main_menu(False))
+    print("✅ Клавиатуры строятся один раз, у админа и пользователя разные варианты меню")
+
+
+def test_reload():
+    original = config.SUBSCRIPTION_PLANS
+    cache = RenderCache()
+    try:
+        cache.plans()
+        # Reloading the config replaces the dict: the listing is rebuilt on next use
+        config.SUBSCRIPTION_PLANS = dict(original, trial={'traffic_gb': 5, 'expiration_days': 3, 'device_limit': 1, 'price': 0.0})
+        _, markup = cache.plans()
+        assert any(button.callback_data == 'buy_trial' for row in markup.inline_keyboard for button in row)
+        assert cache.builds == 2
+
+        # In-place edits need an explicit invalidate()
+        del config.SUBSCRIPTION_PLANS['trial']
+        cache.invalidate()
+        assert 'buy_trial' not in [button.callback_data for row in cache.plans()[1].inline_keyboard for button in row]
+        assert cache.builds == 3
+    finally:
+        config.SUBSCRIPTION_PLANS = original
+    print("✅ После перезагрузки планов список подписок строится заново")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест кэша клавиатур")
+    print("=" * 60)
+    test_reuse()
+    test_reload()
+    print("✅ Тест пройден!")
@@ -0,0 +1,116 @@
+# test_log_pipeline.py
+# Script to test the queued JSON logging pipeline with sampling and rate limits
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from log_pipeline import JsonFormatter, LoggerPolicy, parse_sample, setup_logging
+
+
+def record(name, level=logging.INFO, msg="message", args=()):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_json_format():
+    formatter = JsonFormatter()
+    logger = logging.getLogger('test.json')
+    entry = record('purchases', msg="Purchase job %s done", args=(7,))
+    entry.job_id = 7
+    line = json.loads(formatter.format(entry))
+    assert line['msg'] == "Purchase job 7 done"
+    assert line['logger'] == 'purchases' and line['level'] == 'INFO'
+    assert line['job_id'] == 7
+    assert 'args' not in line and 'levelno' not in line
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        failed = logger.makeRecord('main', logging.ERROR, __file__, 1, "Export failed", (), sys.exc_info())
+    line = json.loads(formatter.format(failed))
+    assert 'ValueError: broken' in line['exc']
+    print("✅ JSON: одна запись на строку, поля extra и трассировка")
+
+
+def test_sampling():
+    policy = LoggerPolicy(parse_sample('httpx=0, api_client=0.5'))
+    assert all(not policy.filter(record('httpx')) for _ in range(100))
+    # Children are covered by their parent's rate
+    assert not policy.filter(record('httpx._client'))
+    # Warnings and errors are never sampled
+    assert policy.filter(record('httpx', logging.WARNING))
+    assert policy.filter(record('httpx', logging.ERROR))
+    kept = sum(policy.filter(record('api_client')) for _ in range(4000))
+    assert 1700 < kept < 2300, kept
+    assert all(policy.filter(record('purchases')) for _ in range(100))
+    print(f"✅ Выборка по логгерам: httpx отброшен, api_client сохранено {kept}/4000")
+
+
+def test_rate_limit():
+    policy = LoggerPolicy(rate=10, burst=5)
+    passed = [policy.filter(record('router', logging.WARNING)) for _ in range(20)]
+    assert sum(passed) == 5, passed
+    # Other loggers have their own bucket, errors are never limited
+    assert policy.filter(record('purchases', logging.WARNING))
+    assert policy.filter(record('router', logging.ERROR))
+    time.sleep(0.15)
+    later = record('router', logging.WARNING)
+    assert policy.filter(later)
+    assert later.suppressed == 15
+    assert policy.dropped['rate_limited'] == 15
+    print("✅ Ограничение частоты по логгерам: 15 записей отброшено и учтено в следующей")
+
+
+class Probe:
+    """Argument that notes which thread turned it into text."""
+
+    def __init__(self):
+        self.formatted_in = None
+
+    def __str__(self):
+        self.formatted_in = threading.current_thread().name
+        return "probe"
+
+
+def test_pipeline():
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bot.log')
+        listener, policy = setup_logging('INFO', 'json', path, 'httpx=0', rate=0)
+        try:
+            probe = Probe()
+            logger = logging.getLogger('purchases')
+            for i in range(1000):
+                logger.info("Queued purchase job %s", i, extra={'job_id': i})
+            logging.getLogger('httpx').info("HTTP Request: POST /sendMessage")
+            logger.warning("Probe %s", probe)
+        finally:
+            listener.stop()
+            for handler in root.handlers[:]:
+                root.removeHandler(handler)
+            for handler in saved_handlers:
+                root.addHandler(handler)
+            root.setLevel(saved_level)
+            listener.handlers[0].close()
+        with open(path, encoding='utf-8') as log:
+            lines = [json.loads(line) for line in log]
+    assert len(lines) == 1001, len(lines)
+    assert lines[999] == dict(lines[999], msg="Queued purchase job 999", job_id=999)
+    assert lines[-1]['msg'] == "Probe probe"
+    assert probe.formatted_in != threading.main_thread().name, probe.formatted_in
+    assert policy.dropped['sampled'] == 1
+    print("✅ Очередь: все записи записаны после stop(), форматирование в потоке записи")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест конвейера логирования")
+    print("=" * 60)
+    test_json_format()
+    test_sampling()
+    test_rate_limit()
+    test_pipeline()
+    print("✅ Тест пройден!")
@@ -0,0 +1,161 @@
+# test_metrics.py
+# Script to test metrics, the /metrics endpoint and hot-path instrumentation
+
+import asyncio
+import logging
+import os
+import tempfile
+import urllib.error
+import urllib.request
+import api_client
+from api_client import AsyncBlitzAPIClient
+from async_database import AsyncDatabase
+from metrics import Counter, Gauge, Histogram, MetricsServer, Registry, REGISTRY, PANEL_LATENCY, DB_LATENCY
+from stub_panel import StubPanel
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.CRITICAL)
+
+
+def test_render():
+    registry = Registry()
+    latency = Histogram('test_seconds', "Test latency", ['route'], buckets=(0.1, 1.0), registry=registry)
+    calls = Counter('test_calls_total', "Test calls", registry=registry)
+    queue = Gauge('test_queue_size', "Test queue", registry=registry)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.labels('buy_{plan}').observe(value)
+    calls.inc()
+    calls.inc(2)
+    items = [1, 2, 3]
+    queue.set_function(lambda: len(items))
+    text = registry.render()
+    assert '# TYPE test_seconds histogram' in text
+    # Buckets are cumulative and inclusive of the bound
+    assert 'test_seconds_bucket{route="buy_{plan}",le="0.1"} 2' in text
+    assert 'test_seconds_bucket{route="buy_{plan}",le="1"} 3' in text
+    assert 'test_seconds_bucket{route="buy_{plan}",le="+Inf"} 4' in text
+    assert 'test_seconds_count{route="buy_{plan}"} 4' in text
+    assert 'test_seconds_sum{route="buy_{plan}"} 3.65' in text
+    assert 'test_calls_total 3' in text
+    assert 'test_queue_size 3' in text
+    items.append(4)
+    assert 'test_queue_size 4' in registry.render()
+    try:
+        Counter('test_calls_total', "Duplicate", registry=registry)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("duplicate metric names must be rejected")
+    print("✅ Формат Prometheus: накопительные бакеты, счётчики, gauge из функции")
+
+
+async def scrape(registry):
+    server = MetricsServer('127.0.0.1', 0, registry)
+    await server.start()
+    try:
+        url = f"http://127.0.0.1:{server.port}"
+        body = await asyncio.to_thread(lambda: urllib.request.urlopen(f"{url}/metrics").read().decode())
+        try:
+            await asyncio.to_thread(urllib.request.urlopen, f"{url}/other")
+        except urllib.error.HTTPError as e:
+            missing = e.code
+        return body, missing
+    finally:
+        await server.stop()
+
+
+def test_endpoint():
+    registry = Registry()
+    Counter('test_scrapes_total', "Scrapes", registry=registry).inc()
+    body, missing = asyncio.run(scrape(registry))
+    assert 'test_scrapes_total 1' in body
+    assert missing == 404
+    print("✅ Эндпоинт /metrics отвечает, остальные пути — 404")
+
+
+def panel_counts(keys):
+    """Observations recorded so far per panel series; the histogram is shared by the whole process."""
+    return {key: PANEL_LATENCY.children[key].count if key in PANEL_LATENCY.children else 0 for key in keys}
+
+
+def test_panel_instrumentation():
+    series = [('POST', '/api/v1/users/', '200'), ('GET', '/api/v1/users/{username}', '200'),
+              ('GET', '/api/v1/users/{username}', '404')]
+    before = panel_counts(series)
+    panel = StubPanel()
+    panel.start()
+    handler = CapturingHandler()
+    log = logging.getLogger('api_client')
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    try:
+        client = AsyncBlitzAPIClient(base_url=panel.base_url)
+
+        async def calls():
+            api_client.BLITZ_PAYLOAD_LOG_SAMPLE = 0
+            await client.create_user('alice', 'secret-pw', 0, 30, unlimited=True)
+            await client.get_user('alice', fresh=True)
+            api_client.BLITZ_PAYLOAD_LOG_SAMPLE = 1
+            await client.create_user('bob', 'secret-pw', 0, 30, unlimited=True)
+            try:
+                await client.get_user('nobody', fresh=True)
+            except api_client.BlitzAPIError:
+                pass
+            await client.aclose()
+
+        asyncio.run(calls())
+    finally:
+        api_client.BLITZ_PAYLOAD_LOG_SAMPLE = 0.01
+        log.removeHandler(handler)
+        log.setLevel(logging.NOTSET)
+        log.propagate = True
+        panel.stop()
+
+    # Usernames are folded into one endpoint label, so series stay few
+    after = panel_counts(series)
+    assert [after[key] - before[key] for key in series] == [2, 1, 1], (before, after)
+    # Bodies are logged for sampled calls only, and never with the password
+    bodies = [message for message in handler.messages if 'Request data' in message]
+    assert len(bodies) == 1 and "'username': 'bob'" in bodies[0], bodies
+    assert not any('secret-pw' in message for message in handler.messages)
+    print("✅ Задержка и статус запросов к панели по шаблонам эндпоинтов, тела запросов — выборочно")
+
+
+class CapturingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_database_instrumentation():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncDatabase(os.path.join(tmp, 'metrics.db'), readers=2)
+
+        async def calls():
+            await db.create_tables()
+            await db.add_user(1, 'alice', 'Alice', None)
+            for _ in range(5):
+                await db.get_user(1)
+            return db.queue_depths()
+
+        depths = asyncio.run(calls())
+        db.close()
+    assert DB_LATENCY.children[('get_user',)].count >= 5
+    assert DB_LATENCY.children[('add_user',)].count >= 1
+    assert depths == {'writer': 0, 'readers': 0}
+    assert 'sqlite_query_seconds_count{function="get_user"}' in REGISTRY.render()
+    print("✅ Задержка функций database.py и очереди потоков БД")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест метрик")
+    print("=" * 60)
+    test_render()
+    test_endpoint()
+    test_panel_instrumentation()
+    test_database_instrumentation()
+    print("✅ Тест пройден!")
@@ -0,0 +1,176 @@
+# test_migrations.py
+# Script to test versioned schema migrations and resumable backfills
+
+import logging
+import os
+import sqlite3
+import tempfile
+import migrations
+from database import Database
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.CRITICAL)
+
+
+def create_legacy(path, users):
+    """A database written before versioning: user_version 0, the original tables and data."""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            subscription_status TEXT DEFAULT 'Не активирована',
+            referral_code TEXT UNIQUE,
+            referred_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            plan TEXT,
+            device_limit INTEGER,
+            vpn_username TEXT,
+            vpn_password TEXT,
+            vpn_key TEXT,
+            start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_date TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    conn.executemany('INSERT INTO users (user_id, username) VALUES (?, ?)',
+                     ((i, f"user{i}") for i in range(1, users + 1)))
+    # Two subscriptions per user; the later one is current
+    conn.executemany(
+        'INSERT INTO subscriptions (user_id, plan, end_date, vpn_username) VALUES (?, ?, ?, ?)',
+        [(i, 'basic', '2024-01-01T00:00:00', f"user_{i}_basic") for i in range(1, users + 1)] +
+        [(i, 'premium', '2024-06-01T00:00:00', f"user_{i}_premium") for i in range(1, users + 1)])
+    conn.commit()
+    conn.close()
+
+
+def columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def current_subscriptions(conn):
+    return dict(conn.execute('''
+        SELECT u.user_id, s.plan FROM users u LEFT JOIN subscriptions s ON s.id = u.current_subscription_id
+    ''').fetchall())
+
+
+def test_legacy_database():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'legacy.db')
+        create_legacy(path, 10)
+        db = Database(path)
+        assert migrations.get_version(db._conn) == 0
+        db.create_tables()
+        conn = db._conn
+        assert migrations.get_version(conn) == migrations.latest_version()
+        assert 'current_subscription_id' in columns(conn, 'users')
+        assert {'schema_backfills', 'idx_subscriptions_user_end_date'} <= {
+            row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+        # Existing rows are kept and the pointer backfill is queued, not run at startup
+        assert conn.execute('SELECT COUNT(*) FROM subscriptions').fetchone()[0] == 20
+        assert conn.execute('SELECT name, last_key, done FROM schema_backfills').fetchall() == [
+            ('current_subscription_id', 0, 0)]
+        assert set(current_subscriptions(conn).values()) == {None}
+        db.close()
+    print("✅ База без версии с уже созданными таблицами обновлена до последней версии, данные сохранены")
+
+
+def test_rerun():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bot.db')
+        db = Database(path)
+        db.create_tables()
+        schema = db._conn.execute('SELECT type, name, sql FROM sqlite_master ORDER BY name').fetchall()
+        assert migrations.migrate(db._conn) == 0
+        db.close()
+
+        # A restart applies nothing and changes nothing
+        db = Database(path)
+        assert migrations.migrate(db._conn) == 0
+        assert db._conn.execute('SELECT type, name, sql FROM sqlite_master ORDER BY name').fetchall() == schema
+        assert migrations.get_version(db._conn) == migrations.latest_version()
+        db.close()
+    print("✅ Повторный запуск миграций ничего не применяет")
+
+
+def test_rollback():
+    version = migrations.latest_version() + 1
+
+    def broken(conn):
+        migrations.add_column(conn, 'users', 'half_applied', 'TEXT')
+        conn.execute("UPDATE users SET username = 'changed'")
+        raise RuntimeError("step failed")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bot.db')
+        db = Database(path)
+        db.create_tables()
+        db._conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'user1')")
+        db._conn.commit()
+
+        step = (version, "Broken step", broken)
+        migrations.MIGRATIONS.append(step)
+        try:
+            db.create_tables()
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("the failing step did not raise")
+        finally:
+            migrations.MIGRATIONS.remove(step)
+        conn = db._conn
+        assert not conn.in_transaction
+        assert migrations.get_version(conn) == version - 1
+        assert 'half_applied' not in columns(conn, 'users')
+        assert conn.execute('SELECT username FROM users').fetchone()[0] == 'user1'
+        db.close()
+    print("✅ Ошибка в шаге миграции откатывает весь шаг вместе с номером версии")
+
+
+def test_backfill_resume(users=25, batch_size=10):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'legacy.db')
+        create_legacy(path, users)
+        db = Database(path)
+        db.create_tables()
+        assert db.run_backfill_batch(batch_size)
+        assert db._conn.execute('SELECT last_key, done FROM schema_backfills').fetchone() == (batch_size, 0)
+        filled = current_subscriptions(db._conn)
+        assert all(filled[i] == 'premium' for i in range(1, batch_size + 1))
+        assert all(filled[i] is None for i in range(batch_size + 1, users + 1))
+        db.close()
+
+        # After a restart the backfill continues from last_key rather than from the start
+        db = Database(path)
+        db.create_tables()
+        db._conn.execute("UPDATE users SET current_subscription_id = NULL WHERE user_id <= ?", (batch_size,))
+        db._conn.commit()
+        batches = 0
+        while db.run_backfill_batch(batch_size):
+            batches += 1
+        filled = current_subscriptions(db._conn)
+        assert batches == 3, batches
+        assert all(filled[i] is None for i in range(1, batch_size + 1))
+        assert all(filled[i] == 'premium' for i in range(batch_size + 1, users + 1))
+        assert db._conn.execute('SELECT done FROM schema_backfills').fetchone()[0] == 1
+        assert not db.run_backfill_batch(batch_size)
+        db.close()
+    print(f"✅ Заполнение {users} пользователей пачками по {batch_size}: после перезапуска продолжено с last_key")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест миграций схемы")
+    print("=" * 60)
+    test_legacy_database()
+    test_rerun()
+    test_rollback()
+    test_backfill_resume()
+    print("✅ Тест пройден!")
@@ -0,0 +1,135 @@
+# test_panel_pool.py
+# Script to test load-aware placement of new VPN users across several local stub panels
+
+import logging
+from api_client import AsyncBlitzAPIClient, BlitzAPIError, PanelNode, PanelPool
+from async_database import AsyncDatabase
+from database import Database
+from purchases import PurchaseWorkerPool
+from reconcile import Reconciler
+from testkit import run, wait_for
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.CRITICAL)
+
+NODES = ('de1', 'nl1', 'fi1')
+
+
+def make_pool(panels, placement_cost=5.0, max_users=None):
+    max_users = max_users or {}
+    return PanelPool([PanelNode(name, AsyncBlitzAPIClient(base_url=panel.base_url, timeout=1), max_users.get(name, 0))
+                      for name, panel in panels.items()], interval=0, placement_cost=placement_cost)
+
+
+async def placement(path, panels, purchases):
+    """A burst of purchases goes to the idlest nodes and never to a failing one."""
+    panels['de1'].cpu_usage, panels['de1'].ram_usage, panels['de1'].online_users = "10%", "20%", 40
+    panels['nl1'].cpu_usage, panels['nl1'].ram_usage, panels['nl1'].online_users = "35%", "30%", 120
+    panels['fi1'].error_rate = 1.0
+    pool = make_pool(panels)
+    await pool.start()
+    assert [node['healthy'] for node in pool.stats()] == [True, True, False]
+
+    db = AsyncDatabase(path)
+    workers = PurchaseWorkerPool(db, pool, workers=4, retry_delay=0.05)
+    await workers.start()
+    for user_id in range(1, purchases + 1):
+        await workers.submit(user_id, 'basic', user_id, 1)
+
+    async def all_done():
+        return (await db.count_purchase_jobs()).get('done', 0) == purchases
+    await wait_for(all_done)
+    await workers.stop()
+
+    # Every subscription records the node its account was created on, and lookups follow it
+    reader = Database(path)
+    rows = reader._conn.execute('SELECT vpn_username, panel_node FROM subscriptions').fetchall()
+    reader.close()
+    for username, node in rows:
+        assert username in panels[node].users, (username, node)
+        uri = await pool.client(node).get_user_uri(username)
+        assert uri['ipv4']
+    placed = {name: len(panel.users) for name, panel in panels.items()}
+    await pool.aclose()
+    db.close()
+    return placed
+
+
+async def reconcile_by_node(path, panels):
+    """The reconciler looks each subscription up on its own node; old rows use the first node."""
+    db = Database(path)
+    with db._conn:
+        db._conn.executemany(
+            "INSERT INTO subscriptions (user_id, plan, end_date, vpn_username, panel_node) VALUES (?, 'basic', '2099-01-01', ?, ?)",
+            [(1, 'legacy_user', None), (2, 'de1_user', 'de1'), (3, 'nl1_user', 'nl1')])
+    db.close()
+    panels['de1'].add_user('legacy_user')
+    panels['de1'].add_user('de1_user')
+    panels['nl1'].add_user('nl1_user')
+
+    pool = make_pool(panels)
+    db = AsyncDatabase(path)
+    progress = await Reconciler(db, pool).run()
+    await pool.aclose()
+    db.close()
+    return progress
+
+
+async def headroom_and_failover(panels):
+    # Low CPU, but almost out of user slots: the scarcest resource decides
+    panels['de1'].cpu_usage, panels['de1'].ram_usage, panels['de1'].online_users = "5%", "10%", 95
+    panels['nl1'].cpu_usage, panels['nl1'].ram_usage, panels['nl1'].online_users = "40%", "50%", 10
+    panels['fi1'].cpu_usage, panels['fi1'].ram_usage, panels['fi1'].online_users = "70%", "60%", 10
+    pool = make_pool(panels, placement_cost=0, max_users={'de1': 100, 'nl1': 100})
+    await pool.check_health()
+    assert pool.choose() == 'nl1'
+    headroom = {node['name']: round(node['headroom']) for node in pool.stats()}
+    assert headroom == {'de1': 5, 'nl1': 50, 'fi1': 30}, headroom
+
+    # A node that starts failing its checks gets no new users until it recovers
+    panels['nl1'].error_rate = 1.0
+    await pool.check_health()
+    assert not pool.nodes['nl1'].healthy
+    assert {pool.choose() for _ in range(10)} == {'fi1'}
+    panels['fi1'].error_rate = panels['de1'].error_rate = 1.0
+    await pool.check_health()
+    assert not pool.is_available('users')
+    try:
+        pool.choose()
+        raise AssertionError("no node should be chosen")
+    except BlitzAPIError:
+        pass
+    panels['fi1'].error_rate = 0.0
+    await pool.check_health()
+    assert pool.choose() == 'fi1'
+    await pool.aclose()
+
+
+def test_placement(purchases=60):
+    placed, _, _ = run(lambda path, panels: placement(path, panels, purchases), purchases, nodes=NODES)
+    assert placed['fi1'] == 0
+    assert sum(placed.values()) == purchases
+    # de1 starts 25 points ahead; at 5 points per placement both nodes end up sharing the burst
+    assert placed['de1'] > placed['nl1'] > 0, placed
+    print(f"✅ {purchases} покупок: de1 {placed['de1']}, nl1 {placed['nl1']}, недоступная fi1 {placed['fi1']}; "
+          f"ключи получены с узла подписки")
+
+
+def test_reconcile_by_node():
+    progress, _, _ = run(reconcile_by_node, 3, nodes=NODES)
+    assert progress['processed'] == 3 and progress['missing'] == 0 and progress['failed'] == 0, progress
+    print("✅ Сверка обращается к узлу подписки, старые подписки — к первому узлу")
+
+
+def test_headroom_and_failover():
+    run(lambda path, panels: headroom_and_failover(panels), 0, nodes=NODES)
+    print("✅ Запас считается по самому дефицитному ресурсу; недоступные узлы пропускаются до восстановления")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест пула панелей")
+    print("=" * 60)
+    test_placement()
+    test_reconcile_by_node()
+    test_headroom_and_failover()
+    print("✅ Тест пройден!")
@@ -0,0 +1,280 @@
+# test_purchases.py
+# Script to test the durable purchase queue against a local stub panel
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from async_database import AsyncDatabase
+from circuit_breaker import CircuitBreaker
+from purchases import PurchaseWorkerPool
+from testkit import count_subscriptions, run, single_panel, wait_for
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.WARNING)
+
+
+async def throughput(path, panel, purchases):
+    db = AsyncDatabase(path)
+    panels = await single_panel(panel)
+    notified = []
+    pool = PurchaseWorkerPool(db, panels, workers=16, retry_delay=0.05)
+
+    async def notify(job):
+        notified.append(job)
+
+    await pool.start(notify)
+    started = time.perf_counter()
+    for user_id in range(1, purchases + 1):
+        await pool.submit(user_id, 'basic', user_id, 1)
+        if user_id == 1:
+            # A second tap on the same button joins the queued job
+            _, created = await pool.submit(1, 'basic', 1, 2)
+            assert not created
+
+    async def all_done():
+        return (await db.count_purchase_jobs()).get('done', 0) == purchases
+    await wait_for(all_done)
+    elapsed = time.perf_counter() - started
+    await pool.stop()
+    await panels.aclose()
+    db.close()
+    assert len(notified) == purchases
+    assert all(job['vpn_key'] for job in notified)
+    return elapsed
+
+
+async def resume_after_timeout(path, panel):
+    """The account request times out but the panel creates the user; the retry adopts it."""
+    db = AsyncDatabase(path)
+    panels = await single_panel(panel, timeout=0.1)
+    pool = PurchaseWorkerPool(db, panels, retry_delay=0.05)
+    panel.latency = 0.3
+    await pool.start()
+    job, _ = await pool.submit(1, 'basic')
+
+    async def retried():
+        return pool.retried > 0
+    await wait_for(retried)
+    panel.latency = 0
+
+    async def done():
+        return (await db.get_purchase_job(job['id']))['status'] == 'done'
+    await wait_for(done)
+    await pool.stop()
+    await panels.aclose()
+    db.close()
+
+
+async def resume_after_crash(path, panel):
+    """Workers are killed mid-request; a new pool picks the job up and finishes it."""
+    db = AsyncDatabase(path)
+    panels = await single_panel(panel)
+    panel.latency = 0.2
+    pool = PurchaseWorkerPool(db, panels)
+    await pool.start()
+    job, _ = await pool.submit(1, 'basic')
+    await asyncio.sleep(0.1)
+    await pool.stop()
+    assert (await db.get_purchase_job(job['id']))['status'] == 'running'
+    await asyncio.sleep(0.2)
+    panel.latency = 0
+
+    pool = PurchaseWorkerPool(db, panels)
+    await pool.start()
+
+    async def done():
+        return (await db.get_purchase_job(job['id']))['status'] == 'done'
+    await wait_for(done)
+    await pool.stop()
+    await panels.aclose()
+    db.close()
+
+
+async def existing_account(path, panel):
+    """A first attempt answered with 409 is a real conflict and fails without retries."""
+    panel.add_user('user_1_basic')
+    db = AsyncDatabase(path)
+    panels = await single_panel(panel)
+    notified = []
+    pool = PurchaseWorkerPool(db, panels)
+
+    async def notify(job):
+        notified.append(job)
+
+    await pool.start(notify)
+    job, _ = await pool.submit(1, 'basic', 1, 1)
+
+    async def finished():
+        return bool(notified)
+    await wait_for(finished)
+    await pool.stop()
+    await panels.aclose()
+    db.close()
+    assert notified[0]['status'] == 'failed' and notified[0]['attempts'] == 1, notified[0]
+
+
+async def panel_outage(path, panel, max_attempts=2):
+    """The panel is down for longer than the job's attempts would last; the job waits and then finishes."""
+    db = AsyncDatabase(path)
+    panels = await single_panel(panel)
+    panels.client().breakers['users'] = CircuitBreaker('users', 1, 0.1)
+    pool = PurchaseWorkerPool(db, panels, max_attempts=max_attempts, retry_delay=0.02)
+    panel.error_rate = 1.0
+    await pool.start()
+    job, _ = await pool.submit(1, 'basic')
+
+    async def waited():
+        return pool.retried > 5 * max_attempts
+    await wait_for(waited)
+    waiting = await db.get_purchase_job(job['id'])
+    panel.error_rate = 0.0
+
+    async def done():
+        return (await db.get_purchase_job(job['id']))['status'] == 'done'
+    await wait_for(done)
+    await pool.stop()
+    await panels.aclose()
+    db.close()
+    return waiting, pool.failed, pool.retried, panel.requests['POST /api/v1/users/']
+
+
+async def renewal(path, panel, removed=False):
+    """A repeat purchase of the plan extends the user's panel account instead of creating a new one."""
+    db = AsyncDatabase(path)
+    panels = await single_panel(panel)
+    notified = []
+    pool = PurchaseWorkerPool(db, panels)
+
+    async def notify(job):
+        notified.append(job)
+
+    await pool.start(notify)
+    await pool.submit(1, 'basic', 1, 1)
+
+    async def notified_of(count):
+        return len(notified) == count
+    await wait_for(lambda: notified_of(1))
+    if removed:
+        # The panel has cleaned up the expired account before the user came back
+        del panel.users['user_1_basic']
+    # Bought again from the expiry reminder, a new message
+    job, created = await pool.submit(1, 'basic', 1, 2)
+    assert created and job['extends_end_date'], job
+    await wait_for(lambda: notified_of(2))
+    await pool.stop()
+    await panels.aclose()
+    db.close()
+    assert [job['status'] for job in notified] == ['done', 'done'], notified
+    assert notified[1]['vpn_username'] == notified[0]['vpn_username'] == 'user_1_basic'
+    assert notified[1]['vpn_key'] == notified[0]['vpn_key']
+
+
+async def expired_and_removed(path, panel):
+    """Renewing a subscription that ended ten days ago, whose account the panel has already removed."""
+    db = AsyncDatabase(path)
+    ended = (datetime.now() - timedelta(days=10)).isoformat()
+    await db.update_subscription(1, 'basic', 1, ended, 'user_1_basic', 'secret', 'hy2://old')
+    panels = await single_panel(panel)
+    notified = []
+    pool = PurchaseWorkerPool(db, panels)
+
+    async def notify(job):
+        notified.append(job)
+
+    await pool.start(notify)
+    job, _ = await pool.submit(1, 'basic', 1, 1)
+    assert job['extends_end_date'] == ended and job['vpn_password'] == 'secret', job
+
+    async def finished():
+        return bool(notified)
+    await wait_for(finished)
+    await pool.stop()
+    await panels.aclose()
+    subscription = await db.get_active_subscription(1)
+    db.close()
+    assert notified[0]['status'] == 'done' and notified[0]['attempts'] == 1, notified[0]
+    return subscription
+
+
+def test_throughput(purchases=200):
+    elapsed, subscriptions, panel = run(lambda path, panel: throughput(path, panel, purchases), purchases, 0.05,
+                                        inspect=count_subscriptions)
+    assert subscriptions == purchases
+    assert panel.requests['POST /api/v1/users/'] == purchases
+    print(f"✅ {purchases} покупок за {elapsed:.2f}s при задержке панели 50 мс ({purchases / elapsed:.0f}/s)")
+
+
+def test_resume_after_timeout():
+    _, subscriptions, panel = run(resume_after_timeout, inspect=count_subscriptions)
+    assert subscriptions == 1
+    assert len(panel.users) == 1
+    print("✅ Таймаут при создании: повтор получил 409 и завершил покупку без дубля")
+
+
+def test_resume_after_crash():
+    _, subscriptions, panel = run(resume_after_crash, inspect=count_subscriptions)
+    assert subscriptions == 1
+    assert len(panel.users) == 1
+    print("✅ Покупка продолжена после перезапуска воркеров")
+
+
+def test_existing_account():
+    _, subscriptions, _ = run(existing_account, inspect=count_subscriptions)
+    assert subscriptions == 0
+    print("✅ Существующий аккаунт на панели: покупка завершилась ошибкой без повторов")
+
+
+def test_panel_outage(max_attempts=2):
+    (waiting, failed, retried, requests), subscriptions, _ = run(
+        lambda path, panel: panel_outage(path, panel, max_attempts), inspect=count_subscriptions)
+    assert waiting['status'] == 'pending' and waiting['attempts'] < max_attempts, waiting
+    assert failed == 0 and subscriptions == 1
+    # While the circuit is open only its probes reach the panel
+    assert requests < retried, (requests, retried)
+    print(f"✅ Пока панель недоступна, покупка ждёт её восстановления, не расходуя попытки "
+          f"({requests} запросов к панели)")
+
+
+def test_renewal():
+    _, subscriptions, panel = run(renewal, inspect=count_subscriptions)
+    assert subscriptions == 2
+    assert panel.requests['POST /api/v1/users/'] == 1 and panel.requests['PATCH /api/v1/users/{username}'] == 1
+    # The second 30 days start when the first ones end
+    assert 59 <= panel.users['user_1_basic']['expiration_days'] <= 60
+    print("✅ Повторная покупка продлила тот же аккаунт на панели: ключ не изменился, срок — 60 дней")
+
+
+def test_renewal_after_removal():
+    _, subscriptions, panel = run(lambda path, panel: renewal(path, panel, removed=True), inspect=count_subscriptions)
+    assert subscriptions == 2
+    assert panel.requests['PATCH /api/v1/users/{username}'] == 1 and panel.requests['POST /api/v1/users/'] == 2
+    assert 59 <= panel.users['user_1_basic']['expiration_days'] <= 60
+    print("✅ Продление аккаунта, уже удалённого с панели: создан заново под тем же именем")
+
+
+def test_renewal_recreates_removed_account():
+    subscription, subscriptions, panel = run(expired_and_removed, inspect=count_subscriptions)
+    assert panel.requests['PATCH /api/v1/users/{username}'] == 1 and panel.requests['POST /api/v1/users/'] == 1
+    user = panel.users['user_1_basic']
+    # Same credentials, and a full term from today since the old one has ended
+    assert user['password'] == 'secret' and user['expiration_days'] == 30, user
+    _, _, vpn_username, vpn_password, vpn_key, end_date = subscription
+    assert (vpn_username, vpn_password) == ('user_1_basic', 'secret') and vpn_key.startswith('hy2://'), subscription
+    assert abs(datetime.fromisoformat(end_date) - (datetime.now() + timedelta(days=30))) < timedelta(minutes=1)
+    assert subscriptions == 2
+    print("✅ Истёкшая подписка без аккаунта на панели: аккаунт создан заново с прежним паролем на полный срок")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест очереди покупок")
+    print("=" * 60)
+    test_throughput()
+    test_resume_after_timeout()
+    test_resume_after_crash()
+    test_existing_account()
+    test_panel_outage()
+    test_renewal()
+    test_renewal_after_removal()
+    test_renewal_recreates_removed_account()
+    print("✅ Тест пройден!")
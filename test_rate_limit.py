@@ -0,0 +1,67 @@
+# test_rate_limit.py
+# Script to test per-user and shared token bucket limits
+
+import time
+from ratelimit import KeyedRateLimiter
+
+LIMITS = {'navigation': (5, 10), 'purchase': (0.2, 3), 'admin': (1, 5)}
+
+
+def test_abuser_does_not_starve_others():
+    limiter = KeyedRateLimiter(LIMITS, global_limits={'panel': (1000, 50)}, shared={'purchase': 'panel'})
+    # One user hammers buy_premium
+    abuser = [limiter.check(1, 'purchase') for _ in range(1000)]
+    assert abuser.count(None) == 3, abuser.count(None)
+    assert abuser.count('throttled') == 997
+    # Everyone else still has their own budget and the shared panel bucket is barely touched
+    others = [limiter.check(user_id, 'purchase') for user_id in range(2, 40)]
+    assert others.count(None) == len(others)
+    # Purchase and navigation limits are independent
+    assert limiter.check(1, 'navigation') is None
+    print("✅ Пользователь, нажимающий покупку 1000 раз, получил 3 попытки; остальные не пострадали")
+
+
+def test_shared_bucket():
+    limiter = KeyedRateLimiter(LIMITS, global_limits={'panel': (0.001, 20)}, shared={'purchase': 'panel'})
+    results = [limiter.check(user_id, 'purchase') for user_id in range(100)]
+    assert results.count(None) == 20 and results.count('dropped') == 80
+    # A dropped request gives the user's token back
+    assert limiter.buckets[(99, 'purchase')].tokens >= 2.99
+    # Navigation does not touch the panel and is not limited by the shared bucket
+    assert limiter.check(5, 'navigation') is None
+    stats = limiter.stats()['actions']['purchase']
+    assert stats == {'allowed': 20, 'throttled': 0, 'dropped': 80}, stats
+    print("✅ Общий лимит на обращения к панели: 20 из 100 покупок прошли, остальные отклонены")
+
+
+def test_bounded_memory(users=200000):
+    limiter = KeyedRateLimiter(LIMITS, max_keys=10000)
+    started = time.perf_counter()
+    for user_id in range(users):
+        limiter.check(user_id, 'navigation')
+    per_check = (time.perf_counter() - started) / users
+    assert len(limiter.buckets) <= 10000
+    assert limiter.evicted >= users - 10000
+    print(f"✅ {users} пользователей: хранится {len(limiter.buckets)} счётчиков, {per_check * 1e6:.1f} мкс на проверку")
+
+
+def test_idle_eviction():
+    limiter = KeyedRateLimiter({'navigation': (1000, 2)})
+    limiter.check(1, 'navigation')
+    limiter.check(1, 'navigation')
+    time.sleep(0.01)
+    # User 1's bucket has refilled: it is dropped when the next key arrives
+    limiter.check(2, 'navigation')
+    assert (1, 'navigation') not in limiter.buckets and limiter.evicted == 1
+    print("✅ Неактивные счётчики удаляются без потери состояния")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест ограничения частоты")
+    print("=" * 60)
+    test_abuser_does_not_starve_others()
+    test_shared_bucket()
+    test_bounded_memory()
+    test_idle_eviction()
+    print("✅ Тест пройден!")
@@ -0,0 +1,80 @@
+# test_reauth.py
+# Script to test lazy login and session re-authentication against a local stub panel
+
+import asyncio
+import logging
+from api_client import AsyncBlitzAPIClient, BlitzAPIClient
+from stub_panel import StubPanel
+from testkit import with_panel
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.CRITICAL)
+
+
+def logins(panel):
+    return panel.requests.get('POST /login', 0)
+
+
+async def expired_session(panel, callers=50):
+    client = AsyncBlitzAPIClient(base_url=panel.base_url)
+    panel.add_user('alice')
+    assert logins(panel) == 0, "the client logged in before the first request"
+
+    await client.get_user('alice', fresh=True)
+    assert logins(panel) == 1
+
+    # Every concurrent caller hits 401, but only one of them logs in again
+    panel.expire_sessions()
+    results = await asyncio.gather(*(client.get_user('alice', fresh=True) for _ in range(callers)))
+    await client.aclose()
+    assert all(user['username'] == 'alice' for user in results)
+    return logins(panel)
+
+
+async def outage_at_boot(panel):
+    client = AsyncBlitzAPIClient(base_url=panel.base_url)
+    panel.error_rate = 1.0
+    try:
+        await client.get_server_status()
+    except Exception:
+        pass
+    # Back online: the next request logs in with the session endpoint, not basic auth
+    panel.error_rate = 0.0
+    status = await client.get_server_status()
+    auth = client.client.auth
+    await client.aclose()
+    return status, auth
+
+
+def test_single_relogin():
+    total, _ = with_panel(expired_session, require_session=True)
+    assert total == 2, f"expected one re-login, got {total - 1}"
+    print("✅ Истёкшая сессия: 50 одновременных запросов, одна повторная авторизация")
+
+
+def test_outage_at_boot():
+    (status, auth), panel = with_panel(outage_at_boot, require_session=True)
+    assert 'online_users' in status
+    assert auth is None, "client stayed on basic auth after the panel recovered"
+    print(f"✅ Панель недоступна при старте: после восстановления вход выполнен заново (попыток входа: {logins(panel)})")
+
+
+def test_sync_client():
+    with StubPanel(require_session=True) as panel:
+        client = BlitzAPIClient(base_url=panel.base_url)
+        assert logins(panel) == 0
+        panel.add_user('bob')
+        assert client.get_user('bob')['username'] == 'bob'
+        panel.expire_sessions()
+        assert client.get_user('bob')['username'] == 'bob'
+        assert logins(panel) == 2
+    print("✅ Синхронный клиент: ленивый вход и повтор запроса после новой авторизации")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест авторизации в панели")
+    print("=" * 60)
+    test_single_relogin()
+    test_outage_at_boot()
+    test_sync_client()
+    print("✅ Тест пройден!")
@@ -0,0 +1,117 @@
+# test_reconcile.py
+# Script to test the reconciliation job against a local stub panel
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from api_client import AsyncBlitzAPIClient, PanelPool
+from async_database import AsyncDatabase
+from database import Database
+from reconcile import Reconciler
+from stub_panel import StubPanel
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.WARNING)
+
+
+def seed(path, panel, users):
+    """Create `users` subscriptions, every 100th of them missing on the panel."""
+    db = Database(path)
+    db.create_tables()
+    end_date = (datetime.now() + timedelta(days=30)).isoformat()
+    with db._conn:
+        db._conn.executemany('INSERT INTO users (user_id, username) VALUES (?, ?)',
+                             ((i, f"user{i}") for i in range(1, users + 1)))
+        db._conn.executemany(
+            'INSERT INTO subscriptions (user_id, plan, end_date, vpn_username, vpn_password, vpn_key) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            ((i, 'basic', end_date, f"user_{i}_basic", "pw", "key") for i in range(1, users + 1)))
+    db.close()
+
+    for i in range(1, users + 1):
+        if i % 100 == 0:
+            continue
+        user = panel.add_user(f"user_{i}_basic")
+        user['download_bytes'] = i
+        user['blocked'] = i % 7 == 0
+
+
+async def reconcile(path, panel, users, concurrency, rate):
+    db = AsyncDatabase(path)
+    client = AsyncBlitzAPIClient(base_url=panel.base_url, max_connections=concurrency)
+    reconciler = Reconciler(db, PanelPool({'main': client}), batch_size=500, concurrency=concurrency, rate=rate)
+
+    started = time.perf_counter()
+    task = asyncio.create_task(reconciler.run())
+    while not task.done():
+        await asyncio.wait({task}, timeout=2)
+        p = reconciler.progress()
+        eta = f"{p['eta']:.0f}s" if p['eta'] is not None else "-"
+        print(f"   {p['processed']}/{p['total']} ({p['percent']:.0f}%), {p['rate']:.0f}/s, ETA {eta}")
+    progress = task.result()
+    elapsed = time.perf_counter() - started
+
+    await client.aclose()
+    db.close()
+    return progress, elapsed
+
+
+def test_reconcile(users=2000, concurrency=20, rate=0):
+    """Reconcile `users` subscriptions and check every row was written back.
+
+    Run as a script for the full 50 000 subscriptions.
+    """
+    panel = StubPanel(latency=0.002)
+    panel.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'reconcile.db')
+            seed(path, panel, users)
+            progress, elapsed = asyncio.run(reconcile(path, panel, users, concurrency, rate))
+            print(f"✅ {progress['processed']} subscriptions in {elapsed:.1f}s ({progress['processed'] / elapsed:.0f}/s), "
+                  f"max concurrent panel requests: {panel.max_inflight}")
+
+            assert progress['processed'] == users
+            assert progress['missing'] == users // 100
+            assert progress['failed'] == 0
+            assert panel.max_inflight <= concurrency
+            assert panel.requests['GET /api/v1/users/{username}'] == users
+            if rate > 0:
+                # The bucket starts full, so at most `concurrency` requests go out ahead of the rate
+                assert users <= concurrency + rate * elapsed, (users, elapsed)
+
+            db = Database(path)
+            rows = dict(((status, count) for status, count in db._conn.execute(
+                'SELECT panel_status, COUNT(*) FROM subscriptions GROUP BY panel_status')))
+            unsynced = db._conn.execute('SELECT COUNT(*) FROM subscriptions WHERE panel_synced_at IS NULL').fetchone()[0]
+            traffic = db._conn.execute('SELECT traffic_used FROM subscriptions WHERE vpn_username = ?',
+                                       ('user_42_basic',)).fetchone()[0]
+            db.close()
+            print(f"   statuses: {rows}")
+            assert unsynced == 0
+            assert rows['deleted'] == users // 100
+            assert rows['blocked'] == sum(1 for i in range(1, users + 1) if i % 7 == 0 and i % 100 != 0)
+            assert traffic == 42
+    finally:
+        panel.stop()
+
+
+def test_reconcile_rate():
+    test_reconcile(users=300, concurrency=10, rate=200)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile subscriptions against a stub panel")
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=0, help="panel requests per second, 0 = unlimited")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"Сверка {args.users} подписок с тестовой панелью")
+    print("=" * 60)
+    test_reconcile(args.users, args.concurrency, args.rate)
+    print("✅ Тест пройден!")
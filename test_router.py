@@ -0,0 +1,139 @@
+# test_router.py
+# Script to test callback routing, argument parsing and middleware
+
+import asyncio
+from types import SimpleNamespace
+from ratelimit import KeyedRateLimiter
+from router import CallbackRouter, timing, allow_users, rate_limit
+
+
+class FakeQuery:
+    def __init__(self, data, user_id=1):
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append(text)
+
+
+def make_router(calls):
+    async def handler(query, **args):
+        calls.append((query.data, args))
+
+    router = CallbackRouter([timing])
+    router.add('profile', handler)
+    router.add('buy_subscription', handler)
+    router.add('buy_{plan}', handler)
+    router.add('page_{number:int}', handler)
+    router.add('page_{number:int}_{sort}', handler)
+    return router, handler
+
+
+def dispatch(router, data, user_id=1):
+    query = FakeQuery(data, user_id)
+    asyncio.run(router.dispatch(SimpleNamespace(callback_query=query), None))
+    return query
+
+
+def test_resolve():
+    router, _ = make_router([])
+    assert router.resolve('profile')[1] == {}
+    assert router.resolve('buy_subscription')[0].pattern == 'buy_subscription'
+    assert router.resolve('buy_premium')[1] == {'plan': 'premium'}
+    # Plan names containing '_' stay whole: the last parameter takes the rest
+    assert router.resolve('buy_family_plus')[1] == {'plan': 'family_plus'}
+    assert router.resolve('page_3')[1] == {'number': 3}
+    assert router.resolve('page_3_date')[1] == {'number': 3, 'sort': 'date'}
+    assert router.resolve('page_x') == (None, None)
+    assert router.resolve('buy_') == (None, None)
+    assert router.resolve('unknown') == (None, None)
+    print("✅ Точные маршруты, маршруты с параметрами и типизированные аргументы")
+
+
+def test_dispatch_and_timing():
+    calls = []
+    router, _ = make_router(calls)
+    for data in ('profile', 'buy_basic', 'buy_basic', 'nothing'):
+        query = dispatch(router, data)
+        assert query.answers == [None], "every callback must be answered exactly once"
+    assert calls == [('profile', {}), ('buy_basic', {'plan': 'basic'}), ('buy_basic', {'plan': 'basic'})]
+    report = router.latency_report()
+    assert report['buy_{plan}']['calls'] == 2 and report['profile']['calls'] == 1
+    assert router.unmatched == 1
+    print("✅ Обработчики вызываются с аргументами, задержка считается по маршрутам")
+
+
+def test_auth():
+    calls, denied = [], []
+
+    async def handler(query):
+        calls.append(query.from_user.id)
+
+    async def deny(call):
+        denied.append(call.user_id)
+
+    router = CallbackRouter()
+    router.add('admin_panel', handler, [allow_users({42}, deny)])
+    dispatch(router, 'admin_panel', 42)
+    query = dispatch(router, 'admin_panel', 7)
+    assert calls == [42] and denied == [7]
+    assert query.answers == [None]
+    print("✅ Проверка доступа к админ панели выполняется в middleware")
+
+
+def test_auth_before_rate_limit():
+    calls, rejected = [], []
+
+    async def handler(query):
+        calls.append(query.from_user.id)
+
+    async def deny(call):
+        pass
+
+    async def reject(call, reason):
+        rejected.append(reason)
+
+    limiter = KeyedRateLimiter({'admin': (0.001, 2)})
+    router = CallbackRouter()
+    router.add('admin_panel', handler, [allow_users({42}, deny), rate_limit(limiter, 'admin', reject)])
+    for user_id in range(100, 120):
+        dispatch(router, 'admin_panel', user_id)
+    dispatch(router, 'admin_panel', 42)
+    dispatch(router, 'admin_panel', 42)
+    assert calls == [42, 42] and rejected == []
+    # Denied users never reach the limiter
+    assert list(limiter.buckets) == [(42, 'admin')]
+    print("✅ Нажатия не-администраторов отклоняются до лимита и не расходуют его")
+
+
+def test_rate_limit():
+    calls, rejected = [], []
+
+    async def handler(query):
+        calls.append(query.from_user.id)
+
+    async def reject(call, reason):
+        rejected.append(reason)
+        await call.answer(reason)
+
+    limiter = KeyedRateLimiter({'navigation': (0.001, 3)})
+    router = CallbackRouter()
+    router.add('profile', handler, [rate_limit(limiter, 'navigation', reject)])
+    answers = [dispatch(router, 'profile', 1).answers for _ in range(5)]
+    dispatch(router, 'profile', 2)
+    assert calls == [1, 1, 1, 2]
+    assert rejected == ['throttled', 'throttled'] and answers[-1] == ['throttled']
+    print("✅ Ограничение частоты нажатий для каждого пользователя")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест маршрутизации кнопок")
+    print("=" * 60)
+    test_resolve()
+    test_dispatch_and_timing()
+    test_auth()
+    test_auth_before_rate_limit()
+    test_rate_limit()
+    print("✅ Тест пройден!")
@@ -0,0 +1,162 @@
+# test_update_processor.py
+# Script to test per-user ordering of concurrently processed updates
+
+import asyncio
+import random
+from types import SimpleNamespace
+from telegram.ext import Application, SimpleUpdateProcessor, TypeHandler
+from stub_telegram import StubTelegram
+from update_processor import PerUserUpdateProcessor, UpdateQueue
+
+
+def make_update(update_id, user_id):
+    return SimpleNamespace(update_id=update_id, effective_user=SimpleNamespace(id=user_id), effective_chat=None)
+
+
+async def dispatch(processor, updates, handler):
+    """Feed updates the way Application does with concurrent updates: one task per update."""
+    await asyncio.gather(*(asyncio.create_task(processor.process_update(update, handler(update)))
+                           for update in updates))
+
+
+async def check_ordering(users=20, per_user=25, limit=8):
+    processor = PerUserUpdateProcessor(limit)
+    seen = {}
+    running_users = set()
+    running = 0
+    max_running = 0
+
+    async def handler(update):
+        nonlocal running, max_running
+        user_id = update.effective_user.id
+        assert user_id not in running_users, f"two updates of user {user_id} ran at once"
+        running_users.add(user_id)
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(random.uniform(0, 0.005))
+        seen.setdefault(user_id, []).append(update.update_id)
+        running -= 1
+        running_users.discard(user_id)
+
+    updates = [make_update(i, random.randint(1, users)) for i in range(users * per_user)]
+    await dispatch(processor, updates, handler)
+
+    for user_id, ids in seen.items():
+        assert ids == sorted(ids), f"updates of user {user_id} reordered: {ids}"
+    assert sum(len(ids) for ids in seen.values()) == len(updates)
+    assert 1 < max_running <= limit, max_running
+    assert not processor._user_locks, "per-user locks were not released"
+    return max_running
+
+
+async def double_tap(processor):
+    """Two buy presses from one user; the purchase checks for an account, then creates it."""
+    accounts = []
+
+    async def purchase(update):
+        if update.effective_user.id not in accounts:
+            await asyncio.sleep(0.01)  # panel round trip
+            accounts.append(update.effective_user.id)
+
+    await dispatch(processor, [make_update(1, 42), make_update(2, 42)], purchase)
+    return len(accounts)
+
+
+async def check_backlog_does_not_block(limit=4):
+    """A user with many queued updates must not hold every worker slot."""
+    processor = PerUserUpdateProcessor(limit)
+    done = {}
+
+    async def handler(update):
+        await asyncio.sleep(0.01)
+        done[update.update_id] = asyncio.get_running_loop().time()
+
+    started = asyncio.get_running_loop().time()
+    updates = [make_update(i, 1) for i in range(50)] + [make_update(100, 2)]
+    await dispatch(processor, updates, handler)
+    return done[100] - started
+
+
+async def check_queue_bound(telegram, updates=500, queue_size=16, admitted=8, limit=4):
+    """Feed a real Application faster than its handlers finish; intake must stop at the bound."""
+    queue = UpdateQueue(queue_size, admitted)
+    application = (Application.builder().token('123456:updates').base_url(telegram.api_url)
+                   .update_queue(queue).concurrent_updates(PerUserUpdateProcessor(limit)).build())
+    release = asyncio.Event()
+    running = 0
+    max_running = 0
+    handled = 0
+
+    async def handler(update, context):
+        nonlocal running, max_running, handled
+        running += 1
+        max_running = max(max_running, running)
+        await release.wait()
+        running -= 1
+        handled += 1
+
+    application.add_handler(TypeHandler(SimpleNamespace, handler))
+    await application.initialize()
+    await application.start()
+    accepted = 0
+
+    async def receive():
+        nonlocal accepted
+        for i in range(updates):
+            # A few users, so some updates wait for their user's earlier ones
+            await queue.put(make_update(i, i % 20))
+            accepted += 1
+
+    receiver = asyncio.create_task(receive())
+    await asyncio.sleep(0.3)
+    held = (accepted, queue.qsize(), queue.admitted(), max_running)
+    release.set()
+    await asyncio.wait_for(receiver, 10)
+    while handled < updates:
+        await asyncio.sleep(0.01)
+    await application.stop()
+    await application.shutdown()
+    return held, queue.admitted()
+
+
+def test_queue_bound(queue_size=16, admitted=8, limit=4):
+    telegram = StubTelegram()
+    telegram.start()
+    try:
+        (accepted, waiting, taken, max_running), left = asyncio.run(
+            check_queue_bound(telegram, queue_size=queue_size, admitted=admitted, limit=limit))
+    finally:
+        telegram.stop()
+    assert (accepted, waiting, taken, max_running) == (queue_size + admitted, queue_size, admitted, limit), (
+        accepted, waiting, taken, max_running)
+    assert left == 0
+    print(f"✅ Application с параллельной обработкой принимает не больше {queue_size} + {admitted} обновлений, "
+          f"пока обработчики заняты")
+
+
+def test_ordering():
+    max_running = asyncio.run(check_ordering())
+    print(f"✅ Порядок обновлений каждого пользователя сохранён, параллельно выполнялось до {max_running}")
+
+
+def test_double_tap():
+    assert asyncio.run(double_tap(SimpleUpdateProcessor(8))) == 2
+    assert asyncio.run(double_tap(PerUserUpdateProcessor(8))) == 1
+    print("✅ Двойное нажатие покупки создаёт один аккаунт (без блокировки по пользователю — два)")
+
+
+def test_backlog():
+    waited = asyncio.run(check_backlog_does_not_block())
+    assert waited < 0.1, waited
+    print(f"✅ Очередь одного пользователя не задерживает других ({waited * 1000:.0f} мс)")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест параллельной обработки обновлений")
+    print("=" * 60)
+    test_ordering()
+    test_double_tap()
+    test_backlog()
+    test_queue_bound()
+    print("✅ Тест пройден!")
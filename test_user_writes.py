@@ -0,0 +1,114 @@
+# test_user_writes.py
+# Script to test the write-behind buffer for /start user upserts
+
+import asyncio
+import logging
+from testkit import with_database
+from user_writes import UserWriteBuffer
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.CRITICAL)
+
+
+class FlakyDatabase:
+    """Fails the first upsert_users call, then passes writes through."""
+
+    def __init__(self, db):
+        self.db = db
+        self.calls = 0
+
+    async def upsert_users(self, rows):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("database is locked")
+        await self.db.upsert_users(rows)
+
+
+async def batching(db):
+    writes = UserWriteBuffer(db, batch_size=100, interval=60)
+    await writes.start()
+    # A promo burst: 1000 /start hits from 250 users
+    for i in range(1000):
+        writes.add_user(i % 250, f"user{i % 250}", "Имя", None)
+    await asyncio.sleep(0.1)
+    # The batch size was reached, so it was written without waiting for the interval:
+    # one transaction for the whole burst, repeat hits coalesced
+    assert writes.stats['flushes'] == 1 and writes.stats['coalesced'] == 750, writes.stats
+    await writes.stop()
+    assert await db.count_users() == 250
+    assert writes.pending() == 0
+
+    # Returning users with an unchanged profile never reach the database
+    before = writes.stats['flushes']
+    for i in range(250):
+        assert not writes.add_user(i, f"user{i}", "Имя", None)
+    assert writes.pending() == 0 and writes.stats['flushes'] == before
+    return writes.stats
+
+
+async def read_your_writes(db):
+    writes = UserWriteBuffer(db, batch_size=100, interval=60)
+    await writes.start()
+    writes.add_user(1000, 'alice', 'Alice', None)
+    assert await db.get_user(1000) is None
+    await writes.ensure(1000)
+    assert (await db.get_user(1000))[1] == 'alice'
+
+    # A renamed user is written again; the referral code stays
+    code = await db.get_referral_code(1000)
+    assert writes.add_user(1000, 'alice_new', 'Alice', None)
+    await writes.ensure(1000)
+    user = await db.get_user(1000)
+    assert user[1] == 'alice_new' and user[5] == code, user
+    await writes.stop()
+
+
+async def retry_after_failure(db):
+    flaky = FlakyDatabase(db)
+    writes = UserWriteBuffer(flaky, batch_size=100, interval=0.05)
+    await writes.start()
+    writes.add_user(2000, 'bob', 'Bob', None)
+    await asyncio.sleep(0.2)
+    assert writes.stats['failed_flushes'] == 1
+    assert (await db.get_user(2000))[1] == 'bob'
+    await writes.stop()
+
+
+async def flush_on_stop(db):
+    writes = UserWriteBuffer(db, batch_size=100, interval=60)
+    await writes.start()
+    for i in range(3000, 3050):
+        writes.add_user(i, f"user{i}", "Имя", None)
+    await writes.stop()
+    assert all([await db.get_user(i) for i in range(3000, 3050)])
+
+
+def test_batching():
+    stats = with_database(batching)
+    print(f"✅ 1000 /start от 250 пользователей: {stats['flushes']} транзакций, объединено {stats['coalesced']}, "
+          f"пропущено известных {stats['skipped']}")
+
+
+def test_read_your_writes():
+    with_database(read_your_writes)
+    print("✅ ensure() записывает пользователя до чтения; смена имени записывается, реферальный код сохраняется")
+
+
+def test_retry_after_failure():
+    with_database(retry_after_failure)
+    print("✅ Ошибка записи: пользователи остаются в буфере и записываются в следующий раз")
+
+
+def test_flush_on_stop():
+    with_database(flush_on_stop)
+    print("✅ stop() записывает всё, что осталось в буфере")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест отложенной записи пользователей")
+    print("=" * 60)
+    test_batching()
+    test_read_your_writes()
+    test_retry_after_failure()
+    test_flush_on_stop()
+    print("✅ Тест пройден!")
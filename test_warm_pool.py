@@ -0,0 +1,154 @@
+# test_warm_pool.py
+# Script to test the warm pool of pre-provisioned panel accounts against a slow local stub panel
+
+import logging
+import time
+from async_database import AsyncDatabase
+from purchases import PurchaseWorkerPool
+from testkit import read_database, run, single_panel, wait_for
+from warm_pool import WarmPool
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.CRITICAL)
+
+PANEL_LATENCY = 0.3
+PLANS = {
+    'basic': {'traffic_gb': None, 'expiration_days': 30, 'device_limit': 1, 'price': 10.0},
+    # Without a pool: purchases of this plan always go through the queue
+    'premium': {'traffic_gb': None, 'expiration_days': 30, 'device_limit': None, 'price': 30.0, 'warm_pool': (0, 0)},
+}
+
+
+def subscriptions(db, users=10):
+    """(user_id, vpn_username, vpn_key, panel_node) of every user with an active subscription."""
+    nodes = {username: node for _, username, node in db.get_panel_subscriptions(0, 100)}
+    rows = []
+    for user_id in range(1, users + 1):
+        active = db.get_active_subscription(user_id)
+        if active is not None:
+            rows.append((user_id, active[2], active[4], nodes.get(active[2])))
+    return rows
+
+
+async def fast_purchases(path, panel):
+    """Purchases are confirmed from the pool while the panel takes 300 ms per request."""
+    panels = await single_panel(panel)
+    db = AsyncDatabase(path)
+    warm = WarmPool(db, panels, PLANS, low=2, high=5, concurrency=5, interval=60)
+    made = await warm.refill()
+    assert made == 5, made
+    assert all(user['expiration_days'] == 31 for user in panel.users.values())
+    assert panel.requests['POST /api/v1/users/'] == 5
+
+    notified = []
+
+    async def notify(job):
+        notified.append(job)
+
+    pool = PurchaseWorkerPool(db, panels, PLANS, workers=2, retry_delay=0.05, warm_pool=warm)
+    await pool.start(notify)
+    await warm.start()
+    latencies = []
+    jobs = []
+    for user_id in range(1, 5):
+        started = time.perf_counter()
+        job, created = await pool.submit(user_id, 'basic', user_id, 1)
+        latencies.append(time.perf_counter() - started)
+        assert created and job['status'] == 'done' and job['vpn_key'].startswith('hy2://'), job
+        jobs.append(job)
+    # A double tap on the same message gets the finished purchase, not a second account
+    job, created = await pool.submit(1, 'basic', 1, 1)
+    assert not created and job['id'] == jobs[0]['id'], job
+    # One ready account left, below the low watermark: the refill loop tops the pool up in the background
+    async def refilled():
+        return (await warm.levels_report())['basic']['ready'] == 5
+    await wait_for(refilled)
+
+    # A plan without a pool, and a second tap on an unfinished purchase, go through the queue
+    job, _ = await pool.submit(5, 'premium', 5, 1)
+    assert job['status'] == 'pending'
+    _, created = await pool.submit(5, 'premium', 5, 2)
+    assert not created
+
+    async def queued_done():
+        return len(notified) == 1
+    await wait_for(queued_done)
+    await warm.stop()
+    await pool.stop()
+    await panels.aclose()
+    db.close()
+    return latencies, warm.stats
+
+
+async def resume_and_retire(path, panel):
+    """An account created just before a crash is adopted; stale ready accounts are not handed out
+    and are deleted from the panel."""
+    db = AsyncDatabase(path)
+    await db.create_tables()
+    panel.add_user('warm_basic_lost', 'secret')
+    await db.add_warm_account('basic', 'main', 'warm_basic_lost', 'secret', time.time())
+    panel.add_user('warm_basic_stale', 'secret')
+    stale = await db.add_warm_account('basic', 'main', 'warm_basic_stale', 'secret', time.time() - 7200)
+    await db.mark_warm_account_ready(stale, 'hy2://stale')
+
+    panels = await single_panel(panel)
+    warm = WarmPool(db, panels, PLANS, low=1, high=1, max_age=3600)
+    made = await warm.refill()
+    assert made == 1 and warm.stats['retired'] == 1, warm.stats
+    assert warm.stats['removed'] == 1 and list(panel.users) == ['warm_basic_lost'], panel.users
+    job, _ = await warm.claim(1, 'basic')
+    assert job['vpn_username'] == 'warm_basic_lost' and job['vpn_password'] == 'secret'
+    await panels.aclose()
+    db.close()
+
+
+async def give_up(path, panel):
+    """An account that keeps failing is given up and no longer holds a place in the pool."""
+    panels = await single_panel(panel)
+    panel.error_rate = 1.0
+    db = AsyncDatabase(path)
+    warm = WarmPool(db, panels, PLANS, low=1, high=1, max_attempts=2)
+    for _ in range(2):
+        assert await warm.refill() == 0
+    assert panel.requests['POST /api/v1/users/'] == 2
+    assert (await db.count_warm_accounts())['basic'] == {'failed': 1}
+
+    panel.error_rate = 0.0
+    # The given-up account is not retried, leaves room for a new one and is deleted on the panel
+    assert await warm.refill() == 1
+    assert panel.requests['POST /api/v1/users/'] == 3 and panel.requests['DELETE /api/v1/users/{username}'] == 1
+    assert await db.count_warm_accounts() == {'basic': {'ready': 1}}
+    await panels.aclose()
+    db.close()
+
+
+def test_fast_purchases():
+    (latencies, stats), subscribed, panel = run(fast_purchases, 10, PANEL_LATENCY,
+                                                inspect=lambda path: read_database(path, subscriptions))
+    assert max(latencies) < 0.1, latencies
+    assert [row[0] for row in subscribed] == [1, 2, 3, 4, 5]
+    assert all(row[1] in panel.users and row[2] and row[3] == 'main' for row in subscribed), subscribed
+    assert stats['claimed'] == 4 and stats['missed'] == 0, stats
+    print(f"✅ Покупка из запаса за {max(latencies) * 1000:.1f} мс при задержке панели {PANEL_LATENCY * 1000:.0f} мс, "
+          f"запас пополнен до 5")
+    print("✅ Повторное нажатие на покупку из запаса не забирает второй аккаунт")
+    print("✅ План без запаса и повторное нажатие идут через очередь")
+
+
+def test_resume_and_retire():
+    run(resume_and_retire, 10, PANEL_LATENCY)
+    print("✅ Аккаунт, созданный перед сбоем, подхвачен; устаревший не выдаётся и удаляется из панели")
+
+
+def test_give_up():
+    run(give_up, 10, PANEL_LATENCY)
+    print("✅ Аккаунт, который не удаётся создать, бросается после лимита попыток и не мешает пополнению")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Тест запаса готовых аккаунтов")
+    print("=" * 60)
+    test_fast_purchases()
+    test_resume_and_retire()
+    test_give_up()
+    print("✅ Тест пройден!")
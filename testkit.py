@@ -0,0 +1,90 @@
+# testkit.py
+# Shared helpers for the test scripts: stub panel runners, a seeded temporary database and polling
+
+import asyncio
+import os
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from api_client import AsyncBlitzAPIClient, PanelPool
+from async_database import AsyncDatabase
+from database import Database
+from stub_panel import StubPanel
+
+
+def with_panel(func, *args, **panel_args):
+    """Run func(panel, *args) against a fresh stub panel. Returns (result, panel)."""
+    with StubPanel(**panel_args) as panel:
+        return asyncio.run(func(panel, *args)), panel
+
+
+def read_database(path, func):
+    """Open the database at `path`, return func(db) and close it."""
+    db = Database(path)
+    try:
+        return func(db)
+    finally:
+        db.close()
+
+
+def seed_users(path, users):
+    """Create the schema and users 1..`users`."""
+    def seed(db):
+        db.create_tables()
+        db.upsert_users([(i, f"user{i}", None, None, None, None) for i in range(1, users + 1)])
+    read_database(path, seed)
+
+
+def count_subscriptions(path):
+    return read_database(path, lambda db: db.count_rows('subscriptions'))
+
+
+@contextmanager
+def temp_database(users=0, name='test.db'):
+    """Path of a database with `users` users, removed on exit."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, name)
+        seed_users(path, users)
+        yield path
+
+
+def with_database(scenario, users=0, readers=2):
+    """Run scenario(db) with an AsyncDatabase over a fresh database with `users` users."""
+    with temp_database(users) as path:
+        db = AsyncDatabase(path, readers=readers)
+        try:
+            return asyncio.run(scenario(db))
+        finally:
+            db.close()
+
+
+async def wait_for(predicate, timeout=30):
+    """Poll an async predicate until it is true."""
+    deadline = time.monotonic() + timeout
+    while not await predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+async def single_panel(panel, **kwargs):
+    """Pool of one node with its health already checked."""
+    panels = PanelPool({'main': AsyncBlitzAPIClient(base_url=panel.base_url, **kwargs)}, interval=0)
+    await panels.start()
+    return panels
+
+
+def run(scenario, users=1, latency=0.0, inspect=None, nodes=None):
+    """Run scenario(path, panel) against a fresh stub panel and a database with `users` users.
+
+    With `nodes`, the scenario gets a {name: panel} dict of stub panels instead.
+    Returns (result, inspect(path), panel); inspect reads the database before it is removed.
+    """
+    with ExitStack() as stack:
+        if nodes is None:
+            panel = stack.enter_context(StubPanel(latency=latency))
+        else:
+            panel = {name: stack.enter_context(StubPanel(latency=latency)) for name in nodes}
+        path = stack.enter_context(temp_database(users))
+        result = asyncio.run(scenario(path, panel))
+        inspected = inspect(path) if inspect is not None else None
+    return result, inspected, panel
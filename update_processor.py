@@ -0,0 +1,104 @@
+# update_processor.py
+# Concurrent update processing that keeps updates from the same user in order
+
+import asyncio
+from telegram.ext import BaseUpdateProcessor
+
+class UpdateQueue(asyncio.Queue):
+    """Update queue that also bounds the updates taken from it and not yet processed.
+
+    With concurrent updates, Application's fetcher starts a task for every update
+    it takes from the queue, so a plain bounded queue never fills. Here taking an
+    update waits for an admission slot, which `task_done` (called by Application
+    once the update is processed) gives back; the queue then fills up and intake
+    blocks.
+
+    Args:
+        maxsize: Maximum number of updates waiting in the queue.
+        max_admitted: Maximum number of updates taken from the queue and not yet
+            processed (running or waiting for their user's earlier updates).
+    """
+
+    def __init__(self, maxsize, max_admitted):
+        super().__init__(maxsize)
+        self._admission = asyncio.Semaphore(max_admitted)
+        self._admitted = 0
+
+    async def get(self):
+        await self._admission.acquire()
+        try:
+            item = await super().get()
+        except BaseException:
+            self._admission.release()
+            raise
+        self._admitted += 1
+        return item
+
+    def task_done(self):
+        super().task_done()
+        # On stop, Application also marks the dropped updates it never took as done
+        if self._admitted:
+            self._admitted -= 1
+            self._admission.release()
+
+    def admitted(self):
+        """Number of updates taken from the queue and not yet processed."""
+        return self._admitted
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates from different users in parallel, and from the same user one at a time.
+
+    A double tap on a purchase button therefore runs the two purchases strictly
+    one after another. Waiting for the per-user lock happens before taking a
+    worker slot, so one user's backlog never blocks other users.
+
+    Args:
+        max_concurrent_updates: Maximum number of handlers running at once.
+    """
+
+    __slots__ = ('_user_locks',)
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # user key -> [lock, number of updates holding or waiting for it]
+        self._user_locks = {}
+
+    @staticmethod
+    def user_key(update):
+        """Serialization key of an update: the user, else the chat, else None (no ordering)."""
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return ('user', user.id)
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None:
+            return ('chat', chat.id)
+        return None
+
+    async def process_update(self, update, coroutine):
+        """Wait for the user's earlier updates, then for a worker slot, then run the update."""
+        key = self.user_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        """Nothing to set up."""
+
+    async def shutdown(self):
+        """Nothing to tear down."""
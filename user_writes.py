@@ -0,0 +1,116 @@
+# user_writes.py
+# Write-behind buffer for user upserts: coalesced in memory and written in one transaction per batch
+
+import asyncio
+import logging
+from collections import OrderedDict
+from config import USER_WRITE_BATCH_SIZE, USER_WRITE_INTERVAL, USER_KNOWN_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class UserWriteBuffer:
+    """Collects user upserts from /start and writes them in batches.
+
+    A user whose stored profile is already known (an LRU of `known_size` user_ids with
+    the username and names last written) is skipped without touching the database, which
+    is the common case for returning users. Other upserts are coalesced per user and
+    written with one transaction every `interval` seconds, or as soon as `batch_size`
+    users are pending. stop() writes out everything still pending.
+
+    Handlers that read the user's row right after an upsert call ensure(user_id) first.
+    """
+
+    def __init__(self, db, batch_size=USER_WRITE_BATCH_SIZE, interval=USER_WRITE_INTERVAL,
+                 known_size=USER_KNOWN_CACHE_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+        self.interval = interval
+        self.known_size = known_size
+        self.stats = {'upserts': 0, 'skipped': 0, 'coalesced': 0, 'flushes': 0, 'written': 0, 'failed_flushes': 0}
+        self._known = OrderedDict()
+        self._pending = {}
+        self._writing = {}
+        self._lock = asyncio.Lock()
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write everything still pending."""
+        if self._task is not None:
+            # A flag, not cancel(): a flush in progress must finish
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def pending(self):
+        """Number of users waiting to be written."""
+        return len(self._pending)
+
+    def add_user(self, user_id, username, first_name, last_name, referral_code=None, referred_by=None):
+        """Record a user upsert. Returns False if the stored row is already up to date."""
+        self.stats['upserts'] += 1
+        profile = (username, first_name, last_name)
+        if self._known.get(user_id) == profile:
+            self._known.move_to_end(user_id)
+            self.stats['skipped'] += 1
+            return False
+        if user_id in self._pending:
+            self.stats['coalesced'] += 1
+        self._pending[user_id] = (user_id, username, first_name, last_name, referral_code, referred_by)
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    async def ensure(self, user_id):
+        """Make sure the user's pending upsert, if any, is in the database."""
+        if user_id in self._pending or user_id in self._writing:
+            await self.flush()
+
+    async def flush(self):
+        """Write all pending upserts in one transaction. Returns the number of users written."""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            self._writing, self._pending = self._pending, {}
+            try:
+                await self.db.upsert_users(list(self._writing.values()))
+            except Exception:
+                self.stats['failed_flushes'] += 1
+                # Keep them for the next flush, unless a newer upsert arrived meanwhile
+                for user_id, row in self._writing.items():
+                    self._pending.setdefault(user_id, row)
+                raise
+            finally:
+                batch, self._writing = self._writing, {}
+            for user_id, row in batch.items():
+                self._remember(user_id, row[1:4])
+            self.stats['flushes'] += 1
+            self.stats['written'] += len(batch)
+            return len(batch)
+
+    def _remember(self, user_id, profile):
+        self._known[user_id] = profile
+        self._known.move_to_end(user_id)
+        if len(self._known) > self.known_size:
+            self._known.popitem(last=False)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Failed to write %s pending users, will retry: %s", len(self._pending), e)
@@ -0,0 +1,221 @@
+# warm_pool.py
+# Pool of pre-provisioned panel accounts per plan, bound to purchases without waiting for the panel
+
+import asyncio
+import logging
+import math
+import secrets
+import time
+from datetime import datetime, timedelta
+from api_client import BlitzAPIError, UserAlreadyExistsError
+from config import (SUBSCRIPTION_PLANS, WARM_POOL_LOW, WARM_POOL_HIGH, WARM_POOL_CONCURRENCY, WARM_POOL_INTERVAL,
+                    WARM_POOL_MAX_AGE, WARM_POOL_MAX_ATTEMPTS)
+from metrics import WARM_POOL_CLAIMS
+from purchases import generate_password, is_transient
+
+logger = logging.getLogger(__name__)
+
+# Discarded accounts deleted from the panel per refill round
+DISCARD_BATCH_SIZE = 100
+
+class WarmPool:
+    """Keeps ready panel accounts, with their keys, per plan in the `warm_accounts` table.
+
+    When fewer than `low` accounts of a plan are ready, the refill loop creates accounts
+    on the node the PanelPool picks until `high` are ready or being created. claim()
+    binds the oldest ready account to a purchase in one transaction and makes no panel
+    request. A plan overrides the watermarks with a 'warm_pool': (low, high) entry.
+
+    Accounts get `max_age` seconds of extra panel lifetime and are retired unclaimed once
+    older than that, so a claimed account always covers the plan's full term. The row is
+    written before the panel request: an account whose creation was interrupted is
+    finished on the next round, and since its name is random a 409 means it is ours.
+    After `max_attempts` failed rounds the account is given up and stops counting
+    towards `high`. Retired and given-up accounts are deleted from their panel before
+    their rows are dropped, so no unclaimed account stays usable there.
+    """
+
+    def __init__(self, db, panels, plans=SUBSCRIPTION_PLANS, low=WARM_POOL_LOW, high=WARM_POOL_HIGH,
+                 concurrency=WARM_POOL_CONCURRENCY, interval=WARM_POOL_INTERVAL, max_age=WARM_POOL_MAX_AGE,
+                 max_attempts=WARM_POOL_MAX_ATTEMPTS):
+        self.db = db
+        self.panels = panels
+        self.plans = plans
+        self.low = low
+        self.high = high
+        self.concurrency = concurrency
+        self.interval = interval
+        self.max_age = max_age
+        self.max_attempts = max_attempts
+        self.stats = {'claimed': 0, 'missed': 0, 'created': 0, 'failed': 0, 'retired': 0, 'removed': 0}
+        self._inflight = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    def levels(self, plan):
+        """(low, high) watermarks of a plan."""
+        return self.plans.get(plan, {}).get('warm_pool', (self.low, self.high))
+
+    async def start(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop refilling. Accounts being created are finished after the next start."""
+        if self._task is not None:
+            # The flag stops the loop even if the cancellation is swallowed by wait_for
+            self._stopping = True
+            self._wakeup.set()
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def claim(self, user_id, plan, chat_id=None, message_id=None):
+        """Bind a ready account to a purchase.
+
+        Returns (job, created): the finished job, the job of a repeated tap on the same
+        message, or (None, False) to queue the purchase.
+        """
+        details = self.plans.get(plan)
+        if not details or not self.levels(plan)[1]:
+            return None, False
+        end_date = datetime.now() + timedelta(days=details['expiration_days'])
+        job, created = await self.db.claim_warm_account(user_id, plan, chat_id, message_id, details['device_limit'],
+                                                        end_date.isoformat(), time.time() - self.max_age)
+        if job is not None and not created:
+            return job, False
+        if job is None:
+            self.stats['missed'] += 1
+            WARM_POOL_CLAIMS.labels(plan, 'miss').inc()
+        else:
+            self.stats['claimed'] += 1
+            WARM_POOL_CLAIMS.labels(plan, 'hit').inc()
+        # Let the refill loop check the watermark
+        self.wake()
+        return job, created
+
+    async def levels_report(self):
+        """Ready and in-creation accounts per configured plan."""
+        counts = await self.db.count_warm_accounts()
+        return {plan: {'ready': counts.get(plan, {}).get('ready', 0), 'creating': counts.get(plan, {}).get('creating', 0)}
+                for plan in self.plans if self.levels(plan)[1]}
+
+    async def refill(self):
+        """Retire stale accounts, delete discarded ones from the panel and create new ones
+        for plans below their low watermark.
+
+        Returns the number of accounts made ready.
+        """
+        retired = await self.db.retire_warm_accounts(time.time() - self.max_age)
+        if retired:
+            self.stats['retired'] += retired
+            logger.info("Retired %s unclaimed warm accounts", retired)
+        if not self.panels.is_available('users'):
+            return 0
+
+        tasks = [self._remove(*row) for row in await self.db.get_discarded_warm_accounts(DISCARD_BATCH_SIZE)
+                 if row[0] not in self._inflight]
+        # Accounts left unfinished by a failed attempt or a restart come first
+        for row in await self.db.get_creating_warm_accounts(self.max_attempts):
+            if row[0] not in self._inflight:
+                tasks.append(self._create(*row))
+        for plan, counts in (await self.levels_report()).items():
+            low, high = self.levels(plan)
+            if counts['ready'] < low:
+                tasks.extend(self._provision(plan) for _ in range(high - counts['ready'] - counts['creating']))
+        if not tasks:
+            return 0
+        made = sum(await asyncio.gather(*tasks))
+        if made:
+            logger.info("Warm pool: %s accounts ready", made)
+        return made
+
+    async def _provision(self, plan):
+        try:
+            node = self.panels.choose()
+        except BlitzAPIError:
+            return False
+        username, password = f"warm_{plan}_{secrets.token_hex(6)}", generate_password()
+        account_id = await self.db.add_warm_account(plan, node, username, password, time.time())
+        return await self._create(account_id, plan, node, username, password)
+
+    async def _create(self, account_id, plan, node, username, password):
+        """Create the account on its node, fetch its key and mark it ready."""
+        self._inflight.add(account_id)
+        try:
+            async with self._semaphore:
+                details = self.plans.get(plan)
+                if details is None:
+                    # The plan was removed from the configuration
+                    await self.db.discard_warm_account(account_id)
+                    return False
+                client = self.panels.client(node)
+                try:
+                    await client.create_user(
+                        username=username,
+                        password=password,
+                        traffic_limit=details['traffic_gb'] or 0,
+                        expiration_days=details['expiration_days'] + math.ceil(self.max_age / 86400),
+                        unlimited=details['device_limit'] is None,
+                        note=f"Warm pool - Plan: {plan}"
+                    )
+                except UserAlreadyExistsError:
+                    logger.info("Warm account %s was created by an earlier attempt", username)
+                uri = await client.get_user_uri(username)
+                if not uri.get('ipv4'):
+                    raise BlitzAPIError(f"Key of {username} is not ready yet")
+                await self.db.mark_warm_account_ready(account_id, uri['ipv4'])
+                self.stats['created'] += 1
+                return True
+        except Exception as e:
+            self.stats['failed'] += 1
+            if is_transient(e):
+                if await self.db.fail_warm_account(account_id, self.max_attempts):
+                    logger.error("Warm account %s given up after %s attempts: %s", username, self.max_attempts, e)
+                else:
+                    logger.warning("Warm account %s not ready, will retry: %s", username, e)
+            else:
+                logger.error("Warm account %s failed: %s", username, e)
+                await self.db.discard_warm_account(account_id)
+            return False
+        finally:
+            self._inflight.discard(account_id)
+
+    async def _remove(self, account_id, node, username):
+        """Delete a discarded account from its node, then drop its row. Returns False (nothing made ready)."""
+        self._inflight.add(account_id)
+        try:
+            async with self._semaphore:
+                try:
+                    client = self.panels.client(node)
+                except BlitzAPIError:
+                    logger.warning("Node %s of warm account %s is no longer configured", node, username)
+                else:
+                    await client.delete_user(username)
+                await self.db.delete_warm_account(account_id)
+                self.stats['removed'] += 1
+        except Exception as e:
+            # Kept for the next round
+            logger.warning("Warm account %s not removed from the panel yet: %s", username, e)
+        finally:
+            self._inflight.discard(account_id)
+        return False
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await self.refill()
+            except Exception:
+                logger.exception("Warm pool refill failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()